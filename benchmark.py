@@ -0,0 +1,516 @@
+"""Micro-benchmarks for the scrapers.
+
+Run from this directory:
+
+	python benchmark.py actions unescape concat imports
+
+No database is needed: importing us_bills no longer connects to one, and none
+of the benchmarks resolves names. Bill action lines and pages are taken from the
+THOMAS pages in the mirror (util.mirror, ../mirror by default), if any, and
+otherwise from a small built-in sample of real action lines. To time whole
+scraper runs against a fixed corpus of pages, see benchmark_corpus.py."""
+
+import sys, os, re, time, subprocess, tempfile, shutil
+
+import us_bills, util
+
+def best_time(func, repeat=5):
+	"""Returns the fastest of repeat runs of func, in seconds."""
+	best = None
+	for i in xrange(repeat):
+		start = time.time()
+		func()
+		elapsed = time.time() - start
+		if best == None or elapsed < best:
+			best = elapsed
+	return best
+
+def peak_rss(func):
+	"""Returns the peak resident set size of a child process that runs func, in
+	KB on Linux (bytes on OS X). The child starts as a copy of this process, so
+	the sizes of different funcs can be compared with each other."""
+	pid = os.fork()
+	if pid == 0:
+		try:
+			func()
+		finally:
+			os._exit(0)
+	return os.wait4(pid, 0)[2].ru_maxrss
+
+def report(label, count, unit, before, after, rss=None):
+	print "%s:" % label
+	print "  baseline     %8.1f usec/%s" % (before / count * 1e6, unit)
+	print "  current      %8.1f usec/%s" % (after / count * 1e6, unit)
+	print "  speedup      %8.2fx" % (before / after)
+	if rss != None:
+		print "  peak RSS     %8d -> %d KB" % rss
+
+def mirrored_pages(host="thomas.loc.gov", limit=None):
+	"""Yields the content of text pages in the mirror for host."""
+	count = 0
+	for h, key in util.mirror.keys():
+		if h != host:
+			continue
+		content, mtime = util.read_mirror_record(*util.mirror.get(h, key))
+		if type(content) != unicode:
+			continue
+		yield content
+		count += 1
+		if limit != None and count >= limit:
+			return
+
+sample_action_lines = [
+	"Referred to the House Committee on Appropriations.",
+	"Referred to the Subcommittee on Health.",
+	"Referred to the Committee on Energy and Commerce, and in addition to the Committees on Education and the Workforce, Ways and Means, and the Budget, for a period to be subsequently determined by the Speaker, in each case for consideration of such provisions as fall within the jurisdiction of the committee concerned.",
+	"Read twice and referred to the Committee on Finance.",
+	"Received in the Senate and referred to the Committee on Homeland Security and Governmental Affairs.",
+	"Received in the Senate. Read the first time. Placed on Senate Legislative Calendar under Read the First Time.",
+	"Read the second time. Placed on Senate Legislative Calendar under General Orders. Calendar No. 4.",
+	"Placed on the Union Calendar, Calendar No. 4.",
+	"Placed on the House Calendar, Calendar No. 12.",
+	"Committee Consideration and Mark-up Session Held.",
+	"Ordered to be Reported (Amended) by the Yeas and Nays: 30 - 19.",
+	"Ordered to be Reported by Voice Vote.",
+	"Committee Agreed to Seek Consideration Under Suspension of the Rules, (Amended) by Voice Vote.",
+	"Reported (Amended) by the Committee on Ways and Means. H. Rept. 112-9, Part I.",
+	"Committee on Finance. Reported by Senator Baucus with an amendment in the nature of a substitute. With written report No. 112-12.",
+	"Committee on Homeland Security and Governmental Affairs. Discharged by Unanimous Consent.",
+	"Rules Committee Resolution H. Res. 92 Reported to House. Rule provides for consideration of H.R. 1 with 1 hour of general debate.",
+	"Rule H. Res. 92 passed House.",
+	"Considered under the provisions of rule H. Res. 92.",
+	"The House proceeded with one hour of debate on H.R. 1.",
+	"Mr. Rogers (KY) moved to suspend the rules and pass the bill, as amended.",
+	"DEBATE - The House proceeded with forty minutes of debate on H.R. 2.",
+	"At the conclusion of debate, the Yeas and Nays were demanded and ordered. Pursuant to the provisions of clause 8, rule XX, the Chair announced that further proceedings on the motion would be postponed.",
+	"On passage Passed by recorded vote: 235 - 189 (Roll no. 147).",
+	"On passage Passed by the Yeas and Nays: 245 - 189 (Roll no. 14).",
+	"On passage Passed by voice vote.",
+	"On motion to suspend the rules and pass the bill, as amended Agreed to by the Yeas and Nays: (2/3 required): 406 - 3 (Roll no. 123).",
+	"On motion to suspend the rules and pass the bill Failed by the Yeas and Nays: (2/3 required): 242 - 178 (Roll no. 117).",
+	"On motion to suspend the rules and agree to the resolution Agreed to by voice vote.",
+	"On agreeing to the resolution Agreed to by recorded vote: 241 - 187 (Roll no. 85).",
+	"On agreeing to the conference report Agreed to by the Yeas and Nays: 357 - 66 (Roll no. 311).",
+	"On motion that the House agree to the Senate amendment Agreed to by the Yeas and Nays: 260 - 167 (Roll no. 268).",
+	"On motion that the House suspend the rules and concur in the Senate amendment Agreed to without objection.",
+	"Motion to reconsider laid on the table Agreed to without objection.",
+	"Passed Senate without amendment by Unanimous Consent.",
+	"Passed Senate with an amendment by Yea-Nay Vote. 81 - 19. Record Vote Number: 61.",
+	"Passed Senate with amendments by Voice Vote.",
+	"Failed of passage in Senate by Yea-Nay Vote. 47 - 51. Record Vote Number: 9.",
+	"Resolution agreed to in Senate without amendment and with a preamble by Unanimous Consent.",
+	"Cloture on the motion to proceed to the bill not invoked in Senate by Yea-Nay Vote. 44 - 56. Record Vote Number: 36.",
+	"Cloture on the bill invoked in Senate by Yea-Nay Vote. 60 - 39. Record Vote Number: 395.",
+	"Senate agreed to conference report by Yea-Nay Vote. 86 - 13. Record Vote Number: 292.",
+	"Senate concurred in the House amendment by Unanimous Consent.",
+	"Motion to proceed to consideration of measure made in Senate.",
+	"Measure laid before Senate by unanimous consent.",
+	"Message on Senate action sent to the House.",
+	"Cleared for White House.",
+	"Presented to President.",
+	"Signed by President.",
+	"Vetoed by President.",
+	"Pocket Vetoed by President.",
+	"Became Public Law No: 112-10.",
+	"Sponsor introductory remarks on measure.",
+	"Submitted in the Senate. (consideration: CR S334-335; text as passed Senate: CR S334)",
+	"Conference held.",
+	"Passed House pursuant to H. Res. 5.",
+	"Conferees agreed to file conference report.",
+	"H.AMDT.12 Amendment (A001) offered by Mr. Rogers.",
+	]
+
+def load_action_lines(limit=20000):
+	"""Returns bill action lines, as parse_bill_status_page passes them to
+	parse_bill_action, from mirrored THOMAS pages or the built-in sample."""
+	lines = []
+	for content in mirrored_pages():
+		for line in content.split("\n"):
+			m = us_bills.status_action_re.search(line)
+			if m == None:
+				continue
+			text = us_bills.action_link_re.sub("", m.group(2))
+			m = us_bills.action_references_re.search(text)
+			if m:
+				text = text[0:m.start()] + text[m.end():]
+			lines.append(text)
+			if len(lines) >= limit:
+				return lines
+	if len(lines) == 0:
+		lines = sample_action_lines
+	return lines
+
+def baseline_parse_bill_action(line, bill_type, prev_state, title):
+	"""parse_bill_action as it was before its patterns were precompiled, for comparison."""
+
+	attrs = { }
+
+	m = re.match("r^(H|S)\.Amdt\.(\d+)", line, re.I)
+	if m != None:
+		attrs["amendment"] = m.group(1).lower() + m.group(2)
+	else:
+			line = re.sub(", the Passed", ", Passed", line);
+			m = re.search(r"(On passage|On motion to suspend the rules and pass the bill|On motion to suspend the rules and agree to the resolution|On motion to suspend the rules and pass the resolution|On agreeing to the resolution|On agreeing to the conference report|Two-thirds of the Members present having voted in the affirmative the bill is passed,?|On motion that the House agree to the Senate amendments?|On motion that the House suspend the rules and concur in the Senate amendments?|On motion that the House suspend the rules and agree to the Senate amendments?|On motion that the House agree with an amendment to the Senate amendments?|House Agreed to Senate Amendments.*?|Passed House)(, the objections of the President to the contrary notwithstanding.?)?(, as amended| \(Amended\))? (Passed|Failed|Agreed to|Rejected)? ?(by voice vote|without objection|by (the Yeas and Nays|Yea-Nay Vote|recorded vote)((:)? \(2/3 required\))?: \d+ - \d+(, \d+ Present)? [ \)]*\((Roll no\.|Record Vote No:) \d+\))", line, re.I)
+			if m != None:
+				motion, isoverride, asamended, passfail, how = m.group(1), m.group(2), m.group(3), m.group(4), m.group(5)
+				if re.search(r"Passed House|House Agreed to", motion, re.I):
+					passfail = 'pass'
+				elif re.search(r"Pass|Agreed", passfail, re.I):
+					passfail = 'pass'
+				else:
+					passfail = 'fail'
+				if "Two-thirds of the Members present" in motion:
+					isoverride = True
+				if isoverride:
+					votetype = "override"
+				elif re.search(r"(agree (with an amendment )?to|concur in) the Senate amendment", line, re.I):
+					votetype = "pingpong"
+				elif re.search("conference report", line, re.I):
+					votetype = "conference"
+				elif bill_type[0] == "h":
+					votetype = "vote"
+				else:
+					votetype = "vote2"
+				roll = None
+				m = re.search(r"\((Roll no\.|Record Vote No:) (\d+)\)", how, re.I)
+				if m != None:
+					roll = m.group(2)
+				suspension = None
+				if roll and "On motion to suspend the rules" in motion:
+					suspension = True
+				attrs["nodename"] = "vote"
+				attrs["votetype"] = votetype
+				attrs["how"] = how
+				if roll:
+					attrs["roll"] = roll
+				new_state = us_bills.get_vote_resulting_state(votetype, "h", passfail=="pass", bill_type, suspension, asamended, title, prev_state)
+				if new_state:
+					attrs["state"] = new_state
+			m = re.search(r"Passed House pursuant to", line, re.I)
+			if m != None:
+				votetype = "vote" if (bill_type[0] == "h") else "vote2"
+				attrs["nodename"] = "vote"
+				attrs["votetype"] = votetype
+				attrs["how"] = "by special rule"
+				new_state = us_bills.get_vote_resulting_state(votetype, "h", passfail=="pass", bill_type, False, False, title, prev_state)
+				if new_state:
+					attrs["state"] = new_state
+			m = re.search(r"(Passed Senate|Failed of passage in Senate|Resolution agreed to in Senate|Received in the Senate, considered, and agreed to|Submitted in the Senate, considered, and agreed to|Introduced in the Senate, read twice, considered, read the third time, and passed|Received in the Senate, read twice, considered, read the third time, and passed|Senate agreed to conference report|Cloture \S*\s?on the motion to proceed .*?not invoked in Senate|Cloture on the bill not invoked in Senate|Cloture on the bill invoked in Senate|Cloture on the motion to proceed to the bill invoked in Senate|Cloture on the motion to proceed to the bill not invoked in Senate|Senate agreed to House amendment|Senate concurred in the House amendment)(,?.*,?) (without objection|by Unanimous Consent|by Voice Vote|by Yea-Nay( Vote)?\. \d+\s*-\s*\d+\. Record Vote (No|Number): \d+)", line, re.I)
+			if m != None:
+				motion, extra, how = m.group(1), m.group(2), m.group(3)
+				roll = None
+				if re.search("passed|agreed|concurred|bill invoked", motion, re.I):
+					passfail = "pass"
+				else:
+					passfail = "fail"
+				votenodename = "vote"
+				if re.search("over veto", extra, re.I):
+					votetype = "override"
+				elif re.search("conference report", motion, re.I):
+					votetype = "conference"
+				elif re.search("cloture", motion, re.I):
+					votetype = "cloture"
+					votenodename = "vote-aux"
+				elif re.search("Senate agreed to House amendment|Senate concurred in the House amendment", motion, re.I):
+					votetype = "pingpong"
+				elif bill_type[0] == "s":
+					votetype = "vote"
+				else:
+					votetype = "vote2"
+				m = re.search(r"Record Vote (No|Number): (\d+)", how, re.I)
+				if m != None:
+					roll = m.group(2)
+					how = "roll"
+				asamended = False
+				if re.search(r"with amendments|with an amendment", extra, re.I):
+					asamended = True
+				attrs["nodename"] = votenodename
+				attrs["votetype"] = votetype
+				attrs["how"] = how
+				if roll:
+					attrs["roll"] = roll
+				new_state = us_bills.get_vote_resulting_state(votetype, "s", passfail=="pass", bill_type, False, asamended, title, prev_state)
+				if new_state:
+					attrs["state"] = new_state
+			m = re.search(r"Placed on (the )?([\w ]+) Calendar( under ([\w ]+))?[,\.] Calendar No\. (\d+)\.|Committee Agreed to Seek Consideration Under Suspension of the Rules|Ordered to be Reported", line, re.I)
+			if m != None:
+				if prev_state in ("INTRODUCED", "REFERRED"):
+					attrs["state"] = "REPORTED"
+				attrs["nodename"] = "calendar"
+				attrs["calendar"] = m.group(2)
+				attrs["under"] = m.group(4)
+				attrs["number"] = m.group(5)
+			m = re.search(r"Committee on (.*)\. Reported by", line, re.I)
+			if m != None:
+				attrs["nodename"] = "reported"
+				attrs["committee"] = m.group(1)
+				if prev_state in ("INTRODUCED", "REFERRED"):
+					attrs["state"] = "REPORTED"
+			m = re.search(r"Committee on (.*)\. Discharged (by Unanimous Consent)?", line, re.I)
+			if m != None:
+				attrs["committee"] = m.group(1)
+				attrs["nodename"] = "discharged"
+				if prev_state in ("INTRODUCED", "REFERRED"):
+					attrs["state"] = "REPORTED"
+			m = re.search("Cleared for White House|Presented to President", line, re.I)
+			if m != None:
+				attrs["nodename"] = "topresident"
+			m = re.search("Signed by President", line, re.I)
+			if m != None:
+				attrs["nodename"] = "signed"
+			m = re.search("Pocket Vetoed by President", line, re.I)
+			if m != None:
+				attrs["nodename"] = "vetoed"
+				attrs["pocket"] = "1"
+				attrs["state"] = "VETOED:POCKET"
+			m = re.search("Vetoed by President", line, re.I)
+			if m != None:
+				attrs["nodename"] = "vetod"
+				attrs["state"] = "PROV_KILL:VETO'"
+			m = re.search("Became (Public|Private) Law No: ([\d\-]+)\.", line, re.I)
+			if m != None:
+				attrs["nodename"] = "enacted"
+				if prev_state != "PROV_KILL:VETO" and not prev_state.startswith("VETOED:"):
+					attrs["state"] = "ENACTED:SIGNED"
+				else:
+					attrs["state"] = "ENACTED:VETO_OVERRIDE"
+			m = re.search(r"Referred to (the )?((House|Senate|Committee) [^\.]+).?", line, re.I)
+			if m != None:
+				attrs["nodename"] = "referral"
+				attrs["committee"] = m.group(2)
+				if prev_state == "INTRODUCED":
+					attrs["state"] = "REFERRED"
+			m = re.search(r"Referred to the Subcommittee on (.*[^\.]).?", line, re.I)
+			if m != None:
+				attrs["nodename"] = "referral"
+				attrs["subcommittee"] = m.group(1)
+				if prev_state == "INTRODUCED":
+					attrs["state"] = "REFERRED"
+			m = re.search(r"Received in the Senate and referred to (the )?(.*[^\.]).?", line, re.I)
+			if m != None:
+				attrs["nodename"] = "referral"
+				attrs["committee"] = m.group(2)
+	return attrs
+
+def bench_actions():
+	lines = load_action_lines()
+	cases = [(line, bill_type, prev_state) for line in lines for bill_type in ("h", "s") for prev_state in ("INTRODUCED", "PASS_OVER:HOUSE")]
+	title = "Making appropriations for the fiscal year"
+
+	def run(parse):
+		results = []
+		for line, bill_type, prev_state in cases:
+			try:
+				results.append(parse(line, bill_type, prev_state, title))
+			except Exception as e:
+				results.append(type(e))
+		return results
+
+	# Both versions must classify every line the same way, except where the
+	# baseline failed: it raised on "Passed House pursuant to" lines.
+	mismatches = [case for case, a, b in zip(cases, run(baseline_parse_bill_action), run(us_bills.parse_bill_action)) if a != b and not isinstance(a, type)]
+	for case in mismatches[:10]:
+		print "MISMATCH:", repr(case)
+
+	before = best_time(lambda : run(baseline_parse_bill_action))
+	after = best_time(lambda : run(us_bills.parse_bill_action))
+	report("parse_bill_action on %d calls (%d distinct action lines)" % (len(cases), len(set(lines))), len(cases), "call", before, after)
+	return len(mismatches) == 0
+
+def load_escaped_pages(limit=2000):
+	"""Returns pages with entity references in them as THOMAS serves them, made by
+	turning the non-ASCII characters in mirrored pages back into references, or
+	built from the sample action lines if nothing is mirrored."""
+	pages = [page.encode("ascii", "xmlcharrefreplace").decode("ascii") for page in mirrored_pages(limit=limit)]
+	if len(pages) == 0:
+		page = u"\n".join([u"<dt><strong>1/5/2011:</strong><dd>%s&nbsp;&mdash; &#147;H.R. 1&#148; &amp; S. 2" % line.replace("'", "&#39;") for line in sample_action_lines])
+		pages = [page] * 50 + [u"\n".join(sample_action_lines)] * 50
+	return pages
+
+def baseline_unescape(text, charset="utf-8"):
+	"""util.unescape as it was before it used precomputed tables, for comparison."""
+	import re, htmlentitydefs
+	
+	if charset.lower() in ("iso-8859-1", "windows-1252"):
+		def decode_char(num):
+			return chr(num).decode(charset)
+	else:
+		decode_char = unichr
+	
+	def fixup(m):
+		text = m.group(0)
+		if text[:2] == "&#":
+			try:
+				if text[:3] == "&#x":
+					text = decode_char(int(text[3:-1], 16))
+				else:
+					text = decode_char(int(text[2:-1]))
+			except ValueError:
+				pass
+		else:
+			try:
+				text = unichr(htmlentitydefs.name2codepoint[text[1:-1]])
+			except KeyError:
+				pass
+		if text == "&": text = "&amp;"
+		if text == "<": text = "&lt;"
+		if text == ">": text = "&gt;"
+		if text == "\"": text = "&quot;"
+		if text == "'": text = "&apos;"
+		return text
+	return re.sub("&#?\w+;", fixup, text)
+
+def bench_unescape():
+	pages = load_escaped_pages()
+	size = sum([len(page) for page in pages])
+	entities = sum([page.count("&") for page in pages])
+
+	def run(unescape):
+		return [unescape(page, "iso-8859-1") for page in pages]
+
+	ok = run(baseline_unescape) == run(util.unescape)
+	if not ok:
+		print "MISMATCH: unescape results differ"
+
+	before = best_time(lambda : run(baseline_unescape))
+	after = best_time(lambda : run(util.unescape))
+	report("unescape on %d pages (%d KB, %d entity references)" % (len(pages), size >> 10, entities), len(pages), "page", before, after)
+	return ok
+
+def load_listing_pages(count=10):
+	"""Returns the lines of the largest mirrored THOMAS search result listings,
+	or of a synthetic listing if nothing is mirrored."""
+	pages = sorted([page for page in mirrored_pages() if "/list/bss/" in page], key=len, reverse=True)[0:count]
+	if len(pages) == 0:
+		record = u'<p><b>  %d.</b> <a href="/cgi-bin/bdquery/D?d112:%d:./list/bss/d112HR.lst::">H.R.%d </a>: To amend the Internal Revenue Code of 1986.\n<br /><b>Sponsor:</b> <a href="/cgi-bin/bdquery/?&Db=d112&querybd=@FIELD(FLD003+@4((@1(Rep+Smith++Lamar))+01075))">Rep Smith, Lamar</a> [TX-21] (introduced 1/5/2011) &nbsp;&nbsp;&nbsp;&nbsp;<b>Cosponsors</b> (%d)\n<br /><b>Committees: </b>House Ways and Means\n<br /><b>Latest Major Action:</b>  1/5/2011 Referred to House committee. Status: Referred to the House Committee on Ways and Means.\n<hr/>\n'
+		pages = [u"".join([record % (i, i, i, i % 50) for i in xrange(1, 2001)])]
+	return [page.split("\n") for page in pages]
+
+def baseline_search_records(lines):
+	"""Groups search result lines into records the way update_bills did before it
+	used list buffers, for comparison."""
+	records = []
+	rec = None
+	for line in lines:
+		hr = line.find("<hr")
+		if hr >= 0 and rec != None:
+			rec += line[0:hr]
+			records.append(rec)
+			rec = None
+		lline = line.lower()
+		m = us_bills.search_record_re.search(lline) if "</b>" in lline else None
+		if m != None:
+			if rec != None:
+				records.append(rec)
+			rec = m.group(4) + "\n"
+		elif rec != None:
+			rec += line + "\n"
+	if rec != None:
+		records.append(rec)
+	return records
+
+def search_records(pages):
+	"""Returns the text of the records us_bills.search_results finds in the
+	search results for Congress 112, with pages, a list of lists of lines, served
+	in place of THOMAS as the search results of each bill type in turn."""
+	served = { }
+	for (tbt, bt), lines in zip(us_bills.thomas_bill_type_codes, pages):
+		served["http://thomas.loc.gov/cgi-bin/bdquery/d?d112:0:./list/bss/d112%s.lst:[[o]]" % tbt] = lines
+	download = us_bills.download
+	us_bills.download = lambda url, lines=False, **kwargs : (iter(served[url]), None)
+	try:
+		return [rec for bt, bn, rec in us_bills.search_results(112)]
+	finally:
+		us_bills.download = download
+
+def baseline_parse_bill_summary_page(lines):
+	"""parse_bill_summary_page as it was before it used a list buffer, for comparison."""
+	mode = 0
+	summary = ""
+	for line in lines:
+		if mode == 1:
+			if "<hr" in line:
+				mode = 0
+			elif "THOMAS Home" in line or "id=\"footer\"" in line:
+				break
+			else:
+				line = re.sub(r"<a.*?>(.*?)</a>", lambda m : m.group(1), line, re.I)
+				summary += line + "\n"
+		elif "SUMMARY AS OF" in line:
+			mode = 1
+	summary = re.sub(r"\(There (is|are) \d+ other summar(y|ies)\)", "", summary, re.I)
+	return summary
+
+def bench_concat():
+	# Each listing is served as the only page of one bill type's search results,
+	# so links to further pages are dropped.
+	listings = [[line for line in lines if "NEXT PAGE" not in line] for lines in load_listing_pages()]
+	listings = [listings[i % len(listings)] for i in xrange(len(us_bills.thomas_bill_type_codes))]
+	baseline = lambda : [rec for lines in listings for rec in baseline_search_records(lines)]
+	current = lambda : search_records(listings)
+	ok = baseline() == current()
+	before = best_time(baseline)
+	after = best_time(current)
+	report("search_results on %d listing pages (%d lines)" % (len(listings), sum([len(lines) for lines in listings])), len(listings), "page", before, after,
+		(peak_rss(baseline), peak_rss(current)))
+
+	# The summaries of omnibus bills run to thousands of lines.
+	summary = [u"<p><b>SUMMARY AS OF:</b>", u"<hr/>", u"SUMMARY AS OF:"] \
+		+ [u"Division %d: Makes appropriations for <a href=\"/cgi-bin/bdquery/z?d112:HR1:\">H.R.1</a> programs &amp; activities." % i for i in xrange(20000)] \
+		+ [u"THOMAS Home"]
+	ok = ok and baseline_parse_bill_summary_page(summary) == us_bills.parse_bill_summary_page(summary)
+	before = best_time(lambda : baseline_parse_bill_summary_page(summary), 3)
+	after = best_time(lambda : us_bills.parse_bill_summary_page(summary), 3)
+	report("parse_bill_summary_page on a %d-line summary" % len(summary), 1, "page", before, after,
+		(peak_rss(lambda : baseline_parse_bill_summary_page(summary)), peak_rss(lambda : us_bills.parse_bill_summary_page(summary))))
+
+	if not ok:
+		print "MISMATCH: records or summaries differ"
+	return ok
+
+# Modules that importing us_bills must not load, because they are slow to import
+# and only some uses of us_bills need them.
+deferred_modules = ("sqlalchemy", "pytz", "lxml.html")
+
+def import_time(modules, repeat=5):
+	"""Returns the fastest of repeat imports of the modules, each in a new Python
+	process, in seconds, and the deferred_modules that were loaded. The
+	processes run in an empty directory, so that importing must not need
+	config.db."""
+	script = "import sys, time\nstart = time.time()\nimport %s\nprint time.time() - start\nprint ' '.join(m for m in %r if m in sys.modules)" % (", ".join(modules), deferred_modules)
+	env = dict(os.environ)
+	env["PYTHONPATH"] = os.pathsep.join([os.path.dirname(os.path.abspath(__file__))] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+	cwd = tempfile.mkdtemp()
+	try:
+		best = None
+		for i in xrange(repeat):
+			elapsed, loaded = subprocess.check_output([sys.executable, "-c", script], cwd=cwd, env=env).split("\n")[0:2]
+			if best == None or float(elapsed) < best:
+				best = float(elapsed)
+	finally:
+		shutil.rmtree(cwd)
+	return best, loaded.split()
+
+def bench_imports():
+	# The baseline is importing us_bills along with the modules it used to import
+	# eagerly.
+	before, loaded = import_time(list(deferred_modules) + ["us_bills"])
+	after, loaded = import_time(["us_bills"])
+	report("import us_bills", 1, "import", before, after)
+	if loaded:
+		print "MISMATCH: importing us_bills loaded %s" % ", ".join(loaded)
+	return not loaded
+
+benchmarks = {
+	"actions": bench_actions,
+	"imports": bench_imports,
+	"unescape": bench_unescape,
+	"concat": bench_concat,
+	}
+
+if __name__ == "__main__":
+	names = sys.argv[1:] or sorted(benchmarks)
+	ok = True
+	for name in names:
+		ok = benchmarks[name]() and ok
+	sys.exit(0 if ok else 1)
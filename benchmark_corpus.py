@@ -0,0 +1,317 @@
+"""A benchmark of the scrapers against a recorded corpus of THOMAS pages, run
+entirely offline.
+
+To record a corpus, run from this directory, with config.db and
+../data/us/committees.xml in place as for the scrapers themselves:
+
+	python benchmark_corpus.py record ../corpus 112 --bills 200
+
+This copies the search result pages of the 112th Congress and all of the pages
+of 200 of its bills, spread evenly over the search results, from the mirror
+(downloading any pages not mirrored yet). It also copies the people database
+and committees.xml. To time the scrapers against the corpus:
+
+	python benchmark_corpus.py run ../corpus --output results.json
+
+Without a corpus, run uses tests/benchmark/smoke-corpus, a synthetic fixture of
+hand-written stand-ins for the pages of three bills and a made-up people table.
+It only checks that the benchmark runs; its times mean nothing. Corpora made by
+record have a "recorded" date in their corpus.json, and run warns about any
+that doesn't.
+
+The run takes place in a temporary workspace with a SQLite copy of the people
+database. Only the corpus is read, and no requests are made to the network.
+update_bills, parse_bill, parse_bill_action and names.parse_name are timed, and
+the results are written as JSON. To compare the results of two runs, e.g. of
+two releases:
+
+	python benchmark_corpus.py compare old.json new.json
+
+This exits with an error status if anything got more than 10% slower."""
+
+import sys, os, os.path, json, time, datetime, shutil, tempfile, sqlite3, platform, argparse
+
+import util, mirror
+
+# The corpus that run uses if none is given.
+default_corpus = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tests", "benchmark", "smoke-corpus")
+
+# us_bills and names are imported only once the current directory is set up,
+# because names reads config.db from the current directory when it first
+# connects to the database.
+
+class RecordingMirror(object):
+	"""Reads and writes records in the source backend, copying every record
+	that is read or written to the dest backend."""
+
+	def __init__(self, source, dest):
+		self.source = source
+		self.dest = dest
+
+	def get(self, host, key):
+		record = self.source.get(host, key)
+		if record != None:
+			self.dest.put(host, key, record[0], record[1])
+		return record
+
+	def put(self, host, key, data, mtime):
+		self.source.put(host, key, data, mtime)
+		self.dest.put(host, key, data, mtime)
+
+	def get_meta(self, host, key):
+		return self.source.get_meta(host, key)
+
+	def put_meta(self, host, key, meta):
+		self.source.put_meta(host, key, meta)
+
+class OfflineMirror(object):
+	"""Serves the records in a corpus, raising an error for any other page
+	rather than letting it be downloaded. Nothing is written."""
+
+	def __init__(self, store):
+		self.store = store
+
+	def get(self, host, key):
+		record = self.store.get(host, key)
+		if record == None:
+			raise IOError("Page is not in the benchmark corpus: %s/%s" % (host, key))
+		return record
+
+	def put(self, host, key, data, mtime):
+		pass
+
+	def get_meta(self, host, key):
+		return { }
+
+	def put_meta(self, host, key, meta):
+		pass
+
+def record(corpus, congresses, bills_per_congress=None):
+	"""Records a corpus of the search results and bill pages of each of the
+	Congresses, with at most bills_per_congress bills from each."""
+	import us_bills, names
+
+	mirror.makedirs(corpus)
+	store = mirror.FileMirror(os.path.join(corpus, "mirror"))
+	util.set_mirror(RecordingMirror(util.mirror, store))
+
+	manifest = { "recorded": datetime.datetime.now().isoformat(), "congresses": { } }
+	for congress in congresses:
+		# Amendments aren't parsed, so only bills are recorded.
+		listed = [(bt, bn) for bt, bn, recordtext in us_bills.search_results(congress)]
+		bills = [(bt, bn) for bt, bn in listed if bt not in ("hz", "sp")]
+		if bills_per_congress != None and len(bills) > bills_per_congress:
+			step = len(bills) / float(bills_per_congress)
+			bills = [bills[int(i * step)] for i in xrange(bills_per_congress)]
+
+		recorded = []
+		for bt, bn in bills:
+			try:
+				for name, suffix, description in us_bills.bill_pages:
+					util.download(us_bills.bill_page_url(congress, bt, bn, suffix))
+			except Exception as e:
+				util.warn("Not recording %d %s %d: %s" % (congress, bt, bn, unicode(e)))
+				continue
+			recorded.append((bt, bn))
+
+		manifest["congresses"][str(congress)] = {
+			"bills": recorded,
+			"skip": sorted(set(bt + str(bn) for bt, bn in listed) - set(bt + str(bn) for bt, bn in recorded)),
+			}
+		print "Congress %d: %d bills recorded of %d listed." % (congress, len(recorded), len(listed))
+
+	# Copy the people database, which parse_name queries.
+	from sqlalchemy.sql import select
+	connection = names.get_engine().connect()
+	try:
+		persons = [dict((k, row[k]) for k in names.people.c.keys()) for row in connection.execute(select([names.people]))]
+		roles = [[row[0], row[1], isodate(row[2]), isodate(row[3]), row[4], row[5]] for row in connection.execute(select([
+			names.people_roles.c.personid, names.people_roles.c.type, names.people_roles.c.startdate,
+			names.people_roles.c.enddate, names.people_roles.c.state, names.people_roles.c.district]))]
+	finally:
+		connection.close()
+	with open(os.path.join(corpus, "people.json"), "w") as f:
+		json.dump({ "people": persons, "people_roles": roles }, f)
+
+	if os.path.exists("../data/us/committees.xml"):
+		shutil.copy("../data/us/committees.xml", os.path.join(corpus, "committees.xml"))
+
+	with open(os.path.join(corpus, "corpus.json"), "w") as f:
+		json.dump(manifest, f, indent=1, sort_keys=True)
+
+def isodate(d):
+	return d.isoformat() if d != None and not isinstance(d, basestring) else d
+
+def make_workspace(corpus):
+	"""Creates a temporary directory laid out as the scrapers expect, with
+	the scrapers' directory, scraper, next to data/us, and returns it."""
+	workspace = tempfile.mkdtemp(prefix="benchmark-")
+	os.makedirs(os.path.join(workspace, "scraper"))
+	os.makedirs(os.path.join(workspace, "data", "us"))
+	if os.path.exists(os.path.join(corpus, "committees.xml")):
+		shutil.copy(os.path.join(corpus, "committees.xml"), os.path.join(workspace, "data", "us", "committees.xml"))
+
+	with open(os.path.join(corpus, "people.json"), "r") as f:
+		make_people_database(workspace, json.load(f))
+	return workspace
+
+def make_people_database(workspace, dump):
+	"""Creates a SQLite people database in the workspace from dump, in the form
+	of a corpus's people.json, and points the workspace's config.db at it."""
+	db = os.path.join(workspace, "people.sqlite")
+	conn = sqlite3.connect(db)
+	# Compare the role type and state without regard to case, as MySQL does.
+	conn.execute("CREATE TABLE people (id INTEGER PRIMARY KEY, firstname TEXT, middlename TEXT, nickname TEXT, lastname TEXT, lastnameenc TEXT, namemod TEXT)")
+	conn.execute("CREATE TABLE people_roles (personroleid INTEGER PRIMARY KEY, personid INTEGER, type TEXT COLLATE NOCASE, startdate DATE, enddate DATE, state TEXT COLLATE NOCASE, district INTEGER)")
+	columns = ["id", "firstname", "middlename", "nickname", "lastname", "lastnameenc", "namemod"]
+	conn.executemany("INSERT INTO people VALUES (?, ?, ?, ?, ?, ?, ?)", [[person.get(c) for c in columns] for person in dump["people"]])
+	conn.executemany("INSERT INTO people_roles (personid, type, startdate, enddate, state, district) VALUES (?, ?, ?, ?, ?, ?)", dump["people_roles"])
+	conn.commit()
+	conn.close()
+	with open(os.path.join(workspace, "scraper", "config.db"), "w") as f:
+		f.write("sqlite:///" + db)
+
+def timed(func, calls, repeat):
+	"""Returns the result entry for the fastest of repeat runs of func, which
+	makes the given number of calls."""
+	best = None
+	for i in xrange(repeat):
+		start = time.time()
+		func()
+		elapsed = time.time() - start
+		if best == None or elapsed < best:
+			best = elapsed
+	return { "calls": calls, "seconds": best, "usec_per_call": best / calls * 1e6 if calls > 0 else None }
+
+def run(corpus, repeat=3, workers=1):
+	"""Times the scrapers against the corpus in a temporary workspace, and
+	returns the results."""
+	corpus = os.path.abspath(corpus)
+	with open(os.path.join(corpus, "corpus.json"), "r") as f:
+		manifest = json.load(f)
+	congresses = sorted(int(c) for c in manifest["congresses"])
+	bills = [(congress, bt, bn) for congress in congresses for bt, bn in manifest["congresses"][str(congress)]["bills"]]
+	if manifest.get("recorded") == None:
+		util.warn("%s was not recorded from THOMAS, so these times are not meaningful." % corpus)
+
+	workspace = make_workspace(corpus)
+	cwd = os.getcwd()
+	os.chdir(os.path.join(workspace, "scraper"))
+	try:
+		import us_bills, names
+		util.mirror_ttl = None
+		util.set_mirror(OfflineMirror(mirror.FileMirror(os.path.join(corpus, "mirror"))))
+
+		def update_all(force_update):
+			for congress in congresses:
+				us_bills.update_bills(congress, force_update, workers=workers, skip=set(manifest["congresses"][str(congress)]["skip"]))
+
+		# Parse every bill once, capturing the calls made to parse_bill_action and
+		# parse_name so that they can be timed on their own.
+		action_calls, name_calls = [], []
+		parse_bill_action, parse_name, parse_names = us_bills.parse_bill_action, us_bills.parse_name, us_bills.parse_names
+		def capture_action(*args):
+			action_calls.append(args)
+			return parse_bill_action(*args)
+		def capture_name(name, pubdate, **kwargs):
+			name_calls.append((name, pubdate, kwargs))
+			return parse_name(name, pubdate, **kwargs)
+		def capture_names(batch, nameformat="firstlast"):
+			for name, pubdate, role_type, state, district in batch:
+				name_calls.append((name, pubdate, { "nameformat": nameformat, "role_type": role_type, "state": state, "district": district }))
+			return parse_names(batch, nameformat)
+		us_bills.parse_bill_action, us_bills.parse_name, us_bills.parse_names = capture_action, capture_name, capture_names
+		try:
+			for congress, bt, bn in bills:
+				us_bills.parse_bill(congress, bt, bn)
+		finally:
+			us_bills.parse_bill_action, us_bills.parse_name, us_bills.parse_names = parse_bill_action, parse_name, parse_names
+
+		def parse_all():
+			for congress, bt, bn in bills:
+				us_bills.parse_bill(congress, bt, bn)
+		def parse_actions():
+			for args in action_calls:
+				us_bills.parse_bill_action(*args)
+		def parse_names_each():
+			for name, pubdate, kwargs in name_calls:
+				names.parse_name(name, pubdate, **kwargs)
+
+		results = {
+			"update_bills": timed(lambda : update_all(True), len(bills), repeat),
+			"update_bills_unchanged": timed(lambda : update_all(False), len(bills), repeat),
+			"parse_bill": timed(parse_all, len(bills), repeat),
+			"parse_bill_action": timed(parse_actions, len(action_calls), repeat),
+			"parse_name": timed(parse_names_each, len(name_calls), repeat),
+			}
+	finally:
+		os.chdir(cwd)
+		shutil.rmtree(workspace)
+
+	return {
+		"time": datetime.datetime.now().isoformat(),
+		"python": platform.python_version(),
+		"platform": platform.platform(),
+		"corpus": { "path": corpus, "recorded": manifest.get("recorded"), "description": manifest.get("description"), "congresses": congresses, "bills": len(bills) },
+		"repeat": repeat,
+		"workers": workers,
+		"results": results,
+		}
+
+def compare(old, new, threshold=0.1):
+	"""Prints the change in time per call of each benchmark in two sets of
+	results, and returns whether none got slower by more than threshold."""
+	ok = True
+	for name in sorted(set(old["results"]) & set(new["results"])):
+		before, after = old["results"][name]["usec_per_call"], new["results"][name]["usec_per_call"]
+		if not before or not after:
+			continue
+		flag = ""
+		if after > before * (1 + threshold):
+			flag = "  SLOWER"
+			ok = False
+		print "%-24s %10.1f -> %10.1f usec/call  %6.2fx%s" % (name, before, after, before / after, flag)
+	return ok
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Benchmarks the scrapers against a recorded corpus of THOMAS pages.")
+	commands = parser.add_subparsers(dest="command")
+
+	p = commands.add_parser("record", help="record a corpus from the mirror")
+	p.add_argument("corpus", help="the directory to record the corpus in")
+	p.add_argument("congress", type=int, nargs="+", help="the Congresses to record")
+	p.add_argument("--bills", type=int, help="the most bills to record from each Congress")
+
+	p = commands.add_parser("run", help="time the scrapers against a corpus")
+	p.add_argument("corpus", nargs="?", default=default_corpus, help="the directory of the corpus (default the synthetic tests/benchmark/smoke-corpus)")
+	p.add_argument("--output", help="the file to write the results to as JSON, instead of standard output")
+	p.add_argument("--repeat", type=int, default=3, help="take the fastest of this many runs (default 3)")
+	p.add_argument("--workers", type=int, default=1, help="worker threads for update_bills (default 1)")
+
+	p = commands.add_parser("compare", help="compare the results of two runs")
+	p.add_argument("old")
+	p.add_argument("new")
+	p.add_argument("--threshold", type=float, default=0.1, help="the slowdown to report as an error (default 0.1)")
+
+	args = parser.parse_args()
+	if args.command == "record":
+		record(args.corpus, args.congress, args.bills)
+	elif args.command == "run":
+		# The scrapers print their warnings, so keep them out of the results.
+		stdout, sys.stdout = sys.stdout, sys.stderr
+		try:
+			results = run(args.corpus, args.repeat, args.workers)
+		finally:
+			sys.stdout = stdout
+		if args.output != None:
+			with open(args.output, "w") as f:
+				json.dump(results, f, indent=1, sort_keys=True)
+		else:
+			json.dump(results, sys.stdout, indent=1, sort_keys=True)
+			print
+	else:
+		with open(args.old, "r") as f:
+			old = json.load(f)
+		with open(args.new, "r") as f:
+			new = json.load(f)
+		sys.exit(0 if compare(old, new, args.threshold) else 1)
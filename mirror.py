@@ -0,0 +1,342 @@
+"""Storage backends for the mirror of downloaded pages kept by util.download.
+
+A page is stored under the host it came from and a key (normally the base64 md5
+of its URL) as a record: a "utf8" or "binary" line followed by the page content.
+The record's modification time is kept too, and a dict of HTTP metadata about
+the page may be stored alongside it. Select a backend with util.set_mirror.
+
+To copy an existing mirror into another backend, run e.g.:
+
+	python mirror.py migrate ../mirror ../mirror-sharded sharded zlib
+
+The source may be a plain, sharded or SQLite mirror directory. The destination
+layout is files, sharded or sqlite, and its compression is none, zlib or zstd."""
+
+import os, os.path, sys, json, hashlib, zlib, threading, sqlite3
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+class FileMirror(object):
+	"""Stores each record as a file at base/host/key, the original mirror layout.
+	Keys containing slashes are stored in subdirectories."""
+
+	def __init__(self, base="../mirror"):
+		self.base = base
+
+	def path(self, host, key):
+		return os.path.join(self.base, host, key)
+
+	def get(self, host, key):
+		"""Returns the record and its modification time, or None if there is no record."""
+		path = self.path(host, key)
+		try:
+			with open(path, "rb") as f:
+				data = f.read()
+			return data, os.stat(path).st_mtime
+		except (IOError, OSError):
+			return None
+
+	def put(self, host, key, data, mtime):
+		path = self.path(host, key)
+		makedirs(os.path.dirname(path))
+		with open(path, "wb") as f:
+			f.write(data)
+		os.utime(path, (mtime, mtime))
+
+	def get_meta(self, host, key):
+		"""Returns the metadata stored for a record, or an empty dict."""
+		return read_json(self.path(host, key) + ".meta")
+
+	def put_meta(self, host, key, meta):
+		path = self.path(host, key) + ".meta"
+		makedirs(os.path.dirname(path))
+		with open(path, "w") as f:
+			json.dump(meta, f)
+
+	def keys(self):
+		"""Yields the (host, key) of every record."""
+		if not os.path.isdir(self.base):
+			return
+		for host in sorted(os.listdir(self.base)):
+			root = os.path.join(self.base, host)
+			for dirpath, dirnames, filenames in os.walk(root):
+				for fn in filenames:
+					if fn.endswith(".meta"):
+						continue
+					yield host, os.path.relpath(os.path.join(dirpath, fn), root).replace(os.sep, "/")
+
+class ShardedMirror(FileMirror):
+	"""Stores each record as a compressed file named by the hex md5 of its key, in
+	two levels of subdirectories named by the first four hex digits, so that no
+	directory holds more than a few thousand files however large the mirror gets.
+	The key is stored at the start of the record so that keys can be listed, and
+	metadata is stored uncompressed next to the record.
+
+	compression is "zlib", "zstd" (which requires the zstandard package) or None.
+	Records written with any compression can be read regardless of the setting."""
+
+	suffixes = { None: "", "zlib": ".z", "zstd": ".zst" }
+
+	def __init__(self, base="../mirror", compression="zlib", level=6):
+		if compression not in self.suffixes:
+			raise ValueError("Unknown mirror compression: " + repr(compression))
+		if compression == "zstd" and zstandard == None:
+			raise ValueError("zstd compression requires the zstandard package.")
+		self.base = base
+		self.compression = compression
+		self.level = level
+
+	def path(self, host, key, compression=None):
+		name = hashlib.md5(key.encode("utf8")).hexdigest()
+		return os.path.join(self.base, host, name[0:2], name[2:4], name + self.suffixes[compression])
+
+	def find(self, host, key):
+		"""Returns the path to the record for key and its compression, trying the
+		configured compression first, or (None, None)."""
+		for compression in [self.compression] + [c for c in self.suffixes if c != self.compression]:
+			path = self.path(host, key, compression)
+			if os.path.exists(path):
+				return path, compression
+		return None, None
+
+	def get(self, host, key):
+		path, compression = self.find(host, key)
+		if path == None:
+			return None
+		with open(path, "rb") as f:
+			data = decompress(f.read(), compression)
+		return data[data.index("\n")+1:], os.stat(path).st_mtime
+
+	def put(self, host, key, data, mtime):
+		path = self.path(host, key, self.compression)
+		makedirs(os.path.dirname(path))
+		# Write to a temporary file and rename it into place, so that a run that is
+		# interrupted doesn't leave a truncated record.
+		tmp = "%s.%d.%d.tmp" % (path, os.getpid(), threading.current_thread().ident)
+		with open(tmp, "wb") as f:
+			f.write(compress(key.encode("utf8") + "\n" + data, self.compression, self.level))
+		os.utime(tmp, (mtime, mtime))
+		os.rename(tmp, path)
+
+		# Remove any copy stored with a different compression.
+		for compression in self.suffixes:
+			if compression != self.compression and os.path.exists(self.path(host, key, compression)):
+				os.unlink(self.path(host, key, compression))
+
+	def keys(self):
+		if not os.path.isdir(self.base):
+			return
+		for host in sorted(os.listdir(self.base)):
+			for dirpath, dirnames, filenames in os.walk(os.path.join(self.base, host)):
+				for fn in filenames:
+					if fn.endswith(".meta") or fn.endswith(".tmp"):
+						continue
+					compression = [c for c in self.suffixes if c != None and fn.endswith(self.suffixes[c])]
+					compression = compression[0] if len(compression) > 0 else None
+					with open(os.path.join(dirpath, fn), "rb") as f:
+						yield host, read_key(f, compression)
+
+class SQLiteMirror(object):
+	"""Stores the records for each host in a single SQLite database file,
+	base/host.sqlite, in a table indexed by key, so that looking up a page does
+	not touch the file system and the whole mirror for a host can be copied or
+	backed up as one file. Records are compressed as in ShardedMirror. Metadata
+	is stored in the record's row, so it is kept only for records that exist.
+
+	Each record is committed as it is stored, with a rollback journal rather than
+	a write-ahead log, so that committed records are always in host.sqlite itself
+	and a copy of it is complete even while a scrape is running (a copy taken in
+	the middle of writing a record may miss that record).
+
+	Each database has one connection, shared by all threads under a lock."""
+
+	def __init__(self, base="../mirror", compression="zlib", level=6):
+		if compression not in ShardedMirror.suffixes:
+			raise ValueError("Unknown mirror compression: " + repr(compression))
+		if compression == "zstd" and zstandard == None:
+			raise ValueError("zstd compression requires the zstandard package.")
+		self.base = base
+		self.compression = compression
+		self.level = level
+		self.databases = { }
+		self.lock = threading.RLock()
+
+	def path(self, host):
+		return os.path.join(self.base, host + ".sqlite")
+
+	def database(self, host, create=True):
+		"""Returns the connection to the database for host, opening it first if
+		needed. If create is False and there is no database yet, returns None."""
+		with self.lock:
+			db = self.databases.get(host)
+			if db != None:
+				return db
+			if not create and not os.path.exists(self.path(host)):
+				return None
+			makedirs(self.base)
+			db = sqlite3.connect(self.path(host), check_same_thread=False)
+			db.execute("PRAGMA journal_mode=TRUNCATE")
+			db.execute("PRAGMA synchronous=NORMAL")
+			db.execute("CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, data BLOB, compression TEXT, mtime REAL, meta TEXT)")
+			db.commit()
+			self.databases[host] = db
+			return db
+
+	def get(self, host, key):
+		with self.lock:
+			db = self.database(host, create=False)
+			if db == None:
+				return None
+			row = db.execute("SELECT data, compression, mtime FROM pages WHERE key=?", (key,)).fetchone()
+		if row == None:
+			return None
+		return decompress(str(row[0]), row[1]), row[2]
+
+	def put(self, host, key, data, mtime):
+		data = sqlite3.Binary(compress(data, self.compression, self.level))
+		with self.lock:
+			db = self.database(host)
+			db.execute("INSERT OR REPLACE INTO pages (key, data, compression, mtime, meta) VALUES (?, ?, ?, ?, (SELECT meta FROM pages WHERE key=?))",
+				(key, data, self.compression, mtime, key))
+			db.commit()
+
+	def get_meta(self, host, key):
+		with self.lock:
+			db = self.database(host, create=False)
+			if db == None:
+				return { }
+			row = db.execute("SELECT meta FROM pages WHERE key=?", (key,)).fetchone()
+		if row == None or row[0] == None:
+			return { }
+		return json.loads(row[0])
+
+	def put_meta(self, host, key, meta):
+		with self.lock:
+			db = self.database(host)
+			db.execute("UPDATE pages SET meta=? WHERE key=?", (json.dumps(meta), key))
+			db.commit()
+
+	def keys(self):
+		if not os.path.isdir(self.base):
+			return
+		for fn in sorted(os.listdir(self.base)):
+			if not fn.endswith(".sqlite"):
+				continue
+			host = fn[0:-len(".sqlite")]
+			with self.lock:
+				keys = [row[0] for row in self.database(host).execute("SELECT key FROM pages ORDER BY key")]
+			for key in keys:
+				yield host, key
+
+	def close(self):
+		with self.lock:
+			for db in self.databases.values():
+				db.close()
+			self.databases = { }
+
+def compress(data, compression, level):
+	if compression == "zlib":
+		return zlib.compress(data, level)
+	if compression == "zstd":
+		return zstandard.ZstdCompressor(level=level).compress(data)
+	return data
+
+def decompress(data, compression):
+	if compression == "zlib":
+		return zlib.decompress(data)
+	if compression == "zstd":
+		if zstandard == None:
+			raise ValueError("Reading zstd-compressed mirror records requires the zstandard package.")
+		return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+	return data
+
+def read_key(f, compression):
+	"""Returns the key at the start of a sharded record file, decompressing only
+	as much of it as needed."""
+	if compression == "zlib":
+		d = zlib.decompressobj()
+	elif compression == "zstd":
+		d = zstandard.ZstdDecompressor().decompressobj()
+	else:
+		d = None
+	key = ""
+	while "\n" not in key:
+		chunk = f.read(4096)
+		if chunk == "":
+			break
+		key += d.decompress(chunk) if d != None else chunk
+	return key.split("\n", 1)[0]
+
+def read_json(path):
+	try:
+		with open(path, "r") as f:
+			return json.load(f)
+	except (IOError, ValueError):
+		return { }
+
+def makedirs(path):
+	try:
+		os.makedirs(path)
+	except OSError:
+		if not os.path.isdir(path):
+			raise
+
+def migrate_mirror(source, dest, verbose=False):
+	"""Copies every record and its metadata from the source backend to the dest
+	backend, and returns the number of records copied."""
+	count = 0
+	for host, key in source.keys():
+		data, mtime = source.get(host, key)
+		dest.put(host, key, data, mtime)
+		meta = source.get_meta(host, key)
+		if meta:
+			dest.put_meta(host, key, meta)
+		count += 1
+		if verbose and count % 10000 == 0:
+			print count, "records copied..."
+	return count
+
+def open_mirror(path, layout=None, compression="zlib"):
+	"""Returns a backend for the mirror directory at path with the given layout,
+	"files", "sharded" or "sqlite". If layout is None, it is guessed from the
+	existing contents of the directory."""
+	if layout == None:
+		if is_packed(path):
+			layout = "sqlite"
+		elif is_sharded(path):
+			layout = "sharded"
+		else:
+			layout = "files"
+	if layout == "files":
+		return FileMirror(path)
+	if layout == "sharded":
+		return ShardedMirror(path, compression)
+	if layout == "sqlite":
+		return SQLiteMirror(path, compression)
+	raise ValueError("Unknown mirror layout: " + repr(layout))
+
+def is_packed(path):
+	return os.path.isdir(path) and len([fn for fn in os.listdir(path) if fn.endswith(".sqlite")]) > 0
+
+def is_sharded(path):
+	if not os.path.isdir(path):
+		return False
+	for host in os.listdir(path):
+		for dirpath, dirnames, filenames in os.walk(os.path.join(path, host)):
+			for fn in filenames:
+				if not fn.endswith(".meta"):
+					return len(os.path.splitext(fn)[0]) == 32 and os.path.relpath(dirpath, os.path.join(path, host)).count(os.sep) == 1
+	return False
+
+if __name__ == "__main__":
+	if len(sys.argv) not in (4, 5, 6) or sys.argv[1] != "migrate":
+		print "Usage: python mirror.py migrate source_dir dest_dir [files|sharded|sqlite] [none|zlib|zstd]"
+		sys.exit(1)
+	layout = sys.argv[4] if len(sys.argv) > 4 else "sharded"
+	compression = sys.argv[5] if len(sys.argv) > 5 else "zlib"
+	source = open_mirror(sys.argv[2])
+	dest = open_mirror(sys.argv[3], layout, None if compression == "none" else compression)
+	print migrate_mirror(source, dest, verbose=True), "records copied."
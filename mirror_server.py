@@ -0,0 +1,194 @@
+"""An HTTP server that serves pages out of the mirror, for load testing the
+download paths (prefetching, persistent connections, rate limits, retries)
+without touching the network.
+
+It acts as an HTTP proxy: point util.http_proxy at it and every page the
+scrapers request is looked up in the mirror under the same host and key that
+util.download would use, and served with a simulated latency, bandwidth limit
+and error rate. Pages that are not in the mirror get a 404, or with --record are
+downloaded for real, saved to the mirror and then served. For example:
+
+	python mirror_server.py ../mirror --port 8080 --latency 0.8 --jitter 0.5 --bandwidth 200000 --error-rate 0.02
+
+and then, in the scraper (with a mirror that does not already have the pages,
+e.g. util.set_mirror(mirror.FileMirror("../mirror-empty"))):
+
+	util.http_proxy = "http://localhost:8080"
+
+Pages stored as text are served as UTF-8 HTML and other pages as binary, since
+the mirror does not keep the original content type. Requests that are not
+proxied (e.g. from a browser, as http://localhost:8080/path) are looked up
+under the host given by --host."""
+
+import time, random, threading, urlparse, email.utils, argparse
+import BaseHTTPServer, SocketServer
+
+import util
+from mirror import open_mirror
+
+class MirrorServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self, address, store, latency=0.0, jitter=0.0, bandwidth=None, error_rate=0.0, error_status=503, retry_after=None, drop_rate=0.0, record=False, host=None, quiet=False):
+		"""Serves the pages in store, a mirror backend, at address, a (host, port).
+		Each response is delayed by latency seconds, varied randomly by up to the
+		fraction jitter either way, and its body is sent at no more than bandwidth
+		bytes per second. A fraction error_rate of requests get an error_status
+		response (with a Retry-After header if retry_after is set), and a fraction
+		drop_rate have their connection closed without a response."""
+		BaseHTTPServer.HTTPServer.__init__(self, address, MirrorRequestHandler)
+		self.store = store
+		self.latency = latency
+		self.jitter = jitter
+		self.bandwidth = bandwidth
+		self.error_rate = error_rate
+		self.error_status = error_status
+		self.retry_after = retry_after
+		self.drop_rate = drop_rate
+		self.record = record
+		self.host = host
+		self.quiet = quiet
+		self.record_lock = threading.Lock()
+		self.stats_lock = threading.Lock()
+		self.stats = { "requests": 0, "served": 0, "not_modified": 0, "missing": 0, "recorded": 0, "errors": 0, "dropped": 0, "bytes": 0 }
+
+	def count(self, stat, n=1):
+		with self.stats_lock:
+			self.stats[stat] += n
+
+class MirrorRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	# Keep connections open between requests, as THOMAS does, so that
+	# util.persistent_connections can be tested.
+	protocol_version = "HTTP/1.1"
+
+	def do_GET(self):
+		self.respond(None)
+
+	def do_POST(self):
+		self.respond(self.rfile.read(int(self.headers.getheader("content-length", 0))))
+
+	def respond(self, data):
+		server = self.server
+		server.count("requests")
+
+		# Form the URL and mirror key the way util.download does: the key of a
+		# POST is that of the URL with the form data as the query string.
+		url = self.path
+		if not url.startswith("http://") and not url.startswith("https://"):
+			url = "http://" + (server.host if server.host != None else self.headers.getheader("host", "localhost")) + url
+		host = urlparse.urlparse(url).hostname
+		key = util.md5_base64(url + ("?" + data if data != None else ""))
+
+		if server.latency > 0:
+			time.sleep(server.latency * random.uniform(1 - server.jitter, 1 + server.jitter))
+
+		r = random.random()
+		if r < server.drop_rate:
+			server.count("dropped")
+			self.close_connection = 1
+			return
+		if r < server.drop_rate + server.error_rate:
+			server.count("errors")
+			headers = { }
+			if server.retry_after != None:
+				headers["Retry-After"] = str(server.retry_after)
+			self.send_body(server.error_status, "text/plain", "Simulated error.\n", headers)
+			return
+
+		record = server.store.get(host, key)
+		if record == None and server.record:
+			record = self.record_page(url, data, host, key)
+		if record == None:
+			server.count("missing")
+			self.send_body(404, "text/plain", "Not in the mirror: %s\n" % url)
+			return
+
+		content, mtime = record
+		format, newline, content = content.partition("\n")
+		headers = { "Last-Modified": email.utils.formatdate(mtime, usegmt=True) }
+		meta = server.store.get_meta(host, key)
+		if meta.get("etag"):
+			headers["ETag"] = meta["etag"]
+
+		since = self.headers.getheader("if-modified-since")
+		if since != None and email.utils.parsedate_tz(since) != None and int(mtime) <= email.utils.mktime_tz(email.utils.parsedate_tz(since)):
+			server.count("not_modified")
+			self.send_body(304, None, "", headers)
+			return
+
+		server.count("served")
+		server.count("bytes", len(content))
+		self.send_body(200, "text/html; charset=utf-8" if format.strip() == "utf8" else "application/octet-stream", content, headers)
+
+	def record_page(self, url, data, host, key):
+		"""Downloads a page that is not in the mirror into it, and returns its record."""
+		server = self.server
+		with server.record_lock:
+			# util.download saves to util.mirror, so make sure that is the mirror
+			# being served while downloading.
+			util.set_mirror(server.store)
+			try:
+				if data == None:
+					util.download(url, mirror_key=key, mirror_base=host)
+				else:
+					util.download(url, args=urlparse.parse_qsl(data, keep_blank_values=True), method="POST", mirror_key=key, mirror_base=host)
+			except Exception as e:
+				self.log_message("could not record %s: %s", url, e)
+				return None
+		server.count("recorded")
+		return server.store.get(host, key)
+
+	def send_body(self, status, content_type, content, headers={ }):
+		self.send_response(status)
+		if content_type != None:
+			self.send_header("Content-Type", content_type)
+		for name, value in headers.items():
+			self.send_header(name, value)
+		self.send_header("Content-Length", str(len(content)))
+		self.end_headers()
+		bandwidth = self.server.bandwidth
+		if bandwidth == None:
+			self.wfile.write(content)
+			return
+		start = time.time()
+		chunk_size = max(1024, min(65536, int(bandwidth / 10)))
+		for i in xrange(0, len(content), chunk_size):
+			self.wfile.write(content[i:i+chunk_size])
+			self.wfile.flush()
+			delay = start + (i + chunk_size) / float(bandwidth) - time.time()
+			if delay > 0:
+				time.sleep(delay)
+
+	def log_message(self, format, *args):
+		if not self.server.quiet:
+			BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+if __name__ == "__main__":
+	parser = argparse.ArgumentParser(description="Serves pages from the mirror as an HTTP proxy, with simulated latency, bandwidth and errors.")
+	parser.add_argument("mirror", nargs="?", default="../mirror", help="the mirror directory (default %(default)s)")
+	parser.add_argument("--layout", choices=("files", "sharded", "sqlite"), help="the layout of the mirror, if not the one guessed from its contents")
+	parser.add_argument("--port", type=int, default=8080, help="the port to listen on (default 8080)")
+	parser.add_argument("--bind", default="localhost", help="the address to listen on (default localhost)")
+	parser.add_argument("--latency", type=float, default=0.0, help="seconds to wait before each response (default 0)")
+	parser.add_argument("--jitter", type=float, default=0.0, help="vary the latency randomly by up to this fraction either way (default 0)")
+	parser.add_argument("--bandwidth", type=float, help="the most bytes per second to send in each response")
+	parser.add_argument("--error-rate", type=float, default=0.0, help="the fraction of requests to answer with an error (default 0)")
+	parser.add_argument("--error-status", type=int, default=503, help="the status of those errors (default 503)")
+	parser.add_argument("--retry-after", type=int, help="send a Retry-After header with errors, in seconds")
+	parser.add_argument("--drop-rate", type=float, default=0.0, help="the fraction of connections to close without a response (default 0)")
+	parser.add_argument("--record", action="store_true", help="download pages that are not in the mirror into it, instead of answering 404")
+	parser.add_argument("--host", default="thomas.loc.gov", help="the host of requests that are not proxied (default %(default)s)")
+	parser.add_argument("--quiet", action="store_true", help="do not log each request")
+	args = parser.parse_args()
+
+	server = MirrorServer((args.bind, args.port), open_mirror(args.mirror, args.layout),
+		latency=args.latency, jitter=args.jitter, bandwidth=args.bandwidth,
+		error_rate=args.error_rate, error_status=args.error_status, retry_after=args.retry_after,
+		drop_rate=args.drop_rate, record=args.record, host=args.host, quiet=args.quiet)
+	print "Serving %s on http://%s:%d/" % (args.mirror, args.bind, args.port)
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	print " ".join("%s=%d" % item for item in sorted(server.stats.items()))
@@ -1,34 +1,51 @@
-import re, unicodedata
-
-import sqlalchemy
-from sqlalchemy.sql import select, and_, or_
+import re, unicodedata, datetime, hashlib, collections, shelve, threading
 
 from util import warn
 
-engine = sqlalchemy.create_engine(open("config.db", "r").read())
-
-from sqlalchemy import Table, Column, Integer, String, Unicode, MetaData, ForeignKey
-from sqlalchemy.dialects.mysql import DATE
-
-metadata = MetaData()
-people = Table("people", metadata,
-	Column("id", Integer, primary_key=True),
-	Column("firstname", Unicode),
-	Column("middlename", Unicode),
-	Column("nickname", Unicode),
-	Column("lastname", Unicode),
-	Column("lastnameenc", Unicode),
-	Column("namemod", Unicode),
-	)
-people_roles = Table("people_roles", metadata,
-	Column("personroleidid", Integer, primary_key=True),
-	Column("personid", None, ForeignKey("people.id")),
-	Column("type", String),
-	Column("startdate", DATE),
-	Column("enddate", DATE),
-	Column("state", String),
-	Column("district", Integer),
-	)
+# The database engine and the definitions of the people and people_roles tables
+# are made by get_engine the first time the database is used, rather than when
+# this module is imported, so that tools that never query the database don't
+# need config.db or pay for importing SQLAlchemy.
+engine = None
+people = None
+people_roles = None
+engine_lock = threading.Lock()
+
+def get_engine():
+	"""Returns the SQLAlchemy engine for the database given in config.db in the
+	current directory, creating it and the table definitions on first use."""
+	global engine, people, people_roles
+	if engine != None:
+		return engine
+	with engine_lock:
+		if engine == None:
+			import sqlalchemy
+			from sqlalchemy import Table, Column, Integer, String, Unicode, MetaData, ForeignKey
+			from sqlalchemy.dialects.mysql import DATE
+			
+			metadata = MetaData()
+			people = Table("people", metadata,
+				Column("id", Integer, primary_key=True),
+				Column("firstname", Unicode),
+				Column("middlename", Unicode),
+				Column("nickname", Unicode),
+				Column("lastname", Unicode),
+				Column("lastnameenc", Unicode),
+				Column("namemod", Unicode),
+				)
+			people_roles = Table("people_roles", metadata,
+				Column("personroleidid", Integer, primary_key=True),
+				Column("personid", None, ForeignKey("people.id")),
+				Column("type", String),
+				Column("startdate", DATE),
+				Column("enddate", DATE),
+				Column("state", String),
+				Column("district", Integer),
+				)
+			
+			# Set engine last, since other threads take it to mean the tables are defined.
+			engine = sqlalchemy.create_engine(open("config.db", "r").read())
+	return engine
 
 def parse_name(name, pubdate, nameformat="firstlast", role_type=None, state=None, district=None):
 	"""Returns the person id identified by the name.
@@ -37,6 +54,89 @@ def parse_name(name, pubdate, nameformat="firstlast", role_type=None, state=None
 	global common_names
 	load_common_names()
 
+	name, firstnames, lastname, lastname_variants = split_name(name, nameformat)
+	
+	# Check for an earlier resolution of the same name that holds on this date.
+	if name_cache != None:
+		cache_key = name_cache_key(name, nameformat, role_type, state, district)
+		person = name_cache.get(cache_key, as_date(pubdate))
+		if person != None:
+			return person
+	
+	if name_cache == None:
+		rows = find_people(lastname_variants, pubdate, role_type, state, district)
+		return match_person(rows, firstnames, lastname, pubdate, role_type, state, district)
+	
+	# Read the candidates' roles on all dates, which gives both the people with a
+	# role on this date and the dates over which the same person would be found.
+	date = as_date(pubdate)
+	roles = find_people_roles(lastname_variants, role_type, state, district)
+	rows = [p for p, s, e in roles if s <= date and e >= date]
+	person = match_person(rows, firstnames, lastname, pubdate, role_type, state, district)
+	
+	startdate, enddate = stable_interval([(s, e) for p, s, e in roles], date)
+	name_cache.put(cache_key, startdate, enddate, person)
+	return person
+
+def parse_names(batch, nameformat="firstlast"):
+	"""Resolves a list of (name, pubdate, role_type, state, district) all at once,
+	as parse_name would each, but with at most one database query. Returns a list
+	holding, for each entry, the person id or the ValueError that parse_name would
+	have raised."""
+	
+	load_common_names()
+	
+	results = [None] * len(batch)
+	pending = []
+	for i, (name, pubdate, role_type, state, district) in enumerate(batch):
+		name, firstnames, lastname, lastname_variants = split_name(name, nameformat)
+		if name_cache != None:
+			person = name_cache.get(name_cache_key(name, nameformat, role_type, state, district), as_date(pubdate))
+			if person != None:
+				results[i] = person
+				continue
+		pending.append((i, name, firstnames, lastname, lastname_variants, pubdate, role_type, state, district))
+	
+	if len(pending) == 0:
+		return results
+	
+	# Use the people index, or else load the part of the database that covers
+	# these names and dates into an index of the same form.
+	if people_index != None:
+		index = people_index
+		mindate, maxdate = datetime.date.min, datetime.date.max
+	else:
+		lastname_variants = set()
+		for entry in pending:
+			lastname_variants |= entry[4]
+		mindate = min(as_date(entry[5]) for entry in pending)
+		maxdate = max(as_date(entry[5]) for entry in pending)
+		index = build_people_index(read_people_tables(lastname_variants, mindate, maxdate))
+	
+	for i, name, firstnames, lastname, lastname_variants, pubdate, role_type, state, district in pending:
+		date = as_date(pubdate)
+		roles = list(indexed_roles(index, lastname_variants, role_type, state, district))
+		rows = [p for p, role in roles if role[1] <= date and role[2] >= date]
+		try:
+			results[i] = match_person(rows, firstnames, lastname, pubdate, role_type, state, district)
+		except ValueError as e:
+			results[i] = e
+			continue
+		
+		if name_cache != None:
+			# Roles outside of the dates we loaded aren't in the index, so don't
+			# let the cached date range extend past them.
+			startdate, enddate = stable_interval([(role[1], role[2]) for p, role in roles], date)
+			name_cache.put(name_cache_key(name, nameformat, role_type, state, district),
+				max(startdate, mindate), min(enddate, maxdate), results[i])
+	
+	return results
+
+def split_name(name, nameformat):
+	"""Normalizes a name and splits it, returning the normalized name, the list
+	of first names, the last name, and the set of variants of the last name to
+	look for in the database."""
+	
 	name = normalize_extended_characters(name)
 
 	# Concatenated abbreviations should be split to match the format in the
@@ -56,33 +156,22 @@ def parse_name(name, pubdate, nameformat="firstlast", role_type=None, state=None
 		# Remove quotes around nicknames. Sometimes the trailing quote is missing?
 		firstnames[i] = re.sub(r'^"+(.*?)"*$', lambda m : m.group(1), firstnames[i])
 	
-	connection = engine.connect()
-	
 	# Filter on the last name (which has no extended characters, versus lastnameenc),
 	# with space/dash variants...
 	lastname_variants = set([lastname, lastname.replace(" ", "-"), lastname.replace("-", " ")])
-	if len(lastname_variants) == 1:
-		fltr = (people.c.lastname == lastname)
-	else:
-		fltr = people.c.lastname.in_(lastname_variants)
 	
-	# Filter on the role...
-	fltr = and_(fltr, (people.c.id == people_roles.c.personid), (people_roles.c.startdate <= pubdate), (people_roles.c.enddate >= pubdate))
-	if role_type != None:
-		fltr = and_(fltr, people_roles.c.type==role_type)
-	if state != None:
-		fltr = and_(fltr, people_roles.c.state==state)
-	if district != None:
-		fltr = and_(fltr, people_roles.c.district==district)
+	return name, firstnames, lastname, lastname_variants
+
+def match_person(rows, firstnames, lastname, pubdate, role_type, state, district):
+	"""Returns the id of the one person among the candidate rows whose first names
+	match, or raises a ValueError."""
 	
 	max_match_score = 0
 	matches = []
 	
-	s = select([people], fltr)
-	result = connection.execute(s)
-	choices = ""
-	for row in result:
-		choices += "\n" + repr(row)
+	candidates = [] # listed in the error message if there is no single match
+	for row in rows:
+		candidates.append(row)
 		
 		# Expand out the list of first, middle, etc. names into an array where each element
 		# has no spaces.
@@ -131,17 +220,298 @@ def parse_name(name, pubdate, nameformat="firstlast", role_type=None, state=None
 				elif row["id"] not in matches:
 					matches.append(row["id"])
 
-		
-	connection.close()
 	
 	if len(matches) != 1:
+		choices = "".join(["\n" + repr(row) for row in candidates])
 		if choices == "":
 			choices = " (none)"
 	
 		raise ValueError("%s matches for person %s on %s [role_type=%s, state=%s, district=%s]. Choices were:%s" % (len(matches), " ".join(firstnames) + " " + lastname, pubdate, role_type, state, district, choices))
-		
+	
 	return matches[0]
 
+def find_people(lastname_variants, pubdate, role_type, state, district):
+	"""Returns the rows of the people table for people with one of the last names
+	and a role on pubdate matching the role type, state and district (when not None)."""
+	
+	if people_index != None:
+		pubdate = as_date(pubdate)
+		return [person for person, role in indexed_roles(people_index, lastname_variants, role_type, state, district)
+			if role[1] <= pubdate and role[2] >= pubdate]
+	
+	from sqlalchemy.sql import select, and_
+	db = get_engine()
+	fltr = and_(role_filter(lastname_variants, role_type, state, district), (people_roles.c.startdate <= pubdate), (people_roles.c.enddate >= pubdate))
+	connection = db.connect()
+	try:
+		return connection.execute(select([people], fltr)).fetchall()
+	finally:
+		connection.close()
+
+def find_people_roles(lastname_variants, role_type, state, district):
+	"""Returns (person, startdate, enddate) for the roles on any date of people with
+	one of the last names matching the role type, state and district (when not
+	None), where person is their row of the people table, in one query. Roles
+	without dates are left out, since they never match a date."""
+	
+	if people_index != None:
+		return [(person, role[1], role[2]) for person, role in indexed_roles(people_index, lastname_variants, role_type, state, district)]
+	
+	from sqlalchemy.sql import select, and_
+	db = get_engine()
+	s = select([people, people_roles.c.startdate, people_roles.c.enddate],
+		and_(role_filter(lastname_variants, role_type, state, district), people_roles.c.startdate != None, people_roles.c.enddate != None))
+	connection = db.connect()
+	try:
+		return [(row, row["startdate"], row["enddate"]) for row in connection.execute(s)]
+	finally:
+		connection.close()
+
+def role_filter(lastname_variants, role_type, state, district):
+	from sqlalchemy.sql import and_
+	
+	# Filter on the last name (which has no extended characters, versus lastnameenc),
+	# with space/dash variants...
+	if len(lastname_variants) == 1:
+		fltr = (people.c.lastname == list(lastname_variants)[0])
+	else:
+		fltr = people.c.lastname.in_(lastname_variants)
+	
+	# Filter on the role...
+	fltr = and_(fltr, (people.c.id == people_roles.c.personid))
+	if role_type != None:
+		fltr = and_(fltr, people_roles.c.type==role_type)
+	if state != None:
+		fltr = and_(fltr, people_roles.c.state==state)
+	if district != None:
+		fltr = and_(fltr, people_roles.c.district==district)
+	return fltr
+
+def indexed_roles(index, lastname_variants, role_type, state, district):
+	"""Yields (person, role) from a people index for each role on any date of
+	people with one of the last names matching the role type, state and district.
+	Roles are matched as the database does: the role type and state are compared
+	without regard to case, and roles without dates are left out, since they
+	never match a date in SQL."""
+	if role_type != None:
+		role_type = role_type.lower()
+	if state != None:
+		state = state.lower()
+	if district != None:
+		district = int(district)
+	for lastname in set(n.lower() for n in lastname_variants):
+		for person, roles in index.get(lastname, []):
+			for role in roles:
+				rtype, startdate, enddate, rstate, rdistrict = role
+				if startdate == None or enddate == None:
+					continue
+				if (role_type == None or (rtype or "").lower() == role_type) \
+					and (state == None or (rstate or "").lower() == state) \
+					and (district == None or rdistrict == district):
+					yield person, role
+
+# An in-memory copy of the people and people_roles tables that find_people uses
+# instead of querying the database, once loaded by load_people_index. Maps
+# lowercased last names to lists of (person, roles) where person is a dict of
+# the columns of the people table and roles is a list of (type, startdate,
+# enddate, state, district).
+people_index = None
+people_index_fingerprint = None
+
+def load_people_index():
+	"""Loads the people and people_roles tables into memory so that name
+	resolution no longer queries the database. Call again to pick up changes
+	to the database, or call unload_people_index to go back to querying it."""
+	global people_index, people_index_fingerprint
+	
+	persons = read_people_tables()
+	index = build_people_index(persons)
+	
+	# Drop cached resolutions if the database has changed since they were made.
+	fingerprint = people_fingerprint(persons)
+	if name_cache != None:
+		name_cache.check_fingerprint(fingerprint)
+	
+	# Replace the index all at once so that concurrent lookups see either the old
+	# or the new index.
+	people_index, people_index_fingerprint = index, fingerprint
+
+def unload_people_index():
+	global people_index
+	people_index = None
+
+def build_people_index(persons):
+	index = { }
+	for person, roles in persons.values():
+		index.setdefault((person["lastname"] or "").lower(), []).append((person, roles))
+	return index
+
+def read_people_tables(lastname_variants=None, mindate=None, maxdate=None):
+	"""Returns a dict from person ids to (person, roles) where person is a dict
+	of the columns of the people table and roles is a list of (type, startdate,
+	enddate, state, district). If lastname_variants is given, only people with
+	those last names and roles overlapping mindate to maxdate are read, in one
+	query."""
+	from sqlalchemy.sql import select, and_
+	persons = { }
+	connection = get_engine().connect()
+	try:
+		if lastname_variants != None:
+			s = select([people, people_roles.c.type, people_roles.c.startdate, people_roles.c.enddate, people_roles.c.state, people_roles.c.district],
+				and_(people.c.lastname.in_(lastname_variants), people.c.id == people_roles.c.personid,
+					people_roles.c.startdate <= maxdate, people_roles.c.enddate >= mindate))
+			for row in connection.execute(s):
+				if row["id"] not in persons:
+					persons[row["id"]] = (dict((k, row[k]) for k in people.c.keys()), [])
+				persons[row["id"]][1].append((row["type"], row["startdate"], row["enddate"], row["state"], row["district"]))
+			return persons
+		
+		for row in connection.execute(select([people])):
+			persons[row["id"]] = (dict(row), [])
+		for row in connection.execute(select([people_roles.c.personid, people_roles.c.type, people_roles.c.startdate, people_roles.c.enddate, people_roles.c.state, people_roles.c.district])):
+			if row["personid"] in persons:
+				persons[row["personid"]][1].append((row["type"], row["startdate"], row["enddate"], row["state"], row["district"]))
+	finally:
+		connection.close()
+	return persons
+
+def people_fingerprint(persons):
+	"""Returns a hash of the contents of read_people_tables, to detect changes
+	to the database."""
+	m = hashlib.md5()
+	for id, (person, roles) in sorted(persons.items()):
+		m.update(repr((sorted(person.items()), sorted(roles))))
+	return m.hexdigest()
+
+class NameCache(object):
+	"""A cache of parse_name results. Entries are keyed by the normalized arguments
+	to parse_name other than the date and hold a list of (startdate, enddate, person
+	id) for ranges of dates in which no candidate's role begins or ends, so that any
+	date in a range resolves to the same person. The size most recently used keys
+	are kept in memory. If path is given, all entries are also kept in a shelve
+	database there for use by later runs."""
+	
+	def __init__(self, size, path=None):
+		self.size = size
+		self.entries = collections.OrderedDict()
+		self.store = shelve.open(path) if path != None else None
+		self.lock = threading.Lock()
+		self.fingerprint = None
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+	
+	def get(self, key, date):
+		"""Returns the cached person id for key on date, or None."""
+		with self.lock:
+			intervals = self.load(key)
+			if intervals != None:
+				for startdate, enddate, person in intervals:
+					if startdate <= date and enddate >= date:
+						self.hits += 1
+						return person
+			self.misses += 1
+			return None
+	
+	def put(self, key, startdate, enddate, person):
+		with self.lock:
+			intervals = (self.load(key) or []) + [(startdate, enddate, person)]
+			self.entries[key] = intervals
+			self.evict()
+			if self.store != None:
+				self.store[repr(key)] = intervals
+	
+	def load(self, key):
+		# Move the key to the most recently used end.
+		intervals = self.entries.pop(key, None)
+		if intervals == None and self.store != None:
+			intervals = self.store.get(repr(key))
+		if intervals != None:
+			self.entries[key] = intervals
+			self.evict()
+		return intervals
+	
+	def evict(self):
+		# Drop the least recently used keys beyond size.
+		while len(self.entries) > self.size:
+			self.entries.popitem(last=False)
+			self.evictions += 1
+	
+	def check_fingerprint(self, fingerprint):
+		"""Clears the cache if fingerprint differs from the one it was made with."""
+		with self.lock:
+			if self.fingerprint == None and self.store != None:
+				self.fingerprint = self.store.get("__fingerprint__")
+			if fingerprint == self.fingerprint:
+				return
+			self.entries.clear()
+			if self.store != None:
+				self.store.clear()
+				self.store["__fingerprint__"] = fingerprint
+			self.fingerprint = fingerprint
+	
+	def close(self):
+		with self.lock:
+			if self.store != None:
+				self.store.close()
+				self.store = None
+	
+	def stats(self):
+		return { "hits": self.hits, "misses": self.misses, "evictions": self.evictions, "size": len(self.entries) }
+
+name_cache = None
+
+def enable_name_cache(size=100000, path=None):
+	"""Turns on caching of parse_name results, keeping up to size entries in
+	memory and, if path is given, all entries in a file there that survives
+	between runs. The file is emptied if the people database has changed."""
+	global name_cache
+	disable_name_cache()
+	cache = NameCache(size, path)
+	if people_index != None:
+		cache.check_fingerprint(people_index_fingerprint)
+	else:
+		cache.check_fingerprint(people_fingerprint(read_people_tables()))
+	name_cache = cache
+
+def disable_name_cache():
+	global name_cache
+	if name_cache != None:
+		name_cache.close()
+	name_cache = None
+
+def name_cache_stats():
+	"""Returns the hit, miss and eviction counts of the name cache."""
+	if name_cache == None:
+		return None
+	return name_cache.stats()
+
+def name_cache_key(name, nameformat, role_type, state, district):
+	return (name, nameformat, role_type, state, str(district) if district != None else None)
+
+def as_date(d):
+	if isinstance(d, datetime.datetime):
+		return d.date()
+	return d
+
+def stable_interval(role_dates, date):
+	"""Returns the widest (startdate, enddate) around date in which none of the
+	(startdate, enddate) roles in role_dates begins or ends."""
+	one_day = datetime.timedelta(days=1)
+	startdate, enddate = datetime.date.min, datetime.date.max
+	for s, e in role_dates:
+		if s == None or e == None:
+			continue # never matches any date
+		if s <= date:
+			startdate = max(startdate, s)
+		else:
+			enddate = min(enddate, s - one_day)
+		if e >= date:
+			enddate = min(enddate, e)
+		else:
+			startdate = max(startdate, e + one_day)
+	return startdate, enddate
+
 def normalize_extended_characters(s):
 	"""Removes accent marks from characters by decomposing characters into
 	base and combining characters, and then removing combining characters."""
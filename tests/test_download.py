@@ -0,0 +1,130 @@
+import os, sys, time, random, shutil, tempfile, threading, urllib, email.utils, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import util, mirror, mirror_server
+
+class DownloadTest(unittest.TestCase):
+	"""Downloads pages through util.download from a mirror_server.MirrorServer
+	acting as the proxy for thomas.loc.gov."""
+
+	host = "thomas.loc.gov"
+
+	def setUp(self):
+		self.tmp = tempfile.mkdtemp()
+		self.served = mirror.FileMirror(os.path.join(self.tmp, "served"))
+		self.server = None
+		self.saved = dict((name, getattr(util, name)) for name in ("mirror", "http_proxy", "persistent_connections", "mirror_ttl", "retry_delay", "download_retries", "get_connection"))
+		util.set_mirror(mirror.FileMirror(os.path.join(self.tmp, "mirror")))
+		util.retry_delay = 0.001
+		random.seed(1)
+
+	def tearDown(self):
+		if self.server != None:
+			self.server.shutdown()
+			self.server.server_close()
+		for name, value in self.saved.items():
+			setattr(util, name, value)
+		with util.connection_pool_lock:
+			for idle in util.connection_pool.values():
+				for conn in idle:
+					conn.close()
+			util.connection_pool.clear()
+		shutil.rmtree(self.tmp)
+
+	def serve(self, **kwargs):
+		self.server = mirror_server.MirrorServer(("127.0.0.1", 0), self.served, quiet=True, **kwargs)
+		thread = threading.Thread(target=self.server.serve_forever)
+		thread.daemon = True
+		thread.start()
+		util.http_proxy = "http://127.0.0.1:%d" % self.server.server_port
+
+	def add_page(self, url, content, data=None, mtime=1300000000):
+		key = util.md5_base64(url + ("?" + data if data != None else ""))
+		self.served.put(self.host, key, "utf8\n" + content.encode("utf8"), mtime)
+		return key
+
+	def add_pages(self, count):
+		pages = { }
+		for i in xrange(count):
+			url = "http://%s/cgi-bin/bdquery/z?d112:HR%d:@@@L" % (self.host, i)
+			pages[url] = u"<p>Page %d caf\xe9</p>\n<p>%s</p>\n" % (i, "x" * (i * 100))
+			self.add_page(url, pages[url])
+		return pages
+
+	def test_concurrent_download_async(self):
+		pages = self.add_pages(24)
+		self.serve(latency=0.02)
+		futures = [(url, util.download_async(url)) for url in sorted(pages)]
+		for url, future in futures:
+			self.assertEqual(future.result()[0], pages[url])
+		self.assertEqual(self.server.stats["served"], len(pages))
+
+	def test_persistent_connections_are_reused(self):
+		pages = self.add_pages(5)
+		self.serve()
+		util.persistent_connections = True
+		reused = []
+		get_connection = util.get_connection
+		def counting_get_connection(key):
+			conn, r = get_connection(key)
+			reused.append(r)
+			return conn, r
+		util.get_connection = counting_get_connection
+		for url in sorted(pages):
+			self.assertEqual(util.download(url)[0], pages[url])
+		self.assertEqual(reused, [False] + [True] * (len(pages) - 1))
+
+	def test_post_args_mirror_key(self):
+		url = "http://%s/cgi-bin/bdquery/d" % self.host
+		args = { "Db": "d112", "querybd": "@FIELD(FLD003+@4((@1(Rep+Smith++Lamar))+01075))" }
+		key = self.add_page(url, u"<p>Results</p>\n", data=urllib.urlencode(args))
+		self.serve()
+		for persistent in (False, True):
+			util.persistent_connections = persistent
+			util.set_mirror(mirror.FileMirror(os.path.join(self.tmp, "mirror%d" % persistent)))
+			self.assertEqual(util.download(url, args=args, method="POST")[0], u"<p>Results</p>\n")
+			self.assertNotEqual(util.mirror.get(self.host, key), None)
+		self.assertEqual(self.server.stats["missing"], 0)
+
+	def test_retries_errors(self):
+		pages = self.add_pages(12)
+		self.serve(error_rate=0.5)
+		util.download_retries = 30
+		for persistent in (False, True):
+			util.persistent_connections = persistent
+			util.set_mirror(mirror.FileMirror(os.path.join(self.tmp, "mirror%d" % persistent)))
+			for url in sorted(pages):
+				self.assertEqual(util.download(url)[0], pages[url])
+		self.assertTrue(self.server.stats["errors"] > 0)
+		self.assertEqual(self.server.stats["served"], 2 * len(pages))
+
+	def test_stale_page_is_revalidated(self):
+		url = "http://%s/cgi-bin/bdquery/z?d112:HR1:@@@L" % self.host
+		key = self.add_page(url, u"<p>Served</p>\n")
+		self.serve()
+		util.mirror_ttl = 3600
+		for persistent in (False, True):
+			util.persistent_connections = persistent
+			util.mirror.put(self.host, key, "utf8\n<p>Mirrored</p>\n", 1300000000)
+			util.mirror.put_meta(self.host, key, { "last_modified": email.utils.formatdate(1300000000, usegmt=True), "fetched": time.time() - 7200 })
+			requests = self.server.stats["requests"]
+			
+			# The server answers 304 Not Modified, so the mirrored copy is used
+			# and is good for another mirror_ttl seconds.
+			self.assertEqual(util.download(url)[0], u"<p>Mirrored</p>\n")
+			self.assertEqual(self.server.stats["requests"], requests + 1)
+			self.assertTrue(time.time() - util.mirror.get_meta(self.host, key)["fetched"] < 60)
+			self.assertEqual(util.download(url)[0], u"<p>Mirrored</p>\n")
+			self.assertEqual(self.server.stats["requests"], requests + 1)
+		self.assertEqual(self.server.stats["not_modified"], 2)
+		self.assertEqual(self.server.stats["served"], 0)
+		
+		# A page modified since is downloaded again.
+		self.add_page(url, u"<p>Served</p>\n", mtime=1300000100)
+		util.mirror.put_meta(self.host, key, { "last_modified": email.utils.formatdate(1300000000, usegmt=True), "fetched": time.time() - 7200 })
+		self.assertEqual(util.download(url)[0], u"<p>Served</p>\n")
+		self.assertEqual(self.server.stats["served"], 1)
+
+if __name__ == "__main__":
+	unittest.main()
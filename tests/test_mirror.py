@@ -0,0 +1,50 @@
+import os, sys, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mirror import ShardedMirror, SQLiteMirror
+
+class ShardedMirrorTest(unittest.TestCase):
+	def setUp(self):
+		self.base = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.base)
+
+	def files(self):
+		return [fn for dirpath, dirnames, filenames in os.walk(self.base) for fn in filenames]
+
+	def test_put_leaves_only_the_record(self):
+		store = ShardedMirror(self.base)
+		store.put("thomas.loc.gov", "a/b==", "utf8\nhello", 1300000000)
+		self.assertEqual(store.get("thomas.loc.gov", "a/b=="), ("utf8\nhello", 1300000000))
+		self.assertEqual(self.files(), [os.path.basename(store.path("thomas.loc.gov", "a/b==", "zlib"))])
+
+	def test_keys_skip_partial_writes(self):
+		store = ShardedMirror(self.base)
+		store.put("thomas.loc.gov", "key", "utf8\nhello", 1300000000)
+		with open(store.path("thomas.loc.gov", "key", "zlib") + ".1.2.tmp", "wb") as f:
+			f.write("x\x9c")
+		self.assertEqual(list(store.keys()), [("thomas.loc.gov", "key")])
+
+class SQLiteMirrorTest(unittest.TestCase):
+	def setUp(self):
+		self.base = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.base)
+
+	def test_open_database_can_be_copied_alone(self):
+		store = SQLiteMirror(os.path.join(self.base, "mirror"))
+		store.put("thomas.loc.gov", "key", "utf8\nhello", 1300000000)
+		store.put_meta("thomas.loc.gov", "key", { "etag": "abc" })
+		os.mkdir(os.path.join(self.base, "copy"))
+		shutil.copy(store.path("thomas.loc.gov"), os.path.join(self.base, "copy"))
+		copy = SQLiteMirror(os.path.join(self.base, "copy"))
+		self.assertEqual(copy.get("thomas.loc.gov", "key"), ("utf8\nhello", 1300000000))
+		self.assertEqual(copy.get_meta("thomas.loc.gov", "key"), { "etag": "abc" })
+		copy.close()
+		store.close()
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,158 @@
+import os, sys, datetime, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import names
+from names import NameCache
+from workspace import Workspace
+
+def person(id, firstname, lastname, middlename=None, nickname=None):
+	return { "id": id, "firstname": firstname, "middlename": middlename, "nickname": nickname, "lastname": lastname, "lastnameenc": lastname, "namemod": "" }
+
+people = {
+	"people": [
+		person(1, "Harold", "Rogers", "Dallas", "Hal"),
+		person(2, "Adam", "Smith"),
+		person(3, "Adrian", "Smith"),
+		person(4, "Rand", "Paul"),
+		person(5, "John", "Doe"),
+		person(6, "Jane", "Roe"),
+		],
+	# personid, type, startdate, enddate, state, district
+	"people_roles": [
+		[1, "rep", "2011-01-05", "2013-01-03", "KY", 5],
+		[2, "rep", "2009-01-06", "2011-01-03", "WA", 9],
+		[2, "rep", "2011-01-05", "2013-01-03", "WA", 9],
+		[3, "rep", "2011-01-05", "2013-01-03", "NJ", 3],
+		[4, "sen", "2011-01-05", "2017-01-03", "ky", None],
+		[5, "rep", None, "2013-01-03", "TX", 1],
+		[6, "rep", "2011-01-05", None, "TX", 2],
+		],
+	}
+
+day = datetime.date(2011, 3, 1)
+
+# (name, nameformat, date, role_type, state, district) and the person id they
+# resolve to, or the number of matches if not exactly one.
+queries = [
+	((u"Harold Rogers", "firstlast", day, None, None, None), 1),
+	((u"Hal Rogers", "firstlast", day, "rep", "KY", 5), 1),
+	((u"Harold Rogers", "firstlast", day, "REP", "ky", "5"), 1),
+	((u"Harold Rogers", "firstlast", datetime.date(2010, 3, 1), None, None, None), "0 matches"),
+	((u"Adam Smith", "firstlast", day, None, None, None), "2 matches"),
+	((u"Adam Smith", "firstlast", day, "rep", "WA", None), 2),
+	((u"Adam Smith", "firstlast", datetime.date(2010, 3, 1), None, None, None), 2),
+	((u"Rand Paul", "firstlast", day, "sen", "KY", None), 4),
+	((u"Paul, Rand", "lastfirst", day, None, "Ky", None), 4),
+	((u"John Doe", "firstlast", day, None, None, None), "0 matches"),
+	((u"Jane Roe", "firstlast", day, None, None, None), "0 matches"),
+	((u"Nobody Here", "firstlast", day, None, None, None), "0 matches"),
+	]
+
+def resolve(name, nameformat, date, role_type, state, district):
+	try:
+		return names.parse_name(name, date, nameformat=nameformat, role_type=role_type, state=state, district=district)
+	except ValueError as e:
+		return str(e).split(" for person")[0]
+
+class ParseNameTest(unittest.TestCase):
+	def test_database(self):
+		with Workspace(people):
+			for args, expected in queries:
+				self.assertEqual(resolve(*args), expected, args)
+
+	def test_index_matches_database(self):
+		with Workspace(people):
+			from_database = [resolve(*args) for args, expected in queries]
+			names.load_people_index()
+			self.assertEqual([resolve(*args) for args, expected in queries], from_database)
+
+	def test_cache_queries_once(self):
+		with Workspace(people):
+			names.enable_name_cache()
+			connections = []
+			get_engine = names.get_engine
+			names.get_engine = lambda : connections.append(1) or get_engine()
+			try:
+				for args, expected in queries:
+					del connections[:]
+					self.assertEqual(resolve(*args), expected, args)
+					self.assertEqual(len(connections), 1, args)
+					# Only names that resolve are cached.
+					del connections[:]
+					self.assertEqual(resolve(*args), expected, args)
+					self.assertEqual(len(connections), 0 if isinstance(expected, int) else 1, args)
+			finally:
+				names.get_engine = get_engine
+
+class ParseNamesTest(unittest.TestCase):
+	def batch(self, nameformat):
+		return [(args[0], args[2], args[3], args[4], args[5]) for args, expected in queries if args[1] == nameformat]
+	
+	def resolve_batch(self, nameformat):
+		return [r if isinstance(r, int) else str(r).split(" for person")[0] for r in names.parse_names(self.batch(nameformat), nameformat=nameformat)]
+	
+	def test_matches_parse_name(self):
+		with Workspace(people):
+			for index in (False, True):
+				if index:
+					names.load_people_index()
+				for nameformat in ("firstlast", "lastfirst"):
+					self.assertEqual(self.resolve_batch(nameformat),
+						[resolve(*args) for args, expected in queries if args[1] == nameformat])
+	
+	def test_errors(self):
+		with Workspace(people):
+			results = names.parse_names([(u"Adam Smith", day, None, None, None), (u"Nobody Here", day, None, None, None), (u"Adam Smith", day, "rep", "WA", None)])
+			self.assertTrue(isinstance(results[0], ValueError))
+			self.assertTrue(str(results[0]).startswith("2 matches for person Adam Smith"))
+			self.assertTrue(isinstance(results[1], ValueError))
+			self.assertTrue(str(results[1]).startswith("0 matches for person Nobody Here"))
+			self.assertEqual(results[2], 2)
+	
+	def test_cache_interval_within_loaded_dates(self):
+		with Workspace(people):
+			names.enable_name_cache()
+			first, last = datetime.date(2011, 3, 1), datetime.date(2011, 6, 1)
+			self.assertEqual(names.parse_names([(u"Adam Smith", first, "rep", "WA", None), (u"Adam Smith", last, "rep", "WA", None)]), [2, 2])
+			# The role runs 2011-01-05 to 2013-01-03, but only roles overlapping
+			# the batch's dates were read, so the cached answer covers just those.
+			key = names.name_cache_key(u"Adam Smith", "firstlast", "rep", "WA", None)
+			self.assertEqual(names.name_cache.get(key, first), 2)
+			self.assertEqual(names.name_cache.get(key, last), 2)
+			self.assertEqual(names.name_cache.get(key, first - datetime.timedelta(days=1)), None)
+			self.assertEqual(names.name_cache.get(key, last + datetime.timedelta(days=1)), None)
+
+class NameCacheTest(unittest.TestCase):
+	def test_put_evicts_beyond_size(self):
+		cache = NameCache(3)
+		for i in xrange(10):
+			cache.put(("name%d" % i,), datetime.date.min, datetime.date.max, i)
+		self.assertEqual(len(cache.entries), 3)
+		self.assertEqual(cache.evictions, 7)
+		self.assertEqual(cache.get(("name9",), datetime.date.today()), 9)
+		self.assertEqual(cache.get(("name0",), datetime.date.today()), None)
+
+	def test_keeps_most_recently_used(self):
+		cache = NameCache(2)
+		cache.put(("a",), datetime.date.min, datetime.date.max, 1)
+		cache.put(("b",), datetime.date.min, datetime.date.max, 2)
+		cache.get(("a",), datetime.date.today())
+		cache.put(("c",), datetime.date.min, datetime.date.max, 3)
+		self.assertEqual(list(cache.entries), [("a",), ("c",)])
+
+	def test_store_keeps_evicted_entries(self):
+		tmp = tempfile.mkdtemp()
+		try:
+			cache = NameCache(1, os.path.join(tmp, "names"))
+			cache.put(("a",), datetime.date.min, datetime.date.max, 1)
+			cache.put(("b",), datetime.date.min, datetime.date.max, 2)
+			self.assertEqual(len(cache.entries), 1)
+			self.assertEqual(cache.get(("a",), datetime.date.today()), 1)
+			self.assertEqual(len(cache.entries), 1)
+			cache.close()
+		finally:
+			shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,129 @@
+import os, sys, unittest
+from lxml import etree
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import util, mirror, us_bills, benchmark
+from workspace import Workspace, smoke_corpus
+
+class ParseBillActionTest(unittest.TestCase):
+	def action_lines(self):
+		saved = util.mirror
+		util.set_mirror(mirror.FileMirror(os.path.join(smoke_corpus, "mirror")))
+		try:
+			lines = benchmark.load_action_lines()
+		finally:
+			util.set_mirror(saved)
+		return sorted(set(lines) | set(benchmark.sample_action_lines))
+	
+	def test_matches_regex_chain(self):
+		# The keyword-trie classifier must classify each line as the chain of
+		# regular expressions it replaced did, except where the old chain raised
+		# (on "Passed House pursuant to" lines).
+		titles = ("Making appropriations for the fiscal year", "Proposing an amendment to the Constitution of the United States relative to a balanced budget.")
+		for line in self.action_lines():
+			for bill_type in ("h", "s", "hr", "sr", "hj", "sj", "hc", "sc"):
+				for prev_state in ("INTRODUCED", "REFERRED", "PASS_OVER:HOUSE", "PASS_OVER:SENATE", "PASSED:BILL", "PASS_BACK:SENATE"):
+					for title in titles:
+						try:
+							expected = benchmark.baseline_parse_bill_action(line, bill_type, prev_state, title)
+						except Exception:
+							continue
+						self.assertEqual(us_bills.parse_bill_action(line, bill_type, prev_state, title), expected, (line, bill_type, prev_state, title))
+
+class SectionReuseTest(unittest.TestCase):
+	def parse_with_changed_page(self, page):
+		"""Parses H.R. 1 with the stored file from a full parse, with each of its
+		sections marked, and the hash of page changed. Returns the full parse and
+		the new one."""
+		pagehashes = { }
+		full = us_bills.parse_bill(112, "h", 1, pagehashes=pagehashes)
+		self.assertTrue(page in pagehashes)
+		
+		fn = us_bills.bill_file_name(112, "h", 1)
+		if not os.path.exists(os.path.dirname(fn)):
+			os.makedirs(os.path.dirname(fn))
+		root = etree.fromstring(full)
+		for node in root:
+			node.set("reused", "1")
+		with open(fn, "w") as f:
+			f.write(etree.tostring(root, pretty_print=True))
+		
+		oldhashes = dict(pagehashes)
+		oldhashes[page] = "changed"
+		newhashes = { }
+		reparsed = us_bills.parse_bill(112, "h", 1, oldhashes=oldhashes, pagehashes=newhashes)
+		self.assertEqual(newhashes, pagehashes)
+		return full, etree.fromstring(reparsed)
+	
+	def test_reparses_only_changed_section(self):
+		with Workspace():
+			full, root = self.parse_with_changed_page("cosponsors")
+			self.assertEqual([node.tag for node in root if node.get("reused") == None], ["cosponsors"])
+			for node in root:
+				node.attrib.pop("reused", None)
+			self.assertEqual(etree.tostring(root, pretty_print=True), full)
+	
+	def test_status_page_sections(self):
+		with Workspace():
+			full, root = self.parse_with_changed_page("status")
+			self.assertEqual([node.tag for node in root if node.get("reused") == None],
+				["state", "introduced", "sponsor", "titles", "actions"])
+			for node in root:
+				node.attrib.pop("reused", None)
+			self.assertEqual(etree.tostring(root, pretty_print=True), full)
+
+class UpdateBillsTest(unittest.TestCase):
+	def setUp(self):
+		self.saved = (us_bills.parse_bill, us_bills.checkpoint_interval)
+		self.parsed = []
+	
+	def tearDown(self):
+		us_bills.parse_bill, us_bills.checkpoint_interval = self.saved
+	
+	def hashes(self):
+		"""Returns the saved record and page md5s of each bill."""
+		result = [ ]
+		for fn in ("../data/us/112/bills.bsshash", "../data/us/112/bills.pagehash"):
+			with open(fn) as f:
+				result.append(dict(line.rstrip("\n").split(" ", 1) for line in f))
+		return result
+	
+	def parse_bill(self, congress, bill_type, bill_number, **kwargs):
+		if (bill_type, bill_number) == self.interrupt:
+			raise KeyboardInterrupt()
+		self.parsed.append(bill_type + str(bill_number))
+		return self.saved[0](congress, bill_type, bill_number, **kwargs)
+	
+	def test_resumes_after_interruption(self):
+		with Workspace():
+			us_bills.parse_bill = self.parse_bill
+			us_bills.checkpoint_interval = 0
+			self.interrupt = None
+			us_bills.update_bills(112, False)
+			self.assertEqual(self.parsed, ["h1", "h2", "s1"])
+			complete = self.hashes()
+			
+			# Start over, stopping at the last bill as though the run was killed.
+			for fn in ("../data/us/112/bills.bsshash", "../data/us/112/bills.pagehash"):
+				os.unlink(fn)
+			self.parsed = []
+			self.interrupt = ("s", 1)
+			self.assertRaises(KeyboardInterrupt, us_bills.update_bills, 112, False)
+			self.assertEqual(self.parsed, ["h1", "h2"])
+			changehash, pagehash = self.hashes()
+			self.assertEqual(sorted(changehash), ["h1", "h2"])
+			self.assertEqual(sorted(pagehash), sorted(changehash))
+			for key in changehash:
+				self.assertEqual(changehash[key], complete[0][key])
+				self.assertEqual(pagehash[key], complete[1][key])
+			
+			# The next run parses only the bill that was not reached.
+			self.parsed = []
+			self.interrupt = None
+			us_bills.update_bills(112, False)
+			self.assertEqual(self.parsed, ["s1"])
+			self.assertEqual(self.hashes(), complete)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,80 @@
+import os, sys, time, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from util import TokenBucket, stream_lines, unescape
+import benchmark
+
+class TokenBucketTest(unittest.TestCase):
+	def test_take_waits_out_pause(self):
+		bucket = TokenBucket(10, burst=5)
+		bucket.pause(0.5)
+		not_before = bucket.not_before
+		for i in xrange(7):
+			bucket.take()
+			self.assertTrue(time.time() >= not_before)
+
+	def test_take_keeps_to_rate(self):
+		bucket = TokenBucket(20, burst=2)
+		start = time.time()
+		for i in xrange(6):
+			bucket.take()
+		# Two tokens are available at once and the other four take 0.05s each.
+		self.assertTrue(time.time() - start >= 0.19)
+
+class StreamLinesTest(unittest.TestCase):
+	def read(self, chunks, charset, html):
+		saved = []
+		lines = list(stream_lines(chunks, charset, html, lambda format, content : saved.append((format, content))))
+		self.assertEqual(len(saved), 1)
+		return lines, saved[0]
+	
+	def check_splits(self, page, charset, html, expected):
+		whole = self.read([page], charset, html)
+		self.assertEqual(whole[0], expected)
+		for i in xrange(len(page) + 1):
+			self.assertEqual(self.read([page[0:i], page[i:]], charset, html), whole, i)
+		self.assertEqual(self.read(list(page), charset, html), whole)
+	
+	def test_split_multibyte_characters(self):
+		self.check_splits(u"caf\xe9\n\u2014 \u00bd\nlast \u201cquoted\u201d".encode("utf8"), "utf8", True,
+			[u"caf\xe9", u"\u2014 \u00bd", u"last \u201cquoted\u201d"])
+	
+	def test_split_entities(self):
+		self.check_splits("caf&eacute; &#233;&#xe9;\nA &amp; B &bogus;\n&lt;p&gt;", "utf8", True,
+			[u"caf\xe9 \xe9\xe9", u"A &amp; B &bogus;", u"&lt;p&gt;"])
+		self.check_splits("caf&#233; &#150;\n", "windows-1252", True, [u"caf\xe9 \u2013", u""])
+		self.check_splits("caf&eacute;\n", "utf8", False, [u"caf&eacute;", u""])
+	
+	def test_split_line_endings(self):
+		self.check_splits("one\r\ntwo\rthree\n\r\nfour\r", "utf8", True, [u"one", u"two", u"three", u"", u"four", u""])
+		self.check_splits("one\r\ntwo\r", None, False, ["one", "two", ""])
+
+class UnescapeTest(unittest.TestCase):
+	texts = [
+		u"no references",
+		u"caf&eacute; &nbsp;&mdash; &ldquo;H.R. 1&rdquo; &copy;&reg;&trade;",
+		u"&amp; &lt;p&gt; &quot;q&quot; &apos;a&apos; &#38; &#60; &#62; &#34; &#39; &#x26;",
+		u"&#233; &#0233; &#xe9; &#XE9; &#xE9; &#8212; &#x2014; &#147;H.R. 1&#148; &#150; &#128;",
+		u"&#255; &#256; &#1114111; &#x110000;",
+		u"&bogus; &Eacute; &EACUTE; &#xzz; &#12a; & amp; &amp &;",
+		u"\xe9 &eacute;\n&#233;\r\n&#x2014;",
+		]
+	
+	def test_matches_baseline(self):
+		for charset in ("utf-8", "utf8", "iso-8859-1", "ISO-8859-1", "windows-1252"):
+			for text in self.texts:
+				self.assertEqual(unescape(text, charset), benchmark.baseline_unescape(text, charset), (text, charset))
+	
+	def test_out_of_range_reference(self):
+		# The baseline raised OverflowError here.
+		for charset in ("utf-8", "iso-8859-1"):
+			self.assertEqual(unescape(u"a &#99999999999; &#x999999999999; b", charset), u"a &#99999999999; &#x999999999999; b")
+	
+	def test_sample_pages(self):
+		for page in benchmark.load_escaped_pages()[0:2]:
+			for charset in ("utf-8", "iso-8859-1"):
+				self.assertEqual(unescape(page, charset), benchmark.baseline_unescape(page, charset))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,46 @@
+"""A temporary directory laid out as the scrapers expect, for tests that need the
+people database or that parse bills."""
+
+import os, sys, shutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import util, mirror, names, benchmark_corpus
+
+# The synthetic pages and people of the benchmark smoke test.
+smoke_corpus = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark", "smoke-corpus")
+
+class Workspace(object):
+	"""Sets up a workspace for the smoke corpus (see benchmark_corpus.make_workspace)
+	and makes its scraper directory current, with the corpus as the mirror,
+	until exit. If people is given, in the form of the corpus's people.json, the
+	people database holds those people instead."""
+
+	def __init__(self, people=None):
+		self.people = people
+
+	def __enter__(self):
+		self.path = benchmark_corpus.make_workspace(smoke_corpus)
+		if self.people != None:
+			os.unlink(os.path.join(self.path, "people.sqlite"))
+			benchmark_corpus.make_people_database(self.path, self.people)
+		self.cwd = os.getcwd()
+		self.mirror = util.mirror
+		os.chdir(os.path.join(self.path, "scraper"))
+		util.set_mirror(benchmark_corpus.OfflineMirror(mirror.FileMirror(os.path.join(smoke_corpus, "mirror"))))
+		reset_names()
+		return self
+
+	def __exit__(self, type, value, traceback):
+		reset_names()
+		util.set_mirror(self.mirror)
+		os.chdir(self.cwd)
+		shutil.rmtree(self.path)
+
+def reset_names():
+	"""Forgets the database connection, people index and name cache of names."""
+	names.disable_name_cache()
+	names.unload_people_index()
+	if names.engine != None:
+		names.engine.dispose()
+	names.engine = names.people = names.people_roles = None
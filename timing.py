@@ -0,0 +1,182 @@
+"""Records how long each stage of a scrape takes, overall and for each bill.
+
+Timing is off by default and then costs nothing: enable() replaces the
+functions that make up each stage with wrappers that time them, and disable()
+puts the originals back. For example:
+
+	import timing, us_bills
+	timing.enable()
+	us_bills.update_bills(112, False)
+	timing.report()
+	timing.write_metrics("../timing.json")
+
+The time of a stage includes any stages it calls, e.g. the time of
+parse_bill_status_page includes parse_bill_action. Pages are downloaded as they
+are parsed, so the download stage covers getting the response (or the mirrored
+copy) and the rest of the download is part of the parse_* stage that reads it.
+With us_bills.incremental_output, the sections of a bill are built while it is
+being written, so the write stage includes them. Pages parsed in the processes
+of a us_bills.BillPipeline are not timed, and there is no per-bill total."""
+
+import time, math, threading, json
+
+# The functions of us_bills timed, as (function, stage). parse_bill is also
+# timed for each bill.
+instrumented = (
+	("parse_bill", "bill"),
+	("download", "download"),
+	("parse_bill_status_page", "parse_bill_status_page"),
+	("parse_bill_action", "parse_bill_action"),
+	("parse_bill_cosponsors_page", "parse_bill_cosponsors_page"),
+	("parse_bill_titles_page", "parse_bill_titles_page"),
+	("parse_bill_committees_page", "parse_bill_committees_page"),
+	("find_committee", "find_committee"),
+	("parse_bill_related_bills_page", "parse_bill_related_bills_page"),
+	("parse_bill_subjects_page", "parse_bill_subjects_page"),
+	("parse_bill_amendments_page", "parse_bill_amendments_page"),
+	("parse_bill_summary_page", "parse_bill_summary_page"),
+	("parse_name", "parse_name"),
+	("parse_names", "parse_names"),
+	("serialize_bill", "serialize"),
+	("save_bill", "write"),
+	("save_bill_incremental", "write"),
+	)
+
+enabled = False
+originals = { } # function => the function before it was wrapped
+instrumented_module = None
+
+# Durations are counted in buckets that grow by bucket_ratio, from min_time, so
+# that percentiles can be estimated, to within the ratio, without keeping every
+# duration.
+min_time = 1e-6 # seconds
+bucket_ratio = 1.1
+
+lock = threading.Lock()
+stages = { } # stage => [calls, total seconds, longest, { bucket => calls }]
+bills = { } # bill => [total seconds, { stage => seconds }]
+current = threading.local() # the bill being parsed by this thread, if any
+
+def enable(module=None):
+	"""Starts timing the stages of scrapes, from where any earlier timing left off.
+	module is the us_bills module to time, if not the one imported as us_bills
+	(i.e. when it is run as a script)."""
+	global enabled, instrumented_module
+	if enabled:
+		return
+	if module == None:
+		import us_bills as module
+	for name, stage in instrumented:
+		func = getattr(module, name)
+		originals[name] = func
+		if stage == "bill":
+			setattr(module, name, timed_bill(func))
+		else:
+			setattr(module, name, timed_stage(func, stage))
+	instrumented_module = module
+	enabled = True
+
+def disable():
+	"""Stops timing, keeping the times recorded so far."""
+	global enabled, instrumented_module
+	for name, func in originals.items():
+		setattr(instrumented_module, name, func)
+	originals.clear()
+	instrumented_module = None
+	enabled = False
+
+def reset():
+	"""Forgets the times recorded so far."""
+	with lock:
+		stages.clear()
+		bills.clear()
+
+def timed_stage(func, stage):
+	def wrapper(*args, **kwargs):
+		start = time.time()
+		try:
+			return func(*args, **kwargs)
+		finally:
+			record(stage, time.time() - start, getattr(current, "bill", None))
+	wrapper.__name__ = func.__name__
+	wrapper.__doc__ = func.__doc__
+	return wrapper
+
+def timed_bill(parse_bill):
+	def wrapper(congress, bill_type, bill_number, *args, **kwargs):
+		outer = getattr(current, "bill", None)
+		current.bill = "%d/%s%d" % (congress, bill_type, bill_number)
+		start = time.time()
+		try:
+			return parse_bill(congress, bill_type, bill_number, *args, **kwargs)
+		finally:
+			elapsed = time.time() - start
+			record("bill", elapsed, None)
+			with lock:
+				bills.setdefault(current.bill, [0.0, { }])[0] += elapsed
+			current.bill = outer
+	wrapper.__name__ = parse_bill.__name__
+	wrapper.__doc__ = parse_bill.__doc__
+	return wrapper
+
+def record(stage, elapsed, bill):
+	b = int(math.log(max(elapsed, min_time) / min_time) / math.log(bucket_ratio))
+	with lock:
+		s = stages.get(stage)
+		if s == None:
+			s = stages[stage] = [0, 0.0, 0.0, { }]
+		s[0] += 1
+		s[1] += elapsed
+		s[2] = max(s[2], elapsed)
+		s[3][b] = s[3].get(b, 0) + 1
+		if bill != None:
+			bill_stages = bills.setdefault(bill, [0.0, { }])[1]
+			bill_stages[stage] = bill_stages.get(stage, 0.0) + elapsed
+
+def percentile(buckets, calls, longest, q):
+	"""Estimates the duration that the fraction q of the calls took no longer than."""
+	seen = 0
+	for b in sorted(buckets):
+		seen += buckets[b]
+		if seen >= q * calls:
+			return min(min_time * bucket_ratio ** (b + 1), longest)
+	return longest
+
+def summary(slowest=10):
+	"""Returns the times recorded so far: for each stage, the number of calls,
+	the total, mean and longest time, and the 50th, 95th and 99th percentile
+	times, and the slowest bills with their time in each stage. Times are in
+	seconds."""
+	with lock:
+		result = { "stages": { }, "slowest_bills": [], "bills": len(bills) }
+		for stage, (calls, total, longest, buckets) in stages.items():
+			result["stages"][stage] = {
+				"calls": calls,
+				"total": total,
+				"mean": total / calls,
+				"p50": percentile(buckets, calls, longest, 0.50),
+				"p95": percentile(buckets, calls, longest, 0.95),
+				"p99": percentile(buckets, calls, longest, 0.99),
+				"max": longest,
+				}
+		for bill, (total, bill_stages) in sorted(bills.items(), key=lambda item : -item[1][0])[0:slowest]:
+			result["slowest_bills"].append({ "bill": bill, "total": total, "stages": dict(bill_stages) })
+	return result
+
+def report(slowest=10):
+	"""Prints a summary of the times recorded so far."""
+	s = summary(slowest)
+	print "%-30s %9s %10s %9s %9s %9s %9s" % ("stage", "calls", "total s", "p50 ms", "p95 ms", "p99 ms", "max ms")
+	for stage, t in sorted(s["stages"].items(), key=lambda item : -item[1]["total"]):
+		print "%-30s %9d %10.2f %9.2f %9.2f %9.2f %9.2f" % (stage, t["calls"], t["total"], t["p50"] * 1e3, t["p95"] * 1e3, t["p99"] * 1e3, t["max"] * 1e3)
+	if len(s["slowest_bills"]) > 0:
+		print
+		print "slowest bills:"
+		for b in s["slowest_bills"]:
+			top = sorted(b["stages"].items(), key=lambda item : -item[1])[0:3]
+			print "  %-16s %9.1f ms  (%s)" % (b["bill"], b["total"] * 1e3, ", ".join("%s %.1f ms" % (stage, t * 1e3) for stage, t in top))
+
+def write_metrics(path, slowest=100):
+	"""Writes summary() to path as JSON."""
+	with open(path, "w") as f:
+		json.dump(summary(slowest), f, indent=1, sort_keys=True)
@@ -1,18 +1,46 @@
-import re, datetime
+import re, datetime, collections, filecmp
 from lxml import etree
-from lxml.html import fragment_fromstring
-import os, os.path
+import os, os.path, sys, threading, time, Queue
 
-from util import download, warn, md5_base64, format_datetime
+from util import download, download_async, warn, md5_base64, md5_base64_lines, hashed_lines, format_datetime, write_file_atomic, WorkerPool, Future, set_rate_limit, set_host_concurrency
 
-from names import parse_name
+from names import parse_name, parse_names
 
 thomas_bill_type_codes = (('HC', 'hc'), ('HE', 'hr'), ('HJ', 'hj'), ('HR', 'h'), ('HZ', 'hz'), ('SC', 'sc'), ('SE', 'sr'), ('SJ', 'sj'), ('SN', 's'), ('SP', 'sp'))
 
-def update_bills(congress, force_update):
+# The start of a record in THOMAS search results, matched against the lowercased line.
+search_record_re = re.compile(r'<b>\s*(\d+)\.</b> <a href="/cgi-bin/bdquery/d\?d\d+:\d+:./list/bss/d\d+[a-z]+.lst::">\s*[a-z\.]+(\d+)\s*</a>(: )?(.*)')
+
+# How often, in seconds, update_bills saves the hashes of the bills processed so far.
+checkpoint_interval = 60
+
+# When True, parse_bill writes each section of a bill's XML to the file as soon
+# as it is built rather than building the whole document in memory first, and
+# returns None instead of the XML.
+incremental_output = False
+
+def update_bills(congress, force_update, workers=1, prefetch=False, pool=None, skip=None, progress=None, pipeline=None):
 	"""Scans THOMAS search results for the indicated Congress updating bill
 	XML data (bills/*.xml) for any changed records. Or re-parses all files if
-	force_update == True."""	
+	force_update == True. Changed bills are parsed by a pool of worker threads
+	(see util.set_host_concurrency to cap simultaneous requests to THOMAS).
+	If prefetch is True, the pages of each bill are downloaded concurrently.
+	
+	The hashes of the bills processed so far are saved every checkpoint_interval
+	seconds, so that if the run is interrupted, running again with force_update
+	== False skips the bills that were already processed.
+	
+	Returns the number of bill XML files that were written because their
+	content changed.
+	
+	To share workers with other calls, pass a WorkerPool as pool instead of a
+	number of workers. Bills whose type and number are in skip are treated as
+	unchanged. If progress is given, progress.submitted(congress, bill) and
+	progress.processed(congress, bill) are called as each bill is queued and
+	done.
+	
+	To parse the bills in stages instead, pass a BillPipeline as pipeline (in
+	which case workers and prefetch are not used)."""	
 	
 	# Make the output directory.
 	try:
@@ -31,6 +59,75 @@ def update_bills(congress, force_update):
 				changehash[bill_code] = status_hash
 	newchangehash = {} # store new hashes to write here
 	
+	# Store md5sums of each of the THOMAS pages of a bill in this file, so that when
+	# a bill changes only the sections built from pages that changed are re-parsed.
+	pagehashfile = ("../data/us/%d/bills.pagehash" % congress)
+	pagehash = {}
+	if os.path.exists(pagehashfile):
+		with open(pagehashfile, "r") as fpages:
+			for line in fpages:
+				fields = line.strip().split(" ")
+				pagehash[fields[0]] = dict(field.split(":", 1) for field in fields[1:])
+	newpagehash = {}
+	
+	# Periodically save the hashes of the bills processed so far, keeping the old
+	# hashes of the bills not yet reached. If a worker is already saving, others
+	# carry on rather than wait.
+	checkpoint_lock = threading.Lock()
+	last_checkpoint = [time.time()]
+	def checkpoint():
+		if time.time() - last_checkpoint[0] < checkpoint_interval or not checkpoint_lock.acquire(False):
+			return
+		try:
+			merged_changehash = dict(changehash)
+			merged_changehash.update(newchangehash)
+			merged_pagehash = dict(pagehash)
+			merged_pagehash.update(newpagehash)
+			save_bill_hashes(changefile, merged_changehash, pagehashfile, merged_pagehash)
+			last_checkpoint[0] = time.time()
+		finally:
+			checkpoint_lock.release()
+	
+	changed = [] # bills whose XML files were written
+	
+	def processed(key):
+		checkpoint()
+		if progress != None:
+			progress.processed(congress, key)
+	
+	own_pool = pool == None and pipeline == None
+	if own_pool:
+		pool = WorkerPool(workers)
+	futures = []
+	for bt, bn, recordtext in search_results(congress):
+		if progress != None:
+			progress.submitted(congress, bt + str(bn))
+		args = (congress, bt, bn, recordtext, changehash, newchangehash, pagehash, newpagehash, force_update, prefetch, processed, changed, skip)
+		if pipeline != None:
+			# Changed bills are queued in the pipeline, which blocks while it is full.
+			futures.append(update_bills_2(*args, pipeline=pipeline))
+		else:
+			futures.append(pool.submit(update_bills_2, *args))
+	
+	# Wait for the workers to finish so that the hashes of all parsed bills are
+	# recorded, raising any exception a worker hit.
+	try:
+		for future in futures:
+			if future != None:
+				future.result()
+	finally:
+		if own_pool:
+			pool.close()
+				
+	# Write out current record md5s to the hash files.
+	save_bill_hashes(changefile, newchangehash, pagehashfile, newpagehash)
+	
+	return len(changed)
+
+def search_results(congress):
+	"""Scans the THOMAS search results for the indicated Congress, yielding the
+	bill type, bill number and text of each bill's record."""
+	
 	# Load results for each bill type (and two amendment types).
 	for tbt, bt in thomas_bill_type_codes:
 		# Loop through the paginated responses.
@@ -42,31 +139,32 @@ def update_bills(congress, force_update):
 			# download file
 			url = "http://thomas.loc.gov/cgi-bin/bdquery/d?d%03d:%d:./list/bss/d%03d%s.lst:[[o]]" \
 				% (congress, offset, congress, tbt)
-			content, mtime = download(url)
-			if not content:
+			lines, mtime = download(url, lines=True)
+			if not lines:
 				warn("Failed to download %s" % url)
 				break
 			
 			# Read file by line, grouping lines together into "rec" until we hit an <hr>, at which point
 			# we handle the record.
-			for line in content.split("\n"):
+			for line in lines:
 				hr = line.find("<hr")
 				if hr >= 0 and rec != None:
 					# process the record ending here
-					rec += line[0:hr]
-					update_bills_2(congress, bt, bn, rec, changehash, newchangehash, force_update)
+					rec.append(line[0:hr])
+					yield bt, bn, "".join(rec)
 					rec = None
 				
 				# check if a record begins here
-				m = re.search(r'<b>\s*(\d+)\.</b> <a href="/cgi-bin/bdquery/d\?d\d+:\d+:./list/bss/d\d+[a-z]+.lst::">\s*[a-z\.]+(\d+)\s*</a>(: )?(.*)', line.lower())
+				lline = line.lower()
+				m = search_record_re.search(lline) if "</b>" in lline else None
 				if m != None:
 					# if we have an open record, process it; shouldn't occur since records end on <hr>'s.
 					if rec != None:
-						update_bills_2(congress, bt, bn, rec, changehash, newchangehash, force_update)
+						yield bt, bn, "".join(rec)
 					
 					seq = int(m.group(1)) # index in the search result
 					bn = int(m.group(2)) # bill number
-					rec = m.group(4) + "\n" # start record with the rest of the text on the line
+					rec = [m.group(4), "\n"] # start record with the rest of the text on the line
 					
 					# check that we didn't miss a record
 					if lastseq != None and lastseq != seq-1:
@@ -76,7 +174,8 @@ def update_bills(congress, force_update):
 				
 				# add line to existing record
 				elif rec != None:
-					rec += line + "\n"
+					rec.append(line)
+					rec.append("\n")
 				
 				# check if there are more results (i.e. continue onto next page)
 				elif "&\">NEXT PAGE" in line and lastseq != None:
@@ -91,63 +190,823 @@ def update_bills(congress, force_update):
 
 		# If there was an open record when we ended, process it, but it shouldn't happen.
 		if rec != None:
-			update_bills_2(congress, bt, bn, rec, changehash, newchangehash, force_update)
-				
-	# Write out current record md5s to the hash file.
-	with open(changefile, "w") as fchanges:
-		items = sorted(newchangehash.items())
-		for item in items:
-			fchanges.write("%s %s\n" % item)
+			yield bt, bn, "".join(rec)
+
+def save_bill_hashes(changefile, changehash, pagehashfile, pagehash):
+	"""Atomically replaces the files of search record md5s and page md5s."""
+	# The page md5s are written first. If the run stops in between, the bills
+	# whose records were not yet saved are parsed again.
+	write_file_atomic(pagehashfile, (" ".join([key] + ["%s:%s" % item for item in sorted(hashes.items())]) + "\n"
+		for key, hashes in sorted(pagehash.items())))
+	write_file_atomic(changefile, ("%s %s\n" % item for item in sorted(changehash.items())))
 
-def update_bills_2(congress, bill_type, bill_number, recordtext, changehash, newchangehash, force_update):
+def update_bills_2(congress, bill_type, bill_number, recordtext, changehash, newchangehash, pagehash, newpagehash, force_update, prefetch=False, processed=None, changed=None, skip=None, pipeline=None):
 	"""Compares a THOMAS search result record to the hash file to see if anything
-	changed, and if so, or if force_update == True, re-parses the bill or amendment."""
+	changed, and if so, or if force_update == True, re-parses the bill or amendment.
+	Unless force_update == True, sections of the bill built from pages that have
+	not changed since the last parse are kept from the existing bill XML. Calls
+	processed, if given, with the bill's type and number once its hashes are
+	recorded, and appends the bill to changed, if given, if its XML file was
+	written. A bill in skip, if given, is treated as unchanged.
+	
+	If pipeline, a BillPipeline, is given, the bill is queued in it to be parsed
+	instead, and the Future for it is returned."""
 	
 	key = bill_type + str(bill_number)
 	rec = md5_base64(recordtext)
 
-	if not force_update and key in changehash and changehash[key] == rec:
-		newchangehash[key] = changehash[key]
+	if (not force_update and key in changehash and changehash[key] == rec) or (skip != None and key in skip):
+		if key in changehash:
+			newchangehash[key] = changehash[key]
+		if key in pagehash:
+			newpagehash[key] = pagehash[key]
+		if processed != None:
+			processed(key)
 		return
 	
 	if not force_update:
 		warn("Detected Update to %d %s %d." % (congress, bill_type, bill_number))
 	
-	try:
-		if bill_type == 'hz':
-			#if (!ParseAmendment($bs, 'h', 'Z', $bn)) { return; }
-			pass
-		elif bill_type == 'sp':
-			#if (!ParseAmendment($bs, 's', 'P', $bn)) { return; }
-			pass
+	hashes = { }
+	def finish(exc_info):
+		# Record the hashes of the bill once it is parsed, unless that failed.
+		if exc_info == None:
+			if bill_type not in ('hz', 'sp'):
+				newpagehash[key] = hashes
+			newchangehash[key] = rec
 		else:
-			parse_bill(congress, bill_type, bill_number)
+			import traceback
+			warn("Parsing bill %d %s %d: " % (congress, bill_type, bill_number) + unicode(exc_info[1]) + "\n" + "".join(traceback.format_exception(*exc_info)))
+		if processed != None:
+			processed(key)
+	
+	if bill_type == 'hz':
+		#if (!ParseAmendment($bs, 'h', 'Z', $bn)) { return; }
+		pass
+	elif bill_type == 'sp':
+		#if (!ParseAmendment($bs, 's', 'P', $bn)) { return; }
+		pass
+	elif pipeline != None:
+		return pipeline.submit(congress, bill_type, bill_number,
+			oldhashes=None if force_update else pagehash.get(key), pagehashes=hashes, changed=changed, done=finish)
+	else:
+		try:
+			parse_bill(congress, bill_type, bill_number, prefetch=prefetch,
+				oldhashes=None if force_update else pagehash.get(key), pagehashes=hashes, changed=changed)
+		except Exception:
+			finish(sys.exc_info())
+			return
+	
+	finish(None)
+
+class BillPipeline(object):
+	"""Parses bills as parse_bill does, but in stages that each use one
+	resource, so that each can be kept busy independently of the others:
+	
+	  fetch: threads download and hash the pages of each bill (the network)
+	  parse: a pool of processes parses the pages that changed (the CPU)
+	  resolve: a thread resolves the sponsors and cosponsors of up to
+	    resolve_batch bills at a time with one parse_names call (the database)
+	  write: a thread builds and saves the XML of each bill (the disk)
+	
+	Each stage passes bills to the next through a queue of at most queue_size
+	bills, so submit() blocks when the stages after it can't keep up, which
+	keeps the number of bills held in memory bounded. With parsers=0, pages are
+	parsed in a thread instead of processes. parsers=None means one process
+	per CPU."""
+	
+	def __init__(self, fetchers=8, parsers=None, resolve_batch=32, queue_size=16):
+		import multiprocessing
+		if parsers == None:
+			parsers = multiprocessing.cpu_count()
+		# Fork the parsers before starting any threads.
+		self.pool = multiprocessing.Pool(parsers) if parsers > 0 else None
+		self.resolve_batch = resolve_batch
+		self.queue_size = queue_size
+		self.fetch_queue = Queue.Queue(queue_size)
+		self.parse_queue = Queue.Queue(queue_size)
+		self.resolve_queue = Queue.Queue(queue_size)
+		self.write_queue = Queue.Queue(queue_size)
+		self.parsing = Queue.Queue(queue_size) # bills in the parse processes
+		self.fetch_threads = [self.start(self.fetch_stage) for i in xrange(fetchers)]
+		self.stage_threads = [self.start(stage) for stage in (self.parse_stage, self.collect_stage, self.resolve_stage, self.write_stage)]
+	
+	def start(self, stage):
+		t = threading.Thread(target=stage)
+		t.daemon = True
+		t.start()
+		return t
+	
+	def submit(self, congress, bill_type, bill_number, oldhashes=None, pagehashes=None, changed=None, done=None):
+		"""Queues a bill to be parsed with the given arguments of parse_bill, and
+		returns a Future for what parse_bill would return or raise. If done is
+		given, it is called from the pipeline when the bill is finished, with None
+		or the sys.exc_info() of the error that stopped it, and the Future gets its
+		result instead."""
+		bill = PipelineBill(congress, bill_type, bill_number, oldhashes, pagehashes, changed, done)
+		self.fetch_queue.put(bill)
+		return bill.future
+	
+	def close(self):
+		"""Waits for the bills submitted to be finished and stops the stages."""
+		for t in self.fetch_threads:
+			self.fetch_queue.put(None)
+		for t in self.fetch_threads:
+			t.join()
+		self.parse_queue.put(None)
+		for t in self.stage_threads:
+			t.join()
+		if self.pool != None:
+			self.pool.close()
+			self.pool.join()
+	
+	def fetch_stage(self):
+		while True:
+			bill = self.fetch_queue.get()
+			if bill == None:
+				return
+			try:
+				self.fetch(bill)
+			except Exception:
+				bill.error = sys.exc_info()
+			self.parse_queue.put(bill)
+	
+	def fetch(self, bill):
+		"""Downloads and hashes the pages of a bill, and works out which sections
+		of its existing XML can be kept and which pages need to be parsed."""
+		previous = load_bill_sections(bill.congress, bill.bill_type, bill.bill_number) if bill.oldhashes else None
+		pages = { }
+		unchanged = { }
+		for name, suffix, description in bill_pages:
+			url = bill_page_url(bill.congress, bill.bill_type, bill.bill_number, suffix)
+			lines, mtime = download(url, lines=True)
+			if not lines:
+				raise Exception("Failed to download %s page: %s" % (description, url))
+			pages[name] = list(lines)
+			bill.pagehashes[name] = md5_base64_lines(pages[name])
+			unchanged[name] = previous != None and name in bill.oldhashes and bill.pagehashes[name] == bill.oldhashes[name]
+			if name == "status":
+				bill.mtime = mtime
+		
+		# The same sections are kept as parse_bill would keep.
+		def reuse(tag, unchanged):
+			if unchanged and tag in previous:
+				return previous[tag]
+			return None
+		kept = [reuse(tag, unchanged["status"]) for tag in ("state", "introduced", "actions")]
+		if None not in kept:
+			bill.kept.update(zip(("state", "introduced", "actions"), kept))
+			bill.kept["sponsor"] = previous.get("sponsor")
+		for name, tag in bill_page_sections.items():
+			node = reuse(tag, unchanged[name] and (unchanged["status"] or name != "titles"))
+			if node != None:
+				bill.kept[tag] = node
+			else:
+				bill.pages[name] = pages[name]
+		if "state" not in bill.kept or "titles" in bill.pages:
+			bill.pages["status"] = pages["status"]
+	
+	def parse_stage(self):
+		while True:
+			bill = self.parse_queue.get()
+			if bill == None:
+				self.parsing.put(None)
+				return
+			if bill.error != None:
+				self.parsing.put((bill, None))
+			elif self.pool == None:
+				try:
+					bill.parsed = parse_bill_pages(bill.congress, bill.bill_type, bill.pages)
+				except Exception:
+					bill.error = sys.exc_info()
+				self.parsing.put((bill, None))
+			else:
+				self.parsing.put((bill, self.pool.apply_async(parse_bill_pages, (bill.congress, bill.bill_type, bill.pages))))
+	
+	def collect_stage(self):
+		# Collect what the parse processes return, in the order the bills went in.
+		while True:
+			item = self.parsing.get()
+			if item == None:
+				self.resolve_queue.put(None)
+				return
+			bill, result = item
+			if result != None:
+				try:
+					bill.parsed = result.get()
+				except Exception:
+					bill.error = sys.exc_info()
+			bill.pages = None # free the memory
+			self.resolve_queue.put(bill)
+	
+	def resolve_stage(self):
+		while True:
+			# Take as many bills as are waiting, up to resolve_batch.
+			bills = [self.resolve_queue.get()]
+			while bills[-1] != None and len(bills) < self.resolve_batch:
+				try:
+					bills.append(self.resolve_queue.get_nowait())
+				except Queue.Empty:
+					break
+			stop = bills[-1] == None
+			if stop:
+				bills.pop()
+			self.resolve(bills)
+			for bill in bills:
+				self.write_queue.put(bill)
+			if stop:
+				self.write_queue.put(None)
+				return
+	
+	def resolve(self, bills):
+		"""Resolves the names of the sponsors and cosponsors of the bills to
+		person ids with a single call to parse_names."""
+		batch = []
+		owners = []
+		for bill in bills:
+			if bill.error != None:
+				continue
+			if "state" not in bill.kept:
+				status = bill.parsed["status"]
+				if status["sponsor"][0] == None:
+					bill.sponsor = 0
+				else:
+					name, senrep, state, district = status["sponsor"]
+					batch.append((name, status["introduced"], senrep, state, district))
+					owners.append((bill, "sponsor"))
+			if "cosponsors" in bill.parsed:
+				bill.people = []
+				for name, senrep, state, district, join_date, withdrawn_date in bill.parsed["cosponsors"]:
+					batch.append((name, join_date, senrep, state, district))
+					owners.append((bill, "cosponsors"))
+		if len(batch) == 0:
+			return
+		try:
+			people = parse_names(batch, nameformat="lastfirst")
+		except Exception:
+			error = sys.exc_info()
+			for bill, role in owners:
+				bill.error = error
+			return
+		for (bill, role), person in zip(owners, people):
+			if role == "sponsor":
+				bill.sponsor = person
+			else:
+				bill.people.append(person)
+	
+	def write_stage(self):
+		while True:
+			bill = self.write_queue.get()
+			if bill == None:
+				return
+			xml = None
+			if bill.error == None:
+				try:
+					xml = self.write(bill)
+				except Exception:
+					bill.error = sys.exc_info()
+			self.finish(bill, xml)
+	
+	def write(self, bill):
+		"""Builds the XML of a bill from the sections kept and the pages parsed,
+		and saves it."""
+		kept, parsed = bill.kept, bill.parsed
+		if "state" in kept:
+			state, intronode, sponsornode = kept["state"], kept["introduced"], kept["sponsor"]
+		else:
+			if isinstance(bill.sponsor, Exception):
+				raise bill.sponsor
+			state, intronode, sponsornode = build_status_sections(parsed["status"], bill.sponsor)
+		
+		def section(name):
+			if name == "actions":
+				return kept["actions"] if "state" in kept else build_actions(parsed["status"]["actions"])
+			tag = bill_page_sections[name]
+			if tag in kept:
+				return kept[tag]
+			return build_bill_section(name, parsed[name], title=parsed["status"]["title"] if name == "titles" else None,
+				people=bill.people if name == "cosponsors" else None)
+		
+		return write_bill(bill.congress, bill.bill_type, bill.bill_number, bill_attributes(bill.congress, bill.bill_type, bill.bill_number, bill.mtime),
+			bill_sections(state, intronode, sponsornode, section), bill.changed)
+	
+	def finish(self, bill, xml):
+		if bill.done == None:
+			if bill.error != None:
+				bill.future.set_exception(bill.error)
+			else:
+				bill.future.set_result(xml)
+			return
+		try:
+			bill.future.set_result(bill.done(bill.error))
+		except:
+			bill.future.set_exception(sys.exc_info())
+
+class PipelineBill(object):
+	"""A bill on its way through a BillPipeline."""
+	def __init__(self, congress, bill_type, bill_number, oldhashes, pagehashes, changed, done):
+		self.congress = congress
+		self.bill_type = bill_type
+		self.bill_number = bill_number
+		self.oldhashes = oldhashes
+		self.pagehashes = pagehashes if pagehashes != None else { }
+		self.changed = changed
+		self.done = done
+		self.future = Future()
+		self.mtime = None # of the status page
+		self.kept = { } # sections of the existing XML to keep, by tag
+		self.pages = { } # lines of the pages to parse, by page name
+		self.parsed = { } # what parse_bill_page returned, by page name
+		self.sponsor = None # person id
+		self.people = None # what parse_names returned for the cosponsors
+		self.error = None # sys.exc_info() of the error that stopped the bill
+
+def parse_bill_pages(congress, bill_type, pages):
+	"""Parses pages, a dict from page name to lines, with parse_bill_page, in
+	the order of bill_pages, returning a dict of the results. This is what a
+	BillPipeline's parse processes run."""
+	return dict((name, parse_bill_page(congress, bill_type, name, pages[name])) for name, suffix, description in bill_pages if name in pages)
+
+def backfill_bills(first, last, force_update=False, workers=8, prefetch=False, journal="../data/us/bills.backfill", report_interval=30, pipeline=None):
+	"""Updates the bills of each Congress from first to last, as update_bills
+	does, with one pool of worker threads shared by all of them, or with
+	pipeline, a BillPipeline, if given. Progress is reported every
+	report_interval seconds.
+	
+	Each bill processed is recorded in the journal file. If the backfill is
+	interrupted, running it again with the same arguments skips the Congresses
+	and bills that were already done. The journal is deleted when the backfill
+	completes. Returns the number of bill XML files that were written."""
+	
+	congresses = range(first, last + 1)
+	header = "backfill %d %d %d\n" % (first, last, 1 if force_update else 0)
+	
+	# Load the journal of an interrupted run of the same backfill.
+	done = { } # congress => set of bills, or True when the whole Congress is done
+	if os.path.exists(journal):
+		with open(journal, "r") as f:
+			if f.readline() == header:
+				for line in f:
+					fields = line.split()
+					if not line.endswith("\n") or len(fields) != 2 or done.get(int(fields[0])) == True:
+						continue # e.g. a line cut off when the run was interrupted
+					if fields[1] == "done":
+						done[int(fields[0])] = True
+					else:
+						done.setdefault(int(fields[0]), set()).add(fields[1])
+	if done:
+		warn("Resuming backfill: %d Congresses and %d bills already done." % (
+			len([c for c in done if done[c] == True]), sum(len(bills) for bills in done.values() if bills != True)))
+	else:
+		with open(journal, "w") as f:
+			f.write(header)
+	
+	pool = WorkerPool(workers) if pipeline == None else None
+	changed = 0
+	with open(journal, "a") as f:
+		progress = BackfillProgress([c for c in congresses if done.get(c) != True], f, report_interval)
+		for congress in congresses:
+			if done.get(congress) == True:
+				continue
+			skip = done.get(congress, set())
+			progress.resume(congress, skip)
+			changed += update_bills(congress, force_update, prefetch=prefetch, pool=pool, skip=skip, progress=progress, pipeline=pipeline)
+			progress.finished(congress)
+		progress.report()
+	if pool != None:
+		pool.close()
+	
+	os.unlink(journal)
+	return changed
+
+class BackfillProgress(object):
+	"""Counts the bills queued and processed in a backfill, appends the bills
+	processed to the journal, and periodically reports the rate at which bills
+	are being processed and an estimate of the time remaining. The number of
+	bills in the Congresses not yet scanned is estimated from those scanned."""
+	
+	def __init__(self, congresses, journal, report_interval):
+		self.lock = threading.Lock()
+		self.journal = journal
+		self.report_interval = report_interval
+		self.remaining = list(congresses) # Congresses not yet finished
+		self.sizes = [] # number of bills in each finished Congress
+		self.queued = { } # congress => number of bills queued so far
+		self.skipped = set() # (congress, bill) done in an earlier run
+		self.submitted_count = 0
+		self.processed_count = 0
+		self.new_count = 0 # bills processed in this run
+		self.start = time.time()
+		self.last_report = self.start
 	
-		newchangehash[key] = rec
-	except Exception as e:
-		import traceback
-		warn("Parsing bill %d %s %d: " % (congress, bill_type, bill_number) + unicode(e) + "\n" + traceback.format_exc())
+	def resume(self, congress, bills):
+		with self.lock:
+			self.skipped.update((congress, bill) for bill in bills)
+	
+	def submitted(self, congress, bill):
+		with self.lock:
+			self.submitted_count += 1
+			self.queued[congress] = self.queued.get(congress, 0) + 1
+	
+	def processed(self, congress, bill):
+		with self.lock:
+			self.processed_count += 1
+			if (congress, bill) not in self.skipped:
+				self.new_count += 1
+				self.journal.write("%d %s\n" % (congress, bill))
+				self.journal.flush()
+			if time.time() - self.last_report >= self.report_interval:
+				self.report()
+	
+	def finished(self, congress):
+		with self.lock:
+			self.sizes.append(self.queued.pop(congress, 0))
+			self.remaining.remove(congress)
+			self.journal.write("%d done\n" % congress)
+			self.journal.flush()
+	
+	def report(self):
+		self.last_report = time.time()
+		elapsed = self.last_report - self.start
+		rate = self.new_count / elapsed if elapsed > 0 else 0.0
+		
+		scanned = self.sizes + self.queued.values()
+		per_congress = float(sum(scanned)) / len(scanned) if len(scanned) > 0 else 0.0
+		total = self.submitted_count + per_congress * (len(self.remaining) - len(self.queued))
+		if rate > 0:
+			eta = str(datetime.timedelta(seconds=int((total - self.processed_count) / rate)))
+		else:
+			eta = "unknown"
+		
+		warn("Backfill: %d of about %d bills processed, %.1f bills/sec, %s remaining." % (self.processed_count, total, rate, eta))
 
-def parse_bill(congress, bill_type, bill_number):
-	"""Downloads and parses THOMAS bill status and summary files."""
+def backfill_main(args):
+	import argparse
+	parser = argparse.ArgumentParser(prog="us_bills.py backfill",
+		description="Updates the bills of each Congress in a range, resuming an interrupted backfill of the same range.")
+	parser.add_argument("first", type=int, help="the first Congress")
+	parser.add_argument("last", type=int, help="the last Congress")
+	parser.add_argument("--force", action="store_true", help="re-parse all bills, not only those detected as changed")
+	parser.add_argument("--workers", type=int, default=8, help="the number of bills to parse at once (default 8)")
+	parser.add_argument("--prefetch", action="store_true", help="download the pages of each bill concurrently")
+	parser.add_argument("--rate", type=float, help="the most requests per second to make to all hosts together")
+	parser.add_argument("--burst", type=int, default=1, help="the most requests to make at once under --rate (default 1)")
+	parser.add_argument("--connections", type=int, help="the most requests to have in flight to any one host")
+	parser.add_argument("--restart", action="store_true", help="start over rather than resume an interrupted backfill")
+	parser.add_argument("--journal", default="../data/us/bills.backfill", help="the journal file for resuming (default %(default)s)")
+	parser.add_argument("--pipeline", action="store_true", help="parse bills in stages: --workers threads download, --parsers processes parse, and single threads resolve names and write files")
+	parser.add_argument("--parsers", type=int, help="the number of processes parsing pages with --pipeline (default one per CPU)")
+	parser.add_argument("--timing", metavar="FILE", help="time each stage of the backfill, print a summary, and write the times to FILE as JSON")
+	args = parser.parse_args(args)
+	
+	if args.rate != None:
+		set_rate_limit(args.rate, args.burst)
+	if args.connections != None:
+		set_host_concurrency(args.connections)
+	if args.restart and os.path.exists(args.journal):
+		os.unlink(args.journal)
+	
+	if args.timing != None:
+		import timing
+		timing.enable(sys.modules[__name__])
+	
+	pipeline = BillPipeline(fetchers=args.workers, parsers=args.parsers) if args.pipeline else None
+	changed = backfill_bills(args.first, args.last, args.force, args.workers, args.prefetch, args.journal, pipeline=pipeline)
+	if pipeline != None:
+		pipeline.close()
+	print changed, "bill files changed."
 	
+	if args.timing != None:
+		timing.report()
+		timing.write_metrics(args.timing)
+
+# The THOMAS pages that together make up the status of a bill, in the order
+# they are parsed, as (page name, URL suffix, description for error messages).
+bill_pages = (
+	("status", "@@@X", "bill status"),
+	("cosponsors", "@@@P", "cosponsors"),
+	("titles", "@@@T", "titles"),
+	("committees", "@@@C", "committees"),
+	("related", "@@@K", "related bills"),
+	("subjects", "@@@J", "subject terms"),
+	("amendments", "@@@A", "amendments"),
+	("summary", "@@@D&summ2=m&", "summary"),
+	)
+
+def bill_page_url(congress, bill_type, bill_number, suffix):
 	# map our bill type code to the THOMAS bill type code (namely, hr is confused with H.R.
 	# so make it hres).
 	bill_type2 = bill_type
 	if bill_type2 == "hr": bill_type2 = "hres"
 	
+	return "http://thomas.loc.gov/cgi-bin/bdquery/z?d%03d:%s%s:%s" % (congress, bill_type2, bill_number, suffix)
+
+def bill_file_name(congress, bill_type, bill_number):
+	return "../data/us/%d/bills/%s%d.xml" % (congress, bill_type, bill_number)
+
+# The sections of the bill XML, by tag, that are built from each page other than
+# the status page. The titles section also depends on the status page, which
+# gives the title to use if the titles page has none.
+bill_page_sections = {
+	"cosponsors": "cosponsors",
+	"titles": "titles",
+	"committees": "committees",
+	"related": "relatedbills",
+	"subjects": "subjects",
+	"amendments": "amendments",
+	"summary": "summary",
+	}
+
+def load_bill_sections(congress, bill_type, bill_number):
+	"""Returns a dict from tag to element of the top-level sections of the
+	existing XML file for a bill, or None if there is no file."""
+	fn = bill_file_name(congress, bill_type, bill_number)
+	if not os.path.exists(fn):
+		return None
+	try:
+		root = etree.parse(fn).getroot()
+	except etree.XMLSyntaxError:
+		return None
+	if root.get("session") != str(congress) or root.get("type") != bill_type or root.get("number") != str(bill_number):
+		return None
+	return dict((node.tag, node) for node in root)
+
+def parse_bill(congress, bill_type, bill_number, prefetch=False, oldhashes=None, pagehashes=None, changed=None):
+	"""Downloads and parses THOMAS bill status and summary files. Each page is
+	parsed line by line as it is downloaded. If prefetch is True, all of the
+	bill's pages are instead requested at once and each page is parsed as soon
+	as it (and the pages before it) arrive.
+	
+	The md5 of each page is stored by page name in pagehashes, if given. If
+	oldhashes gives the md5s of the pages when the bill's existing XML file was
+	made, sections of the file built only from unchanged pages are kept as they
+	are rather than parsed again.
+	
+	The XML is written to bills/<type><number>.xml and returned (but see
+	incremental_output). The file is
+	left untouched if its content is the same, and otherwise the bill's type and
+	number are appended to changed, if given."""
+	
+	if pagehashes == None:
+		pagehashes = { }
+	previous = load_bill_sections(congress, bill_type, bill_number) if oldhashes else None
+	
+	# Start downloading the pages, or, if we're not prefetching, set up to download
+	# each page only when it is needed.
+	pages = { }
+	for name, suffix, description in bill_pages:
+		url = bill_page_url(congress, bill_type, bill_number, suffix)
+		pages[name] = (url, description, download_async(url) if prefetch else None)
+	def get_page(name):
+		url, description, future = pages[name]
+		if future != None:
+			content, mtime = future.result()
+			lines = content.split("\n") if content else None
+		else:
+			lines, mtime = download(url, lines=True)
+		if not lines:
+			raise Exception("Failed to download %s page: %s" % (description, url))
+		
+		# If the page may be unchanged, read it all to hash it before deciding
+		# whether to parse it. Otherwise, hash it as it is parsed.
+		if previous != None and name in oldhashes:
+			lines = list(lines)
+			pagehashes[name] = md5_base64_lines(lines)
+			return lines, mtime, pagehashes[name] == oldhashes[name]
+		return hashed_lines(lines, pagehashes, name), mtime, False
+	def reuse(tag, unchanged):
+		if unchanged and tag in previous:
+			return previous[tag]
+		return None
+	
 	# Start with the All Actions page, from which we'll also grab basic metadata.
+	# If it hasn't changed, keep the sections built from it and parse it only if
+	# its title is needed for the titles section.
+	status_lines, mtime, status_unchanged = get_page("status")
+	kept = [reuse(tag, status_unchanged) for tag in ("state", "introduced", "actions")]
+	if None in kept:
+		status = parse_bill_status_page(status_lines, bill_type)
+		for line in status_lines: pass # read any lines the parser stopped before, to finish the hash
+	else:
+		status = None
+		state, intronode, actionsnode = kept
+		sponsornode = previous.get("sponsor")
 	
-	url = "http://thomas.loc.gov/cgi-bin/bdquery/z?d%03d:%s%s:@@@X" % (congress, bill_type2, bill_number)
-	content, mtime = download(url)
-	if not content:
-		raise Exception("Failed to download bill status page: " + url)
+	if status != None:
+		if status["sponsor"][0] == None:
+			sponsor = 0
+		else:
+			name, senrep, state, district = status["sponsor"]
+			sponsor = parse_name(name, status["introduced"], nameformat="lastfirst", role_type=senrep, state=state, district=district)
+		state, intronode, sponsornode = build_status_sections(status, sponsor)
+		actionsnode = None
 	
-	root = etree.Element("bill")
-	root.set("session", str(congress))
-	root.set("type", bill_type)
-	root.set("number", str(bill_number))
-	root.set("updated", format_datetime(mtime))
+	def section(name):
+		if name == "actions":
+			return actionsnode if actionsnode != None else build_actions(status["actions"])
+		lines, mtime, unchanged = get_page(name)
+		node = reuse(bill_page_sections[name], unchanged and (status_unchanged or name != "titles"))
+		if node == None:
+			if name == "titles":
+				title = status["title"] if status != None else parse_bill_status_page(status_lines, bill_type)["title"]
+			else:
+				title = None
+			data = parse_bill_page(congress, bill_type, name, lines)
+			for line in lines: pass # read any lines the parser stopped before, to finish the hash
+			node = build_bill_section(name, data, title=title)
+		return node
+	
+	# Each page is parsed only when its section is reached.
+	return write_bill(congress, bill_type, bill_number, bill_attributes(congress, bill_type, bill_number, mtime),
+		bill_sections(state, intronode, sponsornode, section), changed)
+
+# The top-level sections of the bill XML that follow the state, introduced and
+# sponsor sections, in document order, by the name of the page each is built
+# from. The actions are built from the status page.
+bill_section_order = ("cosponsors", "titles", "committees", "related", "subjects", "amendments", "actions", "summary")
+
+def bill_sections(state, intronode, sponsornode, section):
+	"""Yields the top-level sections of a bill's XML in document order: the
+	state, introduced and sponsor (if not None) sections, followed by
+	section(name) for each name in bill_section_order."""
+	yield state
+	yield intronode
+	if sponsornode != None:
+		yield sponsornode
+	for name in bill_section_order:
+		yield section(name)
+
+def bill_attributes(congress, bill_type, bill_number, mtime):
+	"""Returns the attributes of the root element of a bill's XML, given the
+	last modified time of its status page."""
+	return collections.OrderedDict([
+		("session", str(congress)),
+		("type", bill_type),
+		("number", str(bill_number)),
+		("updated", format_datetime(mtime)),
+		])
+
+def build_status_sections(status, sponsor):
+	"""Returns the state, introduced and sponsor sections of a bill's XML, built
+	from its parsed status page and the person id of its sponsor, or 0 if it
+	has none, in which case the sponsor section is None."""
+	if "Reserved for the" in status["title"]:
+		raise Exception("Skipping bill " + status["title"].lower())
+	
+	state_name, state_date = status["state"]
+	state = etree.Element("state")
+	state.set("datetime", format_datetime(state_date))
+	state.text = state_name
+	
+	intronode = etree.Element("introduced")
+	intronode.set("datetime", status["introduced"].isoformat())
+	
+	sponsornode = None
+	if sponsor != 0:
+		sponsornode = etree.Element("sponsor")
+		sponsornode.set("id", str(sponsor))
+	
+	return state, intronode, sponsornode
+
+def parse_bill_page(congress, bill_type, name, lines):
+	"""Parses the lines of one of the pages of a bill, by its name in bill_pages,
+	returning what the page's parser returns. The result is plain data, which
+	does not depend on the people database and can be pickled."""
+	if name == "status":
+		return parse_bill_status_page(lines, bill_type)
+	elif name == "cosponsors":
+		return parse_bill_cosponsors_page(lines)
+	elif name == "titles":
+		return parse_bill_titles_page(lines)
+	elif name == "committees":
+		return parse_bill_committees_page(lines, congress)
+	elif name == "related":
+		return parse_bill_related_bills_page(lines)
+	elif name == "subjects":
+		return parse_bill_subjects_page(lines)
+	elif name == "amendments":
+		return parse_bill_amendments_page(lines)
+	elif name == "summary":
+		return parse_bill_summary_page(lines)
+	raise ValueError("Unknown bill page: " + name)
+
+def build_bill_section(name, data, title=None, people=None):
+	"""Builds the section of a bill's XML for one of the pages in
+	bill_page_sections from what parse_bill_page returned for the page. The
+	titles section needs the title from the status page, and the cosponsors
+	section takes the cosponsors' person ids if they were already resolved
+	(see build_cosponsors)."""
+	if name == "cosponsors":
+		return build_cosponsors(data, people)
+	elif name == "titles":
+		return build_titles(data, title)
+	elif name == "committees":
+		return build_committees(data)
+	elif name == "related":
+		return build_related_bills(data)
+	elif name == "subjects":
+		return build_subjects(data)
+	elif name == "amendments":
+		return build_amendments(data)
+	elif name == "summary":
+		return build_summary(data)
+	raise ValueError("Unknown bill section: " + name)
+
+def write_bill(congress, bill_type, bill_number, attrib, sections, changed=None):
+	"""Saves the XML of a bill, made of a root element with the attributes in
+	attrib and the elements yielded by sections, and returns it, as parse_bill
+	does."""
+	try:
+		os.makedirs("../data/us/%d/bills" % congress)
+	except:
+		pass
+	
+	if incremental_output:
+		xml = None
+		written = save_bill_incremental(congress, bill_type, bill_number, attrib, sections)
+	else:
+		root = etree.Element("bill", attrib)
+		for node in sections:
+			node.tail = None
+			root.append(node)
+		xml = serialize_bill(root)
+		written = save_bill(congress, bill_type, bill_number, xml)
+	
+	if written and changed != None:
+		changed.append(bill_type + str(bill_number))
+	return xml
+
+def serialize_bill(root):
+	return etree.tostring(root, pretty_print=True)
+
+def save_bill(congress, bill_type, bill_number, xml):
+	"""Atomically writes the XML for a bill to its file, unless the file already
+	has exactly that content, so that consumers watching the files see only real
+	changes. Returns whether the file was written."""
+	fn = bill_file_name(congress, bill_type, bill_number)
+	if os.path.exists(fn):
+		with open(fn, "rb") as f:
+			if f.read() == xml:
+				return False
+	write_file_atomic(fn, xml)
+	return True
+
+def save_bill_incremental(congress, bill_type, bill_number, attrib, sections):
+	"""Like save_bill, but serializes each section of the bill to a temporary
+	file as soon as it is built, using lxml's incremental serializer, so that
+	the whole document is never held in memory. The bytes written are the same
+	as those of the pretty-printed document."""
+	fn = bill_file_name(congress, bill_type, bill_number)
+	tmp = fn + ".tmp"
+	try:
+		with open(tmp, "wb") as f:
+			with etree.xmlfile(f) as xf:
+				with xf.element("bill", attrib):
+					xf.write("\n")
+					for node in sections:
+						xf.write("  ")
+						indent(node, 1)
+						node.tail = "\n"
+						xf.write(node)
+			f.write("\n")
+			f.flush()
+			os.fsync(f.fileno())
+	except:
+		os.unlink(tmp)
+		raise
+	
+	if os.path.exists(fn) and filecmp.cmp(tmp, fn, shallow=False):
+		os.unlink(tmp)
+		return False
+	os.rename(tmp, fn)
+	return True
+
+def indent(node, level):
+	"""Adds whitespace to the node's descendants as pretty printing does when
+	the node is at the given depth in the document: the children of an element
+	are put on indented lines unless it contains any text at all. (xmlfile
+	would pretty print a node as if it were at the root.)"""
+	children = list(node)
+	if len(children) == 0 or node.text != None or [child for child in children if child.tail != None]:
+		return
+	node.text = "\n" + "  " * (level + 1)
+	for child in children:
+		indent(child, level + 1)
+		child.tail = "\n" + "  " * (level + 1)
+	children[-1].tail = "\n" + "  " * level
+
+status_sponsor_re = re.compile(r"<b>Sponsor: </b>(No Sponsor|<a [^>]+>(.*)</a>\s+\[((\w\w)(-(\d+))?)\])", re.I)
+status_introduced_re = re.compile(r"\(introduced ([\d\/]+)\)", re.I)
+status_title_re = re.compile(r"<B>(Latest )?Title:</B> (.+)", re.I)
+status_action_re = re.compile(r"<dt><strong>([\d/ :apm]+):</strong><dd>(.+)", re.I)
+action_link_re = re.compile(r"</?[Aa]( \S.*?)?>")
+action_references_re = re.compile("\s+\((.*)\)\s*$")
+
+def parse_bill_status_page(lines, bill_type):
+	"""Parses the All Actions page of a bill, returning a dict with the sponsor
+	as (name, role type, state, district), the introduced date, the bill title,
+	the current state as (state, date), and the list of actions as (date,
+	indentation, text, attrs, considerations)."""
 	
 	sponsor = None
 	introduced_date = None
@@ -156,10 +1015,10 @@ def parse_bill(congress, bill_type, bill_number):
 	action_indentation = 0
 	state_name, state_date = None, None
 	
-	for line in content.split("\n"):
+	for line in lines:
 		# Match Sponsor line, which can be either No Sponsor or a name/state/district.
 		# Parse the name later, after we find the introduced date.
-		m = re.search(r"<b>Sponsor: </b>(No Sponsor|<a [^>]+>(.*)</a>\s+\[((\w\w)(-(\d+))?)\])", line, re.I)
+		m = status_sponsor_re.search(line)
 		if m != None:
 			if m.group(1) == "No Sponsor":
 				sponsor = (None, None, None, None)
@@ -176,7 +1035,7 @@ def parse_bill(congress, bill_type, bill_number):
 				sponsor = (name, senrep, m.group(4), m.group(6)) # name, type, state, district
 			
 		# Match the line giving the date of introduction.
-		m = re.search(r"\(introduced ([\d\/]+)\)", line, re.I)
+		m = status_introduced_re.search(line)
 		if m != None:
 			introduced_date = datetime.datetime.strptime(m.group(1), "%m/%d/%Y").date()
 			state_name, state_date = ("INTRODUCED", introduced_date)
@@ -184,18 +1043,18 @@ def parse_bill(congress, bill_type, bill_number):
 		# Match the Title line, which we use 1) to check if this is a bill number reserved for the speaker,
 		# 2) for determining whether this is a proposal for a constitutional amendment for parsing
 		# vote status, and 3) as a backup in case the THOMAS Titles page cannot be parsed.
-		m = re.search(r"<B>(Latest )?Title:</B> (.+)", line, re.I)
+		m = status_title_re.search(line)
 		if m != None:
 			title = m.group(2)
 		
 		# Match action lines.
-		m = re.search(r"<dt><strong>([\d/ :apm]+):</strong><dd>(.+)", line, re.I)
+		m = status_action_re.search(line)
 		if m != None:
 			# Indentation indicates committee action.
 			if line.startswith("<dl>"): action_indentation += 1
 			if line.startswith("</dl>"): action_indentation -= 1
 			
-			text = re.sub(r"</?[Aa]( \S.*?)?>", "", m.group(2))
+			text = action_link_re.sub("", m.group(2))
 	
 			# The date can be either a date or a date and time.
 			try:
@@ -209,7 +1068,7 @@ def parse_bill(congress, bill_type, bill_number):
 			
 			# references are given in parentheses at the end
 			considerations = []
-			m = re.search("\s+\((.*)\)\s*$", text)
+			m = action_references_re.search(text)
 			if m:
 				text = text[0:m.start()] + text[m.end():]
 				for con in m.group(1).split("; "):
@@ -229,47 +1088,45 @@ def parse_bill(congress, bill_type, bill_number):
 			
 	if sponsor == None:
 		raise Exception("No sponsor line.")
-	elif sponsor[0] == None:
-		sponsor = 0
-	else:
-		sponsor = parse_name(sponsor[0], introduced_date, nameformat="lastfirst", role_type=sponsor[1], state=sponsor[2], district=sponsor[3])
-		
-	if "Reserved for the" in title:
-		raise Exception("Skipping bill " + title.lower())
-	
-	# Start building the XML
-	
-	state = etree.Element("state")
-	state.set("datetime", format_datetime(state_date))
-	state.text = state_name
-	root.append(state)
-	
-	intronode = etree.Element("introduced")
-	intronode.set("datetime", introduced_date.isoformat())
-	root.append(intronode)
-	
-	if sponsor != 0:
-		sponsornode = etree.Element("sponsor")
-		sponsornode.set("id", str(sponsor))
-		root.append(sponsornode)
 	
-	# Download and parse the cosponsors page.
+	return {
+		"sponsor": sponsor,
+		"introduced": introduced_date,
+		"title": title,
+		"state": (state_name, state_date),
+		"actions": actions,
+		}
 
-	cosponsors = etree.Element("cosponsors")
-	root.append(cosponsors)
+cosponsor_re = re.compile(r"(<br ?/>)?<a href=[^>]+>(Rep|Sen) (.+)</a> \[([A-Z\d\-]+)\] - (\d\d?/\d\d?/\d\d\d\d)(\(withdrawn - (\d\d?/\d\d?/\d\d\d\d)\))?", re.I)
 
-	url = url.replace("@@@X", "@@@P")
-	content, mtime = download(url)
-	if not content:
-		raise Exception("Failed to download cosponsors page: " + url)
-	
-	content = re.sub(r"(\[[A-Z\d\-]+\])\n( - \d\d?\/)", lambda m : m.group(1) + m.group(2), content) # bring cosponsorship date onto previous line
-	content = re.sub(r"</br>", "\n", content)
+cosponsor_district_end_re = re.compile(r"\[[A-Z\d\-]+\]$")
+cosponsor_date_start_re = re.compile(r" - \d\d?\/")
+
+def cosponsor_lines(lines):
+	"""Brings cosponsorship dates that are on a line of their own onto the previous
+	line, and splits lines at </br>."""
+	prev = None
+	for line in lines:
+		if prev != None and prev.endswith("]") and cosponsor_date_start_re.match(line) and cosponsor_district_end_re.search(prev):
+			prev += line
+			continue
+		if prev != None:
+			for l in prev.split("</br>"):
+				yield l
+		prev = line
+	if prev != None:
+		for l in prev.split("</br>"):
+			yield l
+
+def parse_bill_cosponsors_page(lines):
+	"""Parses the cosponsors page of a bill, returning a list of (name, role type,
+	state, district, joined date, withdrawn date) with names still unresolved."""
 	
-	for line in content.split("\n"):
-		m = re.search(r"(<br ?/>)?<a href=[^>]+>(Rep|Sen) (.+)</a> \[([A-Z\d\-]+)\] - (\d\d?/\d\d?/\d\d\d\d)(\(withdrawn - (\d\d?/\d\d?/\d\d\d\d)\))?", line, re.I)
+	cosponsors = []
+	for line in cosponsor_lines(lines):
+		m = cosponsor_re.search(line)
 		if m:
-			title, name, state_district, join_date, withdrawn_date = m.group(2), m.group(3), m.group(4), m.group(5), m.group(7)
+			senrep, name, state_district, join_date, withdrawn_date = m.group(2), m.group(3), m.group(4), m.group(5), m.group(7)
 			
 			join_date = datetime.datetime.strptime(join_date, "%m/%d/%Y").date()
 			if withdrawn_date != None:
@@ -283,34 +1140,54 @@ def parse_bill(congress, bill_type, bill_number):
 			else:
 				state, district = state_district.split("-")
 			
-			person = parse_name(name, join_date, nameformat="lastfirst", role_type=title.lower(), state=state, district=district)
-			
-			csp = etree.Element("cosponsor")
-			csp.set("id", str(person))
-			csp.set("joined", join_date.isoformat())
-			if withdrawn_date: csp.set("withdrawn", withdrawn_date.isoformat())
-			cosponsors.append(csp)
-
-
-	# Download and parse the titles page.
-	
+			cosponsors.append((name, senrep.lower(), state, district, join_date, withdrawn_date))
 	
-	titles = etree.Element("titles")
-	root.append(titles)
+	return cosponsors
 
-	url = url.replace("@@@P", "@@@T")
-	content, mtime = download(url)
-	if not content:
-		raise Exception("Failed to download titles page: " + url)
+def build_cosponsors(cosponsors, people=None):
+	"""Builds the cosponsors section from the list parse_bill_cosponsors_page
+	returns. people is the list parse_names returned for the cosponsors, if
+	their names were already resolved."""
+	# Resolve all of the names at once.
+	if people == None:
+		people = parse_names([(name, join_date, senrep, state, district) for name, senrep, state, district, join_date, withdrawn_date in cosponsors], nameformat="lastfirst")
+	for person in people:
+		if isinstance(person, Exception):
+			raise person
 	
-	content = re.sub(r"(<I>)?(<br/>|<p>)", lambda m : "\n" + ("" if not m.group(1) else m.group(1)), content)
+	node = etree.Element("cosponsors")
+	for (name, senrep, state, district, join_date, withdrawn_date), person in zip(cosponsors, people):
+		csp = etree.Element("cosponsor")
+		csp.set("id", str(person))
+		csp.set("joined", join_date.isoformat())
+		if withdrawn_date: csp.set("withdrawn", withdrawn_date.isoformat())
+		node.append(csp)
+	return node
+
+title_type_re = re.compile(r"<li>(.*) title(\(s\))?( as ([\w ]*))?:", re.I)
+title_break_re = re.compile(r"(<I>)?(<br/>|<p>)")
+
+def title_lines(lines):
+	"""Splits lines further at <br/> and <p>, moving an <I> just before the break
+	onto the new line."""
+	for line in lines:
+		if "<br/>" not in line and "<p>" not in line:
+			yield line
+			continue
+		line = title_break_re.sub(lambda m : "\n" + ("" if not m.group(1) else m.group(1)), line)
+		for l in line.split("\n"):
+			yield l
+
+def parse_bill_titles_page(lines):
+	"""Parses the titles page of a bill, returning a list of (type, as, partial, title)."""
 	
+	titles = []
 	title_type, title_as = None, None
-	for line in content.split("\n"):
+	for line in title_lines(lines):
 		if line == "</ul>":
 			break
 		
-		m = re.search(r"<li>(.*) title(\(s\))?( as ([\w ]*))?:", line, re.I)
+		m = title_type_re.search(line)
 		if m:
 			title_type, title_as = m.group(1).lower(), m.group(4).lower()
 		
@@ -323,43 +1200,42 @@ def parse_bill(congress, bill_type, bill_number):
 			line = line.replace("<I>", "")
 			line = line.replace("</I>", "")
 			line = line.replace(" (identified by CRS)", "")
-				
-			t = etree.Element("title")
-			t.set("type", title_type)
-			t.set("as", title_as)
-			t.set("partial", "yes" if partial else "no")
-			t.text = line.strip()
-			titles.append(t)
-	
-	if len(titles) == 0:
-		# Sometimes titles aren't available.
-		t = etree.Element("title")
-		t.set("type", "official")
-		t.set("as", "introduced")
-		t.set("partial", "no")
-		t.text = title
-		titles.append(t)
-	
+			
+			titles.append((title_type, title_as, partial, line.strip()))
 	
-	# Download and parse the committees page.
+	return titles
+
+def build_titles(titles, title):
+	node = etree.Element("titles")
 	
+	if len(titles) == 0:
+		# Sometimes titles aren't available, so fall back to the title on the status page.
+		titles = [("official", "introduced", False, title)]
 	
-	committees = etree.Element("committees")
-	root.append(committees)
+	for title_type, title_as, partial, text in titles:
+		t = etree.Element("title")
+		t.set("type", title_type)
+		t.set("as", title_as)
+		t.set("partial", "yes" if partial else "no")
+		t.text = text
+		node.append(t)
+	return node
 
-	url = url.replace("@@@T", "@@@C")
-	content, mtime = download(url)
-	if not content:
-		raise Exception("Failed to download committees page: " + url)
+committee_re = re.compile(r'<a href="/cgi-bin/bdquery(tr)?/R\?[^"]+">(.*)</a>\s*</td><td width="65\%">(.+)</td></tr>', re.I)
+whitespace_re = re.compile(r"\s+")
+
+def parse_bill_committees_page(lines, congress):
+	"""Parses the committees page of a bill, returning a list of (committee code, activity)."""
 	
+	committees = []
 	last_committee = None
-	for line in content.split("\n"):
-		m = re.search(r'<a href="/cgi-bin/bdquery(tr)?/R\?[^"]+">(.*)</a>\s*</td><td width="65\%">(.+)</td></tr>', line, re.I)
+	for line in lines:
+		m = committee_re.search(line)
 		if m:
 			committee = m.group(2)
 			activity = m.group(3)
 			
-			committee = re.sub(r"\s+", " ", committee).strip()
+			committee = whitespace_re.sub(" ", committee).strip()
 	
 			if not committee.startswith("Subcommittee on "):
 				last_committee = committee
@@ -368,136 +1244,141 @@ def parse_bill(congress, bill_type, bill_number):
 				committee = committee[len("Subcommittee on "):]
 				committee = find_committee(last_committee, committee, congress)
 			
-			cx = etree.Element("committee")
-			cx.set("code", committee)
-			cx.set("activity", activity)
-			committees.append(cx)
-
-
-	# Download and parse related bills page.
-	
-	related_bill_type_map = { }
-	for a, b in thomas_bill_type_codes:
-		related_bill_type_map[a] = b
-	related_bill_relationship_map = {
-		"Identical bill identified by CRS": "identical",
-		"Related bill identified by CRS": "related",
-		"Related bill as identified by the House Clerk's office": "related",
-		"passed in House in lieu of this bill": "supersedes",
-		"passed in Senate in lieu of this bill": "supersedes",
-		}
-		
-	related_bills = etree.Element("relatedbills")
-	root.append(related_bills)
+			committees.append((committee, activity))
+	
+	return committees
+
+def build_committees(committees):
+	node = etree.Element("committees")
+	for committee, activity in committees:
+		cx = etree.Element("committee")
+		cx.set("code", committee)
+		cx.set("activity", activity)
+		node.append(cx)
+	return node
 
-	url = url.replace("@@@C", "@@@K")
-	content, mtime = download(url)
-	if not content:
-		raise Exception("Failed to download related bills page: " + url)
+related_bill_relationship_map = {
+	"Identical bill identified by CRS": "identical",
+	"Related bill identified by CRS": "related",
+	"Related bill as identified by the House Clerk's office": "related",
+	"passed in House in lieu of this bill": "supersedes",
+	"passed in Senate in lieu of this bill": "supersedes",
+	}
+
+related_bill_re = re.compile(r'<a href="/cgi-bin/bdquery(tr)?/z\?d(\d\d\d):(\w+)(\d\d\d\d\d):">.*</a></td><td>(.*)</td></tr>', re.I)
+
+def parse_bill_related_bills_page(lines):
+	"""Parses the related bills page of a bill, returning a list of (relationship,
+	congress, bill type, bill number)."""
+	
+	related_bill_type_map = dict(thomas_bill_type_codes)
 	
-	for line in content.split("\n"):
-		m = re.search(r'<a href="/cgi-bin/bdquery(tr)?/z\?d(\d\d\d):(\w+)(\d\d\d\d\d):">.*</a></td><td>(.*)</td></tr>', line, re.I)
+	related_bills = []
+	for line in lines:
+		m = related_bill_re.search(line)
 		if m:
 			related_bill_congress = int(m.group(2))
 			related_bill_type = related_bill_type_map[m.group(3)]
 			related_bill_number = int(m.group(4))
-			if re.search("Rule related to", m.group(5)):
+			if "Rule related to" in m.group(5):
 				related_bill_relationship = "rule"
 			else:
 				related_bill_relationship = related_bill_relationship_map[m.group(5)]
 			
-			rb = etree.Element("bill")
-			rb.set("relation", related_bill_relationship)
-			rb.set("session", str(related_bill_congress))
-			rb.set("type", related_bill_type)
-			rb.set("number", str(related_bill_number))
-			related_bills.append(rb)
-			
-	
-	# Download and parse CRS subject terms page.
+			related_bills.append((related_bill_relationship, related_bill_congress, related_bill_type, related_bill_number))
 	
-	
-	subjects = etree.Element("subjects")
-	root.append(subjects)
+	return related_bills
+
+def build_related_bills(related_bills):
+	node = etree.Element("relatedbills")
+	for relationship, congress, bill_type, bill_number in related_bills:
+		rb = etree.Element("bill")
+		rb.set("relation", relationship)
+		rb.set("session", str(congress))
+		rb.set("type", bill_type)
+		rb.set("number", str(bill_number))
+		node.append(rb)
+	return node
+
+subject_re = re.compile(r'<a href="/cgi-bin/bdquery/\?.*@FIELD\(FLD001.*\)">(.*)</a> ', re.I)
 
-	url = url.replace("@@@K", "@@@J")
-	content, mtime = download(url)
-	if not content:
-		raise Exception("Failed to download subject terms page: " + url)
+def parse_bill_subjects_page(lines):
+	"""Parses the CRS subject terms page of a bill, returning a list of terms."""
 	
-	for line in content.split("\n"):
-		m = re.search(r'<a href="/cgi-bin/bdquery/\?.*@FIELD\(FLD001.*\)">(.*)</a> ', line, re.I)
+	terms = []
+	for line in lines:
+		m = subject_re.search(line)
 		if m:
 			term = m.group(1)
-			term = re.sub(r"\s+", " ", term).strip()
-			
-			s = etree.Element("term")
-			s.set("name", term)
-			subjects.append(s)
-			
+			term = whitespace_re.sub(" ", term).strip()
+			terms.append(term)
 	
-	# Download and parse amendments page.
+	return terms
+
+def build_subjects(terms):
+	node = etree.Element("subjects")
+	for term in terms:
+		s = etree.Element("term")
+		s.set("name", term)
+		node.append(s)
+	return node
+
+amendment_re = re.compile(r'<a href="/cgi-bin/bdquery/z\?d\d+:([HS])([ZP])(\d+):">[HS]\.AMDT\.\d+</a>', re.I)
+
+def parse_bill_amendments_page(lines):
+	"""Parses the amendments page of a bill, returning a list of amendment numbers
+	like h123."""
 	
+	amendments = []
+	for line in lines:
+		for m in amendment_re.finditer(line):
+			amendment_chamber = m.group(1).lower()
+			amendment_number = int(m.group(3))
+			amendments.append(amendment_chamber + str(amendment_number))
 	
-	amendments = etree.Element("amendments")
-	root.append(amendments)
+	return amendments
 
-	url = url.replace("@@@J", "@@@A")
-	content, mtime = download(url)
-	if not content:
-		raise Exception("Failed to download amendments page: " + url)
-	
-	for m in re.finditer(r'<a href="/cgi-bin/bdquery/z\?d\d+:([HS])([ZP])(\d+):">[HS]\.AMDT\.\d+</a>', content, re.I):
-		amendment_chamber = m.group(1).lower()
-		amendment_number = int(m.group(3))
-		
+def build_amendments(amendments):
+	node = etree.Element("amendments")
+	for amendment in amendments:
 		a = etree.Element("amendment")
-		a.set("number", amendment_chamber + str(amendment_number))
-		amendments.append(a)
-
-
-	# Put the actions in here.
+		a.set("number", amendment)
+		node.append(a)
+	return node
 
-	actionsnode = etree.Element("actions")
-	root.append(actionsnode)
+def build_actions(actions):
+	node = etree.Element("actions")
 	for adate, aindent, text, attrs, considerations in actions:
-		nodename = "action"
-		if "nodename" in attrs:
-			nodename = attrs["nodename"]
-			del attrs["nodename"]
+		attrs = dict(attrs)
+		nodename = attrs.pop("nodename", "action")
 			
-		node = etree.Element(nodename)
-		actionsnode.append(node)
+		anode = etree.Element(nodename)
+		node.append(anode)
 		
-		node.set("datetime", format_datetime(adate))
+		anode.set("datetime", format_datetime(adate))
 		
 		for k, v in sorted(attrs.items()):
 			if v == None:
 				continue
-			node.set(k, v)
+			anode.set(k, v)
 		
 		n = etree.Element("text")
 		n.text = text
-		node.append(n)
+		anode.append(n)
 		
 		for c in considerations:
 			n = etree.Element("reference")
 			n.set("label", c[0])
 			n.set("ref", c[1])
-			node.append(n)
-	
-	
-	# Download the CRS summary text.
+			anode.append(n)
+	return node
 
-
-	url = url.replace("@@@A", "@@@D&summ2=m&")
-	content, mtime = download(url)
-	if not content:
-		raise Exception("Failed to download summary page: " + url)
+def parse_bill_summary_page(lines):
+	"""Parses the CRS summary page of a bill, returning the summary HTML."""
 	
 	mode = 0
-	summary = ""
-	for line in content.split("\n"):
+	summary = []
+	for line in lines:
 		if mode == 1:
 			if "<hr" in line:
 				mode = 0
@@ -505,216 +1386,312 @@ def parse_bill(congress, bill_type, bill_number):
 				break
 			else:
 				line = re.sub(r"<a.*?>(.*?)</a>", lambda m : m.group(1), line, re.I)
-				summary += line + "\n"
+				summary.append(line)
+				summary.append("\n")
 		elif "SUMMARY AS OF" in line:
 			mode = 1
 	
-	summary = re.sub(r"\(There (is|are) \d+ other summar(y|ies)\)", "", summary, re.I)
-	root.append(fragment_fromstring(summary, create_parent="summary"))
+	summary = re.sub(r"\(There (is|are) \d+ other summar(y|ies)\)", "", "".join(summary), re.I)
+	return summary
 
-	try:
-		os.makedirs("../data/us/%d/bills" % congress)
-	except:
-		pass
+def build_summary(summary):
+	from lxml.html import fragment_fromstring # lxml.html is slow to import
+	return fragment_fromstring(summary, create_parent="summary")
 
-	return etree.tostring(root, pretty_print=True)
 
+# Bill actions are classified by a table of rules, applied in order, each of
+# which sets attributes on the action when its pattern matches the line. Later
+# rules override earlier ones. Every rule also lists lowercase keywords, at least
+# one of which appears in any line its pattern can match. A single scan of the
+# line for all of the keywords at once picks out the rules worth trying, so most
+# lines are classified without running more than one or two of the patterns.
+
+amendment_action_re = re.compile("r^(H|S)\.Amdt\.(\d+)", re.I)
+
+house_vote_re = re.compile(r"(On passage|On motion to suspend the rules and pass the bill|On motion to suspend the rules and agree to the resolution|On motion to suspend the rules and pass the resolution|On agreeing to the resolution|On agreeing to the conference report|Two-thirds of the Members present having voted in the affirmative the bill is passed,?|On motion that the House agree to the Senate amendments?|On motion that the House suspend the rules and concur in the Senate amendments?|On motion that the House suspend the rules and agree to the Senate amendments?|On motion that the House agree with an amendment to the Senate amendments?|House Agreed to Senate Amendments.*?|Passed House)(, the objections of the President to the contrary notwithstanding.?)?(, as amended| \(Amended\))? (Passed|Failed|Agreed to|Rejected)? ?(by voice vote|without objection|by (the Yeas and Nays|Yea-Nay Vote|recorded vote)((:)? \(2/3 required\))?: \d+ - \d+(, \d+ Present)? [ \)]*\((Roll no\.|Record Vote No:) \d+\))", re.I)
+house_vote_passed_re = re.compile(r"Passed House|House Agreed to", re.I)
+house_vote_pass_re = re.compile(r"Pass|Agreed", re.I)
+house_vote_pingpong_re = re.compile(r"(agree (with an amendment )?to|concur in) the Senate amendment", re.I)
+house_vote_roll_re = re.compile(r"\((Roll no\.|Record Vote No:) (\d+)\)", re.I)
+
+def action_house_vote(m, attrs, line, bill_type, prev_state, title):
+	motion, isoverride, asamended, passfail, how = m.group(1), m.group(2), m.group(3), m.group(4), m.group(5)
+
+	if house_vote_passed_re.search(motion):
+		passfail = 'pass'
+	elif house_vote_pass_re.search(passfail):
+		passfail = 'pass'
+	else:
+		passfail = 'fail'
+
+	if "Two-thirds of the Members present" in motion:
+		isoverride = True
+
+	if isoverride:
+		votetype = "override"
+	elif house_vote_pingpong_re.search(line):
+		votetype = "pingpong"
+	elif "conference report" in line.lower():
+		votetype = "conference"
+	elif bill_type[0] == "h":
+		votetype = "vote"
+	else:
+		votetype = "vote2"
+
+	roll = None
+	m = house_vote_roll_re.search(how)
+	if m != None:
+		roll = m.group(2)
+
+	suspension = None
+	if roll and "On motion to suspend the rules" in motion:
+		suspension = True
+
+	attrs["nodename"] = "vote"
+	attrs["votetype"] = votetype
+	attrs["how"] = how
+	if roll:
+		attrs["roll"] = roll
+
+	# get the new state of the bill after this vote
+	new_state = get_vote_resulting_state(votetype, "h", passfail=="pass", bill_type, suspension, asamended, title, prev_state)
+	if new_state:
+		attrs["state"] = new_state
+
+house_special_rule_re = re.compile(r"Passed House pursuant to", re.I)
+
+def action_house_special_rule(m, attrs, line, bill_type, prev_state, title):
+	votetype = "vote" if (bill_type[0] == "h") else "vote2"
+	attrs["nodename"] = "vote"
+	attrs["votetype"] = votetype
+	attrs["how"] = "by special rule"
+
+	# get the new state of the bill after this vote
+	new_state = get_vote_resulting_state(votetype, "h", True, bill_type, False, False, title, prev_state)
+
+	if new_state:
+		attrs["state"] = new_state
+
+senate_vote_re = re.compile(r"(Passed Senate|Failed of passage in Senate|Resolution agreed to in Senate|Received in the Senate, considered, and agreed to|Submitted in the Senate, considered, and agreed to|Introduced in the Senate, read twice, considered, read the third time, and passed|Received in the Senate, read twice, considered, read the third time, and passed|Senate agreed to conference report|Cloture \S*\s?on the motion to proceed .*?not invoked in Senate|Cloture on the bill not invoked in Senate|Cloture on the bill invoked in Senate|Cloture on the motion to proceed to the bill invoked in Senate|Cloture on the motion to proceed to the bill not invoked in Senate|Senate agreed to House amendment|Senate concurred in the House amendment)(,?.*,?) (without objection|by Unanimous Consent|by Voice Vote|by Yea-Nay( Vote)?\. \d+\s*-\s*\d+\. Record Vote (No|Number): \d+)", re.I)
+senate_vote_pass_re = re.compile("passed|agreed|concurred|bill invoked", re.I)
+senate_vote_pingpong_re = re.compile("Senate agreed to House amendment|Senate concurred in the House amendment", re.I)
+senate_vote_roll_re = re.compile(r"Record Vote (No|Number): (\d+)", re.I)
+senate_vote_amended_re = re.compile(r"with amendments|with an amendment", re.I)
+
+def action_senate_vote(m, attrs, line, bill_type, prev_state, title):
+	motion, extra, how = m.group(1), m.group(2), m.group(3)
+	roll = None
+
+	if senate_vote_pass_re.search(motion):
+		passfail = "pass"
+	else:
+		passfail = "fail"
+
+	lmotion = motion.lower()
+	votenodename = "vote"
+	if "over veto" in extra.lower():
+		votetype = "override"
+	elif "conference report" in lmotion:
+		votetype = "conference"
+	elif "cloture" in lmotion:
+		votetype = "cloture"
+		votenodename = "vote-aux" # because it is not a vote on passage
+	elif senate_vote_pingpong_re.search(motion):
+		votetype = "pingpong"
+	elif bill_type[0] == "s":
+		votetype = "vote"
+	else:
+		votetype = "vote2"
+
+	m = senate_vote_roll_re.search(how)
+	if m != None:
+		roll = m.group(2)
+		how = "roll"
+
+	asamended = False
+	if senate_vote_amended_re.search(extra):
+		asamended = True
+
+	attrs["nodename"] = votenodename
+	attrs["votetype"] = votetype
+	attrs["how"] = how
+	if roll:
+		attrs["roll"] = roll
+
+	# get the new state of the bill after this vote
+	new_state = get_vote_resulting_state(votetype, "s", passfail=="pass", bill_type, False, asamended, title, prev_state)
+
+	if new_state:
+		attrs["state"] = new_state
+
+# TODO: Make a new state for this as pre-reported.
+calendar_re = re.compile(r"Placed on (the )?([\w ]+) Calendar( under ([\w ]+))?[,\.] Calendar No\. (\d+)\.|Committee Agreed to Seek Consideration Under Suspension of the Rules|Ordered to be Reported", re.I)
+
+def action_calendar(m, attrs, line, bill_type, prev_state, title):
+	# TODO: This makes no sense.
+	if prev_state in ("INTRODUCED", "REFERRED"):
+		attrs["state"] = "REPORTED"
+
+	attrs["nodename"] = "calendar"
+
+	# TODO: Useless.
+	attrs["calendar"] = m.group(2)
+	attrs["under"] = m.group(4)
+	attrs["number"] = m.group(5)
+
+reported_re = re.compile(r"Committee on (.*)\. Reported by", re.I)
+
+def action_reported(m, attrs, line, bill_type, prev_state, title):
+	attrs["nodename"] = "reported"
+	attrs["committee"] = m.group(1)
+	if prev_state in ("INTRODUCED", "REFERRED"):
+		attrs["state"] = "REPORTED"
+
+discharged_re = re.compile(r"Committee on (.*)\. Discharged (by Unanimous Consent)?", re.I)
+
+def action_discharged(m, attrs, line, bill_type, prev_state, title):
+	attrs["committee"] = m.group(1)
+	attrs["nodename"] = "discharged"
+	if prev_state in ("INTRODUCED", "REFERRED"):
+		attrs["state"] = "REPORTED"
+
+topresident_re = re.compile("Cleared for White House|Presented to President", re.I)
+
+def action_topresident(m, attrs, line, bill_type, prev_state, title):
+	attrs["nodename"] = "topresident"
+
+signed_re = re.compile("Signed by President", re.I)
+
+def action_signed(m, attrs, line, bill_type, prev_state, title):
+	attrs["nodename"] = "signed"
+
+pocket_vetoed_re = re.compile("Pocket Vetoed by President", re.I)
+
+def action_pocket_vetoed(m, attrs, line, bill_type, prev_state, title):
+	attrs["nodename"] = "vetoed"
+	attrs["pocket"] = "1"
+	attrs["state"] = "VETOED:POCKET"
+
+vetoed_re = re.compile("Vetoed by President", re.I)
+
+def action_vetoed(m, attrs, line, bill_type, prev_state, title):
+	attrs["nodename"] = "vetod"
+	attrs["state"] = "PROV_KILL:VETO'"
+
+enacted_re = re.compile("Became (Public|Private) Law No: ([\d\-]+)\.", re.I)
+
+def action_enacted(m, attrs, line, bill_type, prev_state, title):
+	attrs["nodename"] = "enacted"
+	if prev_state != "PROV_KILL:VETO" and not prev_state.startswith("VETOED:"):
+		attrs["state"] = "ENACTED:SIGNED"
+	else:
+		attrs["state"] = "ENACTED:VETO_OVERRIDE"
+
+referral_re = re.compile(r"Referred to (the )?((House|Senate|Committee) [^\.]+).?", re.I)
+subcommittee_referral_re = re.compile(r"Referred to the Subcommittee on (.*[^\.]).?", re.I)
+senate_referral_re = re.compile(r"Received in the Senate and referred to (the )?(.*[^\.]).?", re.I)
+
+def action_referral(m, attrs, line, bill_type, prev_state, title):
+	attrs["nodename"] = "referral"
+	attrs["committee"] = m.group(2)
+	if prev_state == "INTRODUCED":
+		attrs["state"] = "REFERRED"
+
+def action_subcommittee_referral(m, attrs, line, bill_type, prev_state, title):
+	attrs["nodename"] = "referral"
+	attrs["subcommittee"] = m.group(1)
+	if prev_state == "INTRODUCED":
+		attrs["state"] = "REFERRED"
+
+def action_senate_referral(m, attrs, line, bill_type, prev_state, title):
+	attrs["nodename"] = "referral"
+	attrs["committee"] = m.group(2)
+
+# (keywords, pattern, handler)
+action_rules = (
+	(("voice vote", "without objection", "roll no.", "record vote no:"), house_vote_re, action_house_vote),
+	(("passed house pursuant to",), house_special_rule_re, action_house_special_rule),
+	(("without objection", "unanimous consent", "voice vote", "yea-nay"), senate_vote_re, action_senate_vote),
+	(("calendar", "suspension of the rules", "ordered to be reported"), calendar_re, action_calendar),
+	(("reported by",), reported_re, action_reported),
+	(("discharged",), discharged_re, action_discharged),
+	(("cleared for white house", "presented to president"), topresident_re, action_topresident),
+	(("signed by president",), signed_re, action_signed),
+	(("pocket vetoed by president",), pocket_vetoed_re, action_pocket_vetoed),
+	(("vetoed by president",), vetoed_re, action_vetoed),
+	(("law no:",), enacted_re, action_enacted),
+	(("referred to",), referral_re, action_referral),
+	(("referred to",), subcommittee_referral_re, action_subcommittee_referral),
+	(("received in the senate and referred to",), senate_referral_re, action_senate_referral),
+	)
+
+def has_keyword(text, keywords):
+	for keyword in keywords:
+		if keyword in text:
+			return True
+	return False
+
+def keyword_pattern(keywords):
+	"""Returns a regular expression matching any of the keywords, with common
+	prefixes factored out so that the regex engine can reject most positions in
+	a line after looking at a single character."""
+	branches = { }
+	empty = False
+	for k in keywords:
+		if k == "":
+			empty = True
+		else:
+			branches.setdefault(k[0], []).append(k[1:])
+	alternatives = [re.escape(c) + keyword_pattern(branches[c]) for c in sorted(branches)]
+	if len(alternatives) == 0:
+		return ""
+	if len(alternatives) == 1 and not empty:
+		return alternatives[0]
+	return "(?:" + "|".join(alternatives) + ")" + ("?" if empty else "")
+
+def compile_action_rules(rules):
+	"""Returns a pattern matching any of the rules' keywords and a map from each
+	keyword to the indexes of the rules it selects. Where one keyword begins another,
+	the pattern matches the longer, so a keyword also selects the rules of the
+	keywords it contains."""
+	keywords = set([k for rule in rules for k in rule[0]])
+	dispatch = { }
+	for k in keywords:
+		dispatch[k] = tuple([i for i, rule in enumerate(rules) if has_keyword(k, rule[0])])
+	return re.compile(keyword_pattern(keywords)), dispatch
+
+action_keyword_scanner, action_keyword_dispatch = compile_action_rules(action_rules)
 
 def parse_bill_action(line, bill_type, prev_state, title):
 	"""Parse a THOMAS bill action line. Returns attributes to be set in the XML file on the action line."""
-	
+
 	attrs = { }
-	
+
 	# If a line starts with an amendment number, this action is on the amendment and cannot
 	# be parsed yet.
-	m = re.match("r^(H|S)\.Amdt\.(\d+)", line, re.I)
+	m = amendment_action_re.match(line)
 	if m != None:
 		# Process actions specific to amendments separately.
 		attrs["amendment"] = m.group(1).lower() + m.group(2)
-	
+		return attrs
+
 	# Otherwise, parse the action line for key actions.
-	else:
-			# A House Vote.
-			line = re.sub(", the Passed", ", Passed", line); # 106 h4733 and others
-			m = re.search(r"(On passage|On motion to suspend the rules and pass the bill|On motion to suspend the rules and agree to the resolution|On motion to suspend the rules and pass the resolution|On agreeing to the resolution|On agreeing to the conference report|Two-thirds of the Members present having voted in the affirmative the bill is passed,?|On motion that the House agree to the Senate amendments?|On motion that the House suspend the rules and concur in the Senate amendments?|On motion that the House suspend the rules and agree to the Senate amendments?|On motion that the House agree with an amendment to the Senate amendments?|House Agreed to Senate Amendments.*?|Passed House)(, the objections of the President to the contrary notwithstanding.?)?(, as amended| \(Amended\))? (Passed|Failed|Agreed to|Rejected)? ?(by voice vote|without objection|by (the Yeas and Nays|Yea-Nay Vote|recorded vote)((:)? \(2/3 required\))?: \d+ - \d+(, \d+ Present)? [ \)]*\((Roll no\.|Record Vote No:) \d+\))", line, re.I)
-			if m != None:
-				motion, isoverride, asamended, passfail, how = m.group(1), m.group(2), m.group(3), m.group(4), m.group(5)
-				
-				if re.search(r"Passed House|House Agreed to", motion, re.I):
-					passfail = 'pass'
-				elif re.search(r"Pass|Agreed", passfail, re.I):
-					passfail = 'pass'
-				else:
-					passfail = 'fail'
-				
-				if "Two-thirds of the Members present" in motion:
-					isoverride = True
-				
-				if isoverride:
-					votetype = "override"
-				elif re.search(r"(agree (with an amendment )?to|concur in) the Senate amendment", line, re.I):
-					votetype = "pingpong"
-				elif re.search("conference report", line, re.I):
-					votetype = "conference"
-				elif bill_type[0] == "h":
-					votetype = "vote"
-				else:
-					votetype = "vote2"
-				
-				roll = None
-				m = re.search(r"\((Roll no\.|Record Vote No:) (\d+)\)", how, re.I)
-				if m != None:
-					roll = m.group(2)
-
-				suspension = None
-				if roll and "On motion to suspend the rules" in motion:
-					suspension = True
-
-				attrs["nodename"] = "vote"
-				attrs["votetype"] = votetype
-				attrs["how"] = how
-				if roll:
-					attrs["roll"] = roll
-
-				# get the new state of the bill after this vote
-				new_state = get_vote_resulting_state(votetype, "h", passfail=="pass", bill_type, suspension, asamended, title, prev_state)
-				if new_state:
-					attrs["state"] = new_state
-					
-			m = re.search(r"Passed House pursuant to", line, re.I)
-			if m != None:
-				votetype = "vote" if (bill_type[0] == "h") else "vote2"
-				attrs["nodename"] = "vote"
-				attrs["votetype"] = votetype
-				attrs["how"] = "by special rule"
-
-				# get the new state of the bill after this vote
-				new_state = get_vote_resulting_state(votetype, "h", passfail=="pass", bill_type, False, False, title, prev_state)
-				
-				if new_state:
-					attrs["state"] = new_state
-			
-			# A Senate Vote
-			m = re.search(r"(Passed Senate|Failed of passage in Senate|Resolution agreed to in Senate|Received in the Senate, considered, and agreed to|Submitted in the Senate, considered, and agreed to|Introduced in the Senate, read twice, considered, read the third time, and passed|Received in the Senate, read twice, considered, read the third time, and passed|Senate agreed to conference report|Cloture \S*\s?on the motion to proceed .*?not invoked in Senate|Cloture on the bill not invoked in Senate|Cloture on the bill invoked in Senate|Cloture on the motion to proceed to the bill invoked in Senate|Cloture on the motion to proceed to the bill not invoked in Senate|Senate agreed to House amendment|Senate concurred in the House amendment)(,?.*,?) (without objection|by Unanimous Consent|by Voice Vote|by Yea-Nay( Vote)?\. \d+\s*-\s*\d+\. Record Vote (No|Number): \d+)", line, re.I)
-			if m != None:
-				motion, extra, how = m.group(1), m.group(2), m.group(3)
-				roll = None
-				
-				if re.search("passed|agreed|concurred|bill invoked", motion, re.I):
-					passfail = "pass"
-				else:
-					passfail = "fail"
-					
-				votenodename = "vote"
-				if re.search("over veto", extra, re.I):
-					votetype = "override"
-				elif re.search("conference report", motion, re.I):
-					votetype = "conference"
-				elif re.search("cloture", motion, re.I):
-					votetype = "cloture"
-					votenodename = "vote-aux" # because it is not a vote on passage
-				elif re.search("Senate agreed to House amendment|Senate concurred in the House amendment", motion, re.I):
-					votetype = "pingpong"
-				elif bill_type[0] == "s":
-					votetype = "vote"
-				else:
-					votetype = "vote2"
-					
-				m = re.search(r"Record Vote (No|Number): (\d+)", how, re.I)
-				if m != None:
-					roll = m.group(2)
-					how = "roll"
-					
-				asamended = False
-				if re.search(r"with amendments|with an amendment", extra, re.I):
-					asamended = True
-					
-				attrs["nodename"] = votenodename
-				attrs["votetype"] = votetype
-				attrs["how"] = how
-				if roll:
-					attrs["roll"] = roll
-
-				# get the new state of the bill after this vote
-				new_state = get_vote_resulting_state(votetype, "s", passfail=="pass", bill_type, False, asamended, title, prev_state)
-				
-				if new_state:
-					attrs["state"] = new_state
-					
-			# TODO: Make a new state for this as pre-reported.
-			m = re.search(r"Placed on (the )?([\w ]+) Calendar( under ([\w ]+))?[,\.] Calendar No\. (\d+)\.|Committee Agreed to Seek Consideration Under Suspension of the Rules|Ordered to be Reported", line, re.I)
-			if m != None:
-				# TODO: This makes no sense.
-				if prev_state in ("INTRODUCED", "REFERRED"):
-					attrs["state"] = "REPORTED"
-				
-				attrs["nodename"] = "calendar"
-				
-				# TODO: Useless.
-				attrs["calendar"] = m.group(2)
-				attrs["under"] = m.group(4)
-				attrs["number"] = m.group(5)
-			
-			m = re.search(r"Committee on (.*)\. Reported by", line, re.I)
-			if m != None:
-				attrs["nodename"] = "reported"
-				attrs["committee"] = m.group(1)
-				if prev_state in ("INTRODUCED", "REFERRED"):
-					attrs["state"] = "REPORTED"
-				
-			m = re.search(r"Committee on (.*)\. Discharged (by Unanimous Consent)?", line, re.I)
-			if m != None:
-				attrs["committee"] = m.group(1)
-				attrs["nodename"] = "discharged"
-				if prev_state in ("INTRODUCED", "REFERRED"):
-					attrs["state"] = "REPORTED"
-					
-			m = re.search("Cleared for White House|Presented to President", line, re.I)
-			if m != None:
-				attrs["nodename"] = "topresident"
-				
-			m = re.search("Signed by President", line, re.I)
-			if m != None:
-				attrs["nodename"] = "signed"
-				
-			m = re.search("Pocket Vetoed by President", line, re.I)
-			if m != None:
-				attrs["nodename"] = "vetoed"
-				attrs["pocket"] = "1"
-				attrs["state"] = "VETOED:POCKET"
-				
-			m = re.search("Vetoed by President", line, re.I)
-			if m != None:
-				attrs["nodename"] = "vetod"
-				attrs["state"] = "PROV_KILL:VETO'"
-				
-			m = re.search("Became (Public|Private) Law No: ([\d\-]+)\.", line, re.I)
-			if m != None:
-				attrs["nodename"] = "enacted"
-				if prev_state != "PROV_KILL:VETO" and not prev_state.startswith("VETOED:"):				
-					attrs["state"] = "ENACTED:SIGNED"
-				else:
-					attrs["state"] = "ENACTED:VETO_OVERRIDE"
-				
-			m = re.search(r"Referred to (the )?((House|Senate|Committee) [^\.]+).?", line, re.I)
-			if m != None:
-				attrs["nodename"] = "referral"
-				attrs["committee"] = m.group(2)
-				if prev_state == "INTRODUCED":
-					attrs["state"] = "REFERRED"
-				
-			m = re.search(r"Referred to the Subcommittee on (.*[^\.]).?", line, re.I)
-			if m != None:
-				attrs["nodename"] = "referral"
-				attrs["subcommittee"] = m.group(1)
-				if prev_state == "INTRODUCED":
-					attrs["state"] = "REFERRED"
-				
-			m = re.search(r"Received in the Senate and referred to (the )?(.*[^\.]).?", line, re.I)
-			if m != None:
-				attrs["nodename"] = "referral"
-				attrs["committee"] = m.group(2)
-				
+	line = line.replace(", the Passed", ", Passed") # 106 h4733 and others
+
+	# Find every keyword in the line, including ones that overlap.
+	lline = line.lower()
+	selected = set()
+	m = action_keyword_scanner.search(lline)
+	while m != None:
+		selected.update(action_keyword_dispatch[m.group(0)])
+		m = action_keyword_scanner.search(lline, m.start() + 1)
+
+	for i in sorted(selected):
+		keywords, pattern, handler = action_rules[i]
+		m = pattern.search(line)
+		if m != None:
+			handler(m, attrs, line, bill_type, prev_state, title)
+
 	return attrs
 
 	# # REFORMAT
@@ -1182,17 +2159,23 @@ committee_map = None
 def find_committee(committee, subcommittee, congress):
 	global committee_map
 	if committee_map == None:
-		committee_map = { }
+		# Build the map fully before publishing it so that other worker threads
+		# never see a partially loaded map.
+		cmap = { }
 		root = etree.parse("../data/us/committees.xml")
 		for c in root.xpath("committee"):
 			for d in c.xpath("thomas-names/name"):
-				committee_map[d.get("session") + ":" + d.text] = c.get("code")
+				cmap[d.get("session") + ":" + d.text] = c.get("code")
 				for s in c.xpath("subcommittee"):
 					for e in c.xpath("thomas-names/name"):
-						committee_map[d.get("session") + ":" + d.text + ":" + e.text] = c.get("code") + s.get("code")
+						cmap[d.get("session") + ":" + d.text + ":" + e.text] = c.get("code") + s.get("code")
+		committee_map = cmap
 	return committee_map[str(congress) + ":" + committee + (": " + subcommittee if subcommittee else "")]
 
 if __name__ == "__main__":
-	#update_bills(112, True)
-	print parse_bill(112, "h", 1)
+	if len(sys.argv) > 1 and sys.argv[1] == "backfill":
+		backfill_main(sys.argv[2:])
+	else:
+		#update_bills(112, True)
+		print parse_bill(112, "h", 1)
 	
@@ -1,8 +1,14 @@
-import os, os.path
+import os, os.path, sys, re, htmlentitydefs
 import base64, hashlib
-from pytz import timezone
 import datetime, time
-import urllib, urllib2, urlparse
+import urllib, urllib2, urlparse, httplib, socket
+import threading, Queue, codecs, itertools, random, email.utils
+
+from mirror import FileMirror
+
+# datetime.strptime imports this module the first time it is called, which can
+# fail if two threads call it at once (Python issue 7980), so import it now.
+import _strptime
 
 # based on http://effbot.org/zone/re-sub.htm#unescape-html, with changes
 #
@@ -13,101 +19,662 @@ import urllib, urllib2, urlparse
 #
 # Accept a charset argument with which to decode numeric entities since the code
 # points are relative to the character set.
+#
+# Replacements are looked up in a table per charset, which starts out with all
+# of the named entities and gains numeric references as they are seen.
+entity_re = re.compile("(&#?\w+;)")
+xml_special_characters = { u"&": "&amp;", u"<": "&lt;", u">": "&gt;", u"\"": "&quot;", u"'": "&apos;" }
+named_entities = dict(("&%s;" % name, xml_special_characters.get(unichr(codepoint), unichr(codepoint))) for name, codepoint in htmlentitydefs.name2codepoint.items())
+entity_tables = { }
+
 def unescape(text, charset="utf-8"):
-	import re, htmlentitydefs
+	if "&" not in text:
+		return text
 	
-	if charset.lower() in ("iso-8859-1", "windows-1252"):
-		def decode_char(num):
-			return chr(num).decode(charset)
-	else:
-		decode_char = unichr
+	charset = charset.lower()
+	table = entity_tables.get(charset)
+	if table == None:
+		table = entity_tables.setdefault(charset, dict(named_entities))
 	
-	def fixup(m):
-		text = m.group(0)
-		if text[:2] == "&#":
-			# numeric character reference
-			try:
-				if text[:3] == "&#x":
-					text = decode_char(int(text[3:-1], 16))
-				else:
-					text = decode_char(int(text[2:-1]))
-			except ValueError:
-				pass # leave as is
-		else:
-			# named entity
-			try:
-				text = unichr(htmlentitydefs.name2codepoint[text[1:-1]])
-			except KeyError:
-				pass # leave as is
+	# Splitting on the pattern puts the references at the odd indexes.
+	parts = entity_re.split(text)
+	lookup = table.get
+	replacements = [lookup(ref) for ref in parts[1::2]]
+	if None in replacements:
+		for i, ref in enumerate(parts[1::2]):
+			if replacements[i] == None:
+				replacements[i] = unescape_reference(ref, charset)
+				if ref[1] == "#":
+					table[ref] = replacements[i]
+	parts[1::2] = replacements
+	return "".join(parts)
+
+def unescape_reference(ref, charset):
+	"""Returns the replacement for a reference not in the entity tables."""
+	if ref[:2] == "&#":
+		# numeric character reference
+		try:
+			if ref[:3] == "&#x":
+				num = int(ref[3:-1], 16)
+			else:
+				num = int(ref[2:-1])
+			if charset in ("iso-8859-1", "windows-1252"):
+				text = chr(num).decode(charset)
+			else:
+				text = unichr(num)
+		except (ValueError, OverflowError):
+			return ref # leave as is
 		
 		# re-encode XML special characters
-		if text == "&": text = "&amp;"
-		if text == "<": text = "&lt;"
-		if text == ">": text = "&gt;"
-		if text == "\"": text = "&quot;"
-		if text == "'": text = "&apos;"
-		
-		return text
-	return re.sub("&#?\w+;", fixup, text)
+		return xml_special_characters.get(text, text)
+	
+	# unknown named entity, leave as is
+	return ref
+
+
+# Pages in the mirror are normally used forever once downloaded. If mirror_ttl
+# is set to a number of seconds, a page fetched longer ago than that is checked
+# with the server again. The request is made conditional on the ETag and
+# Last-Modified headers saved with the page, so that if the page is unchanged
+# the server answers 304 Not Modified with no body and the mirrored copy is kept.
+mirror_ttl = None
 
+# The backend that mirrored pages are stored in. See mirror.py.
+mirror = FileMirror("../mirror")
 
-def download(url, args=None, method="GET", binary=False, default_charset="iso-8859-1", mirror_key=None, mirror_base=None):
+def set_mirror(backend):
+	"""Stores mirrored pages in backend, e.g. a mirror.ShardedMirror, from now on."""
+	global mirror
+	mirror = backend
+
+def download(url, args=None, method="GET", binary=False, default_charset="iso-8859-1", mirror_key=None, mirror_base=None, lines=False):
+	"""Returns the content of the page at url, from the mirror if it is there, and
+	its last modified time. Text pages are decoded to unicode with line endings
+	normalized to \n, and in HTML pages entity references are replaced.
+	
+	If lines is True, the content is returned as an iterator over its lines (as
+	split by \n) instead, or None if the page is empty. A page that is not in the
+	mirror is then decoded chunk by chunk as it arrives, and saved to the mirror
+	when the iterator has been used up or discarded."""
+	
 	# Try to load from our local mirror directory.
 	if mirror_key == None:
 		mirror_key = md5_base64(url + ("?" + urllib.urlencode(args).encode("utf8") if args != None else ""))
 	if mirror_base == None:
 		mirror_base = urlparse.urlparse(url).hostname
-	mirror_file = "../mirror/%s/%s" % (mirror_base, mirror_key)
-	try:
-		os.makedirs(os.path.dirname(mirror_file))
-	except:
-		pass
-	if os.path.exists(mirror_file):
-		with open(mirror_file, "r") as f:
-			format = f.readline().strip()
-			content = f.read()
-		if format == "utf8":
-			content = content.decode("utf8")
-		st = os.stat(mirror_file)
-		return content, datetime.datetime.fromtimestamp(st.st_mtime) # return content and last modified time of file
+	store = mirror
+	record = store.get(mirror_base, mirror_key)
+	meta = { }
+	if record != None:
+		if mirror_ttl == None:
+			return read_mirror_record(record[0], record[1], lines)
+		# Pages mirrored before metadata was kept were fetched when they were
+		# last modified.
+		meta = store.get_meta(mirror_base, mirror_key)
+		if time.time() - meta.get("fetched", record[1]) < mirror_ttl:
+			return read_mirror_record(record[0], record[1], lines)
 	
 	# Form URL.
-	if method == "GET" and args != None:
-		url += "?" + urllib.urlencode(args).encode("utf8")
+	data = None
+	if args != None:
+		if method == "GET":
+			url += "?" + urllib.urlencode(args).encode("utf8")
+		else:
+			data = urllib.urlencode(args).encode("utf8")
 	
-	req = urllib2.Request(url)
-	r = urllib2.urlopen(req)
+	# Revalidate a stale page in the mirror.
+	headers = { }
+	if data == None and meta.get("etag"):
+		headers["If-None-Match"] = meta["etag"]
+	if data == None and meta.get("last_modified"):
+		headers["If-Modified-Since"] = meta["last_modified"]
 	
-	content = r.read()
+	try:
+		stream = http_stream(url, data, headers)
+		info = next(stream)
+	except urllib2.HTTPError as e:
+		if e.code != 304 or len(headers) == 0:
+			raise
+		# The page has not changed. Keep the mirrored copy and its modification
+		# time, but note when it was last checked.
+		meta["fetched"] = time.time()
+		if e.info().getheader("etag"):
+			meta["etag"] = e.info().getheader("etag")
+		if e.fp != None:
+			e.close()
+		store.put_meta(mirror_base, mirror_key, meta)
+		return read_mirror_record(record[0], record[1], lines)
+	
+	modified_time = time.time()
 	
 	# Decode the bytes into unicode according to whatever charset information
 	# we have. For HTML, normalize entity references into plain unicode.
-	if r.info().gettype() in ("text/plain", "text/html") and not binary:
-		charset = r.info().getparam("charset")
+	charset, html = None, False
+	if info.gettype() in ("text/plain", "text/html") and not binary:
+		charset = info.getparam("charset")
 		if charset == None:
 			charset = default_charset
+		html = info.gettype() == "text/html"
+	
+	def save(format, content):
+		store.put(mirror_base, mirror_key, format + "\n" + content, modified_time)
+		store.put_meta(mirror_base, mirror_key, {
+			"url": url,
+			"etag": info.getheader("etag"),
+			"last_modified": info.getheader("last-modified"),
+			"fetched": modified_time,
+			})
+	
+	if lines:
+		return nonempty_lines(stream_lines(stream, charset, html, save)), datetime.datetime.fromtimestamp(modified_time)
+	
+	content = "".join(stream)
+	if charset != None:
 		content = content.decode(charset)
-		if r.info().gettype() == "text/html":
+		if html:
 			content = unescape(content, charset.lower())
 	
 	# normalize line endings
 	content = content.replace("\r\n", "\n")
 	content = content.replace("\r", "\n")
 	
-	modified_time = time.time()
-
-	f = open(mirror_file, "w")
 	if type(content) == str:
-		f.write("binary\n")
-		f.write(content)
+		save("binary", content)
 	else:
-		f.write("utf8\n")
-		f.write(content.encode("utf8"))
-	f.close()
-	os.utime(mirror_file, (modified_time, modified_time))
+		save("utf8", content.encode("utf8"))
 
 	return content, datetime.datetime.fromtimestamp(modified_time)
 
+def read_mirror_record(data, mtime, lines=False):
+	mtime = datetime.datetime.fromtimestamp(mtime) # the last modified time of the page
+	format, newline, content = data.partition("\n")
+	if lines:
+		return nonempty_lines(record_lines(data, len(format) + 1, format.strip() == "utf8")), mtime
+	if format.strip() == "utf8":
+		content = content.decode("utf8")
+	return content, mtime
+
+def record_lines(data, start, utf8):
+	"""Yields the lines of the content in a mirror record starting at start, one
+	at a time, so that the content is not split or decoded all at once."""
+	while True:
+		end = data.find("\n", start)
+		line = data[start:end] if end >= 0 else data[start:]
+		yield line.decode("utf8") if utf8 else line
+		if end < 0:
+			break
+		start = end + 1
+
+def stream_lines(chunks, charset, html, save):
+	"""Yields the lines of a page as its chunks arrive, decoded from charset (if not
+	None), with entity references replaced if html is True, and then calls save
+	with the format and the whole content encoded for the mirror. If the caller
+	stops early, the rest of the page is read anyway so that it can be saved."""
+	
+	# The content for the mirror is kept encoded, which takes much less memory
+	# than the decoded lines.
+	content = []
+	
+	def decoded_lines():
+		decoder = codecs.getincrementaldecoder(charset)() if charset != None else None
+		pending = "" # text not yet unescaped, from the end of the last complete line
+		carry = "" # a \r that may be the start of a \r\n
+		partial = "" # the start of the line being read
+		while True:
+			chunk = next(chunks, None)
+			if chunk != None:
+				pending += decoder.decode(chunk) if decoder != None else chunk
+				# Entity references do not span lines, so everything up to the last
+				# line break can be unescaped now.
+				cut = max(pending.rfind("\n"), pending.rfind("\r")) + 1
+				if cut == 0:
+					continue
+				text, pending = pending[0:cut], pending[cut:]
+			else:
+				if decoder != None:
+					pending += decoder.decode("", True)
+				text, pending = pending, ""
+			
+			if html and "&" in text:
+				text = unescape(text, charset.lower())
+			text = carry + text
+			carry = ""
+			if chunk != None and text.endswith("\r"):
+				text, carry = text[0:-1], "\r"
+			
+			# normalize line endings
+			text = text.replace("\r\n", "\n")
+			text = text.replace("\r", "\n")
+			content.append(text.encode("utf8") if charset != None else text)
+			
+			lines = (partial + text).split("\n")
+			if chunk == None:
+				for line in lines:
+					yield line
+				return
+			partial = lines.pop()
+			for line in lines:
+				yield line
+	
+	chunks = iter(chunks)
+	lines = decoded_lines()
+	try:
+		for line in lines:
+			yield line
+	except GeneratorExit:
+		for line in lines:
+			pass
+	save("utf8" if charset != None else "binary", "".join(content))
+
+def nonempty_lines(lines):
+	"""Returns an iterator over lines, which always yields at least one line as
+	str.split does, or None if it yields only one empty line."""
+	first = next(lines)
+	if first == "":
+		try:
+			second = next(lines)
+		except StopIteration:
+			return None
+		return itertools.chain((first, second), lines)
+	return itertools.chain((first,), lines)
+
+# Network settings. With persistent_connections, requests are made over
+# keep-alive connections that are pooled and reused for later requests to the
+# same host, instead of opening a new connection for each page with urllib2.
+# http_proxy is the URL of a proxy to make http requests through, such as
+# mirror_server.py, e.g. "http://localhost:8080"; limits on concurrency and
+# rates still apply to the hosts being requested.
+http_timeout = 120 # seconds
+persistent_connections = False
+http_proxy = None
+max_idle_connections = 8 # per host
+connection_pool = { } # (scheme, host, port) => list of idle connections
+connection_pool_lock = threading.Lock()
+
+def http_fetch(url, data=None, headers={ }):
+	"""Requests url, POSTing data if it is not None, and returns the response
+	headers (a mimetools.Message) and body. Error responses, and 304 Not Modified
+	responses to conditional requests, raise urllib2.HTTPError."""
+	stream = http_stream(url, data, headers)
+	info = next(stream)
+	return info, "".join(stream)
+
+def http_stream(url, data=None, headers={ }, chunk_size=65536):
+	"""Requests url like http_fetch, but returns a generator that yields the
+	response headers and then the body in chunks as it arrives. Errors are raised
+	when getting the headers, after any retries (see download_retries). The
+	request holds a slot for its host only while it is waiting on the server, not
+	while the caller has the headers or a chunk, so that a caller that makes
+	other requests to the host while reading the body doesn't hold up its own."""
+	host = urlparse.urlparse(url).hostname
+	limiters = rate_limiters(host)
+	attempt = 0
+	while True:
+		with host_slot(host):
+			for limiter in limiters:
+				limiter.take()
+			start = time.time()
+			try:
+				if not persistent_connections and http_proxy != None:
+					r = urllib2.build_opener(urllib2.ProxyHandler({ "http": http_proxy })).open(urllib2.Request(url, data, headers), timeout=http_timeout)
+					info = r.info()
+					release = lambda complete : r.close()
+				elif not persistent_connections:
+					r = urllib2.urlopen(urllib2.Request(url, data, headers), timeout=http_timeout)
+					info = r.info()
+					release = lambda complete : r.close()
+				else:
+					r, release = pooled_open(url, data, headers)
+					info = r.msg
+			except (urllib2.URLError, httplib.HTTPException, socket.error) as e:
+				overloaded = isinstance(e, urllib2.HTTPError) and e.code in overload_statuses
+				transient = overloaded or not isinstance(e, urllib2.HTTPError)
+				if overloaded or time.time() - start >= slow_response:
+					for limiter in limiters:
+						limiter.backoff()
+				delay = retry_delay * 2**attempt * random.uniform(0.5, 1.5)
+				if isinstance(e, urllib2.HTTPError) and retry_after(e) != None:
+					delay = retry_after(e)
+					for limiter in limiters:
+						limiter.pause(delay)
+				if not transient or attempt >= download_retries or delay > max_retry_after:
+					raise
+				# Free the error response's connection before trying again.
+				if isinstance(e, urllib2.HTTPError) and e.fp != None:
+					e.close()
+			else:
+				for limiter in limiters:
+					if time.time() - start >= slow_response:
+						limiter.backoff()
+					else:
+						limiter.success()
+				break
+		
+		# Wait outside of the host slot so that other requests can go ahead.
+		attempt += 1
+		time.sleep(delay)
+	
+	complete = False
+	try:
+		yield info
+		while True:
+			with host_slot(host):
+				chunk = r.read(chunk_size)
+			if not chunk:
+				break
+			yield chunk
+		complete = True
+	finally:
+		release(complete)
+
+def pooled_open(url, data=None, headers={ }, redirects=5):
+	"""Requests url on a pooled connection, following redirects, and returns the
+	response with its body unread, and a function to call when done with it,
+	passing whether the body was read completely so the connection can be reused."""
+	u = urlparse.urlparse(url)
+	key = (u.scheme, u.hostname, u.port)
+	path = u.path if u.path else "/"
+	if u.query:
+		path += "?" + u.query
+	if http_proxy != None and u.scheme == "http":
+		# Ask the proxy for the whole URL.
+		p = urlparse.urlparse(http_proxy)
+		key = ("http", p.hostname, p.port)
+		path = "http://" + u.netloc + path
+	request_headers = dict(headers)
+	if data != None:
+		request_headers["Content-Type"] = "application/x-www-form-urlencoded"
+	
+	while True:
+		conn, reused = get_connection(key)
+		try:
+			conn.request("GET" if data == None else "POST", path, data, request_headers)
+			r = conn.getresponse()
+		except (httplib.HTTPException, socket.error):
+			conn.close()
+			# The server may have closed an idle connection since we last used
+			# it, in which case try again on a new connection.
+			if reused:
+				continue
+			raise
+		break
+	
+	def release(complete):
+		if complete and not r.will_close:
+			release_connection(key, conn)
+		else:
+			conn.close()
+	
+	if r.status in (301, 302, 303, 307) and r.getheader("location") and redirects > 0:
+		r.read()
+		release(True)
+		return pooled_open(urlparse.urljoin(url, r.getheader("location")), data if r.status == 307 else None, headers, redirects-1)
+	if r.status < 200 or r.status >= 300:
+		r.read()
+		release(True)
+		raise urllib2.HTTPError(url, r.status, r.reason, r.msg, None)
+	return r, release
+
+def get_connection(key):
+	"""Returns an idle connection to the (scheme, host, port) in key, or a new
+	one, and whether the connection is being reused."""
+	with connection_pool_lock:
+		idle = connection_pool.get(key)
+		if idle:
+			return idle.pop(), True
+	scheme, host, port = key
+	if scheme == "https":
+		return httplib.HTTPSConnection(host, port, timeout=http_timeout), False
+	return httplib.HTTPConnection(host, port, timeout=http_timeout), False
+
+def release_connection(key, conn):
+	with connection_pool_lock:
+		idle = connection_pool.setdefault(key, [])
+		if len(idle) < max_idle_connections:
+			idle.append(conn)
+			return
+	conn.close()
+
+# download_async runs downloads on a shared pool of threads, so that any number
+# of requests can be outstanding without a thread for each.
+download_pool = None
+download_pool_size = 16
+download_pool_lock = threading.Lock()
+
+def download_async(url, args=None, method="GET", binary=False, default_charset="iso-8859-1", mirror_key=None, mirror_base=None):
+	"""Starts downloading url as with download, returning a Future whose
+	result() is download's (content, modified time)."""
+	global download_pool
+	with download_pool_lock:
+		if download_pool == None:
+			download_pool = WorkerPool(download_pool_size, max_pending=0)
+	return download_pool.submit(download, url, args=args, method=method, binary=binary, default_charset=default_charset, mirror_key=mirror_key, mirror_base=mirror_base)
+
+# Limits on the number of simultaneous downloads from any one host, so that
+# a pool of workers doesn't hammer the remote server. Hosts not listed use
+# default_host_concurrency. None means no limit.
+host_concurrency = { }
+default_host_concurrency = None
+host_semaphores = { }
+host_semaphores_lock = threading.Lock()
+
+def set_host_concurrency(limit, host=None):
+	"""Sets the maximum number of simultaneous downloads from host, or the
+	default for all hosts if host is None."""
+	global default_host_concurrency
+	with host_semaphores_lock:
+		if host == None:
+			default_host_concurrency = limit
+			host_semaphores.clear()
+		else:
+			host_concurrency[host] = limit
+			host_semaphores.pop(host, None)
+
+class host_slot(object):
+	"""A context manager that holds one of the download slots for a host
+	while a request is in progress."""
+	def __init__(self, host):
+		with host_semaphores_lock:
+			if host not in host_semaphores:
+				limit = host_concurrency.get(host, default_host_concurrency)
+				host_semaphores[host] = threading.BoundedSemaphore(limit) if limit != None else None
+			self.semaphore = host_semaphores[host]
+	def __enter__(self):
+		if self.semaphore != None:
+			self.semaphore.acquire()
+	def __exit__(self, type, value, traceback):
+		if self.semaphore != None:
+			self.semaphore.release()
+
+class TokenBucket(object):
+	"""Lets take() be called rate times per second on average, and up to burst
+	times at once after a pause. Callers wait their turn in the order they
+	arrive.
+	
+	The rate adapts to how the server is coping: backoff() cuts it by
+	backoff_factor, and each success() adds back recovery_step of the
+	configured rate, up to the configured rate. pause() holds all callers
+	back for a time, e.g. as long as a Retry-After header asks."""
+	def __init__(self, rate, burst=1):
+		self.max_rate = float(rate)
+		self.rate = self.max_rate
+		self.burst = burst
+		self.tokens = burst
+		self.stamp = time.time()
+		self.not_before = 0
+		self.lock = threading.Lock()
+	def take(self):
+		"""Takes a token, first waiting until one is available."""
+		with self.lock:
+			now = time.time()
+			start = max(now, self.not_before)
+			self.tokens = min(self.burst, self.tokens + (start - self.stamp) * self.rate)
+			self.stamp = start
+			self.tokens -= 1
+			# Wait for any pause to end and then, if the bucket was empty, for the
+			# token to be refilled.
+			wait = start - now + max(0, -self.tokens / self.rate)
+		if wait > 0:
+			time.sleep(wait)
+	def backoff(self):
+		with self.lock:
+			self.rate = max(self.max_rate * min_rate_fraction, self.rate * backoff_factor)
+	def success(self):
+		with self.lock:
+			self.rate = min(self.max_rate, self.rate + self.max_rate * recovery_step)
+	def pause(self, seconds):
+		with self.lock:
+			self.not_before = max(self.not_before, time.time() + seconds)
+
+# Limits on the rate of requests, to all hosts together (rate_limiter) and to
+# particular hosts (host_rate_limiters), or None for no limit. The limits are
+# the most that is ever used. Requests are slowed down below them after a
+# response that suggests the server is overloaded: an HTTP 429 or 5xx error,
+# or headers that took slow_response seconds or more to arrive.
+rate_limiter = None
+host_rate_limiters = { }
+backoff_factor = 0.5
+recovery_step = 0.05
+min_rate_fraction = 1/64.0
+slow_response = 30 # seconds
+
+# Requests that fail with a transient error, i.e. a network error or an HTTP
+# 429 or 5xx response, are retried up to download_retries times, after
+# retry_delay seconds and then twice as long as the last time, randomly
+# shortened or lengthened by up to half so that workers don't retry in step.
+# A Retry-After header is honored if it asks for no more than max_retry_after
+# seconds.
+download_retries = 4
+retry_delay = 1.0 # seconds
+max_retry_after = 300 # seconds
+overload_statuses = (429, 500, 502, 503, 504)
+
+def set_rate_limit(rate, burst=1, host=None):
+	"""Limits requests to host, or to all hosts together if host is None, to
+	rate per second on average, with up to burst at once. A rate of None
+	removes the limit."""
+	global rate_limiter
+	limiter = TokenBucket(rate, burst) if rate != None else None
+	if host == None:
+		rate_limiter = limiter
+	elif limiter != None:
+		host_rate_limiters[host] = limiter
+	else:
+		host_rate_limiters.pop(host, None)
+
+def rate_limiters(host):
+	return [limiter for limiter in (rate_limiter, host_rate_limiters.get(host)) if limiter != None]
+
+def retry_after(e):
+	"""Returns the number of seconds the Retry-After header of an HTTPError asks
+	the client to wait, or None."""
+	value = e.info().getheader("retry-after") if e.info() != None else None
+	if not value:
+		return None
+	try:
+		return max(0, int(value))
+	except ValueError:
+		date = email.utils.parsedate_tz(value)
+		if date == None:
+			return None
+		return max(0, email.utils.mktime_tz(date) - time.time())
+
+class Future(object):
+	"""The eventual result of a call submitted to a WorkerPool."""
+	def __init__(self):
+		self.event = threading.Event()
+		self.value = None
+		self.exc_info = None
+	def set_result(self, value):
+		self.value = value
+		self.event.set()
+	def set_exception(self, exc_info):
+		self.exc_info = exc_info
+		self.event.set()
+	def done(self):
+		return self.event.is_set()
+	def result(self):
+		"""Waits for the call to complete and returns its return value, or
+		re-raises the exception it raised."""
+		self.event.wait()
+		if self.exc_info != None:
+			raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+		return self.value
+
+class WorkerPool(object):
+	"""A fixed number of threads that run submitted calls. With one worker
+	(or fewer), calls are run immediately in the calling thread instead. At
+	most max_pending calls wait in the queue before submit() blocks, which
+	keeps a fast producer from running too far ahead of the workers; zero
+	means no limit."""
+	
+	def __init__(self, workers, max_pending=None):
+		self.workers = workers
+		self.threads = []
+		if workers <= 1:
+			return
+		if max_pending == None:
+			max_pending = workers * 4
+		self.queue = Queue.Queue(max_pending)
+		for i in xrange(workers):
+			t = threading.Thread(target=self.run)
+			t.daemon = True
+			t.start()
+			self.threads.append(t)
+	
+	def submit(self, func, *args, **kwargs):
+		future = Future()
+		if not self.threads:
+			WorkerPool.call(future, func, args, kwargs)
+		else:
+			self.queue.put((future, func, args, kwargs))
+		return future
+	
+	def join(self):
+		"""Waits until all submitted calls have completed."""
+		if self.threads:
+			self.queue.join()
+	
+	def close(self):
+		"""Waits for submitted calls to complete and stops the threads."""
+		self.join()
+		for t in self.threads:
+			self.queue.put(None)
+		for t in self.threads:
+			t.join()
+		self.threads = []
+	
+	def run(self):
+		while True:
+			item = self.queue.get()
+			try:
+				if item == None:
+					return
+				WorkerPool.call(*item)
+			finally:
+				self.queue.task_done()
+	
+	@staticmethod
+	def call(future, func, args, kwargs):
+		try:
+			future.set_result(func(*args, **kwargs))
+		except:
+			future.set_exception(sys.exc_info())
+
+def write_file_atomic(path, chunks):
+	"""Writes a string, or each string from an iterable of them, to a temporary
+	file next to path and then renames it over path, so that readers (and a run
+	that is interrupted) see either the old file or the complete new one."""
+	tmp = path + ".tmp"
+	with open(tmp, "wb") as f:
+		if isinstance(chunks, basestring):
+			chunks = [chunks]
+		for chunk in chunks:
+			f.write(chunk)
+		f.flush()
+		os.fsync(f.fileno())
+	os.rename(tmp, path)
+
 def warn(text):
 	print text.encode("utf8")
 
@@ -116,8 +683,34 @@ def md5_base64(text):
 	m.update(text.encode("utf-8"))
 	return base64.b64encode(m.digest())
 
+def md5_base64_lines(lines):
+	"""Returns the md5_base64 of lines, each followed by a newline."""
+	m = hashlib.md5()
+	for line in lines:
+		m.update(line.encode("utf-8"))
+		m.update("\n")
+	return base64.b64encode(m.digest())
+
+def hashed_lines(lines, hashes, key):
+	"""Yields lines, and once they have all been read stores their
+	md5_base64_lines in hashes[key], so that a page can be hashed while it is
+	parsed."""
+	m = hashlib.md5()
+	for line in lines:
+		m.update(line.encode("utf-8"))
+		m.update("\n")
+		yield line
+	hashes[key] = base64.b64encode(m.digest())
+
+# The US/Eastern time zone, loaded when first needed, since pytz is slow to import.
+eastern = None
+
 def format_datetime(v):
+	global eastern
 	if type(v) == datetime.datetime:
-		v = v.replace(microsecond=0, tzinfo=timezone("US/Eastern"))
+		if eastern == None:
+			from pytz import timezone
+			eastern = timezone("US/Eastern")
+		v = v.replace(microsecond=0, tzinfo=eastern)
 	return v.isoformat()
 